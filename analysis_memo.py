@@ -0,0 +1,86 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+# Import local modules
+import config
+import database as db
+import result_cache
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Hit/miss counters for this process
+_stats = {"hits": 0, "misses": 0, "stored": 0}
+_stats_lock = threading.Lock()
+_last_eviction = 0.0
+
+def _normalize(value):
+    """Collapse whitespace in strings so cosmetic differences map to the same key"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+def _templates():
+    """Prompt template of each kind of Claude call: one image per request, or several packed together"""
+    return {"single": config.CLAUDE_PROMPT_TEMPLATE, "packed": config.CLAUDE_PACKED_PROMPT_TEMPLATE}
+
+def config_hash(prompt="single"):
+    """Fingerprint of the model and the prompt template used; memo entries from other settings are stale"""
+    fingerprint = f"{config.DEFAULT_CLAUDE_MODEL}\0{prompt}\0{_templates()[prompt]}"
+    return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+
+def memo_key(filtered_results, prompt="single"):
+    """Key of a Claude call: model, prompt template ("single" or "packed") and the normalized filtered search results"""
+    normalized = [
+        {field: _normalize(value) for field, value in match.items()}
+        for match in filtered_results
+    ]
+    payload = json.dumps(normalized, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f"{config_hash(prompt)}\0{payload}".encode('utf-8')).hexdigest()
+
+def lookup(key):
+    """Get the memoized analysis for a key, or None"""
+    if not config.CLAUDE_MEMO_ENABLED:
+        return None
+
+    analysis = db.get_memoized_analysis(key, time.time() - config.CLAUDE_MEMO_TTL)
+
+    with _stats_lock:
+        _stats["hits" if analysis else "misses"] += 1
+    return analysis
+
+def store(key, analysis, prompt="single"):
+    """Memoize a successful analysis made with the given prompt template"""
+    if not config.CLAUDE_MEMO_ENABLED or not result_cache.is_cacheable_analysis(analysis):
+        return
+
+    db.save_memoized_analysis(key, config_hash(prompt), analysis)
+    with _stats_lock:
+        _stats["stored"] += 1
+
+    _maybe_evict()
+
+def _maybe_evict():
+    """Drop stale, expired and least recently used entries at most every CLAUDE_MEMO_EVICT_INTERVAL seconds"""
+    global _last_eviction
+
+    with _stats_lock:
+        if time.time() - _last_eviction < config.CLAUDE_MEMO_EVICT_INTERVAL:
+            return
+        _last_eviction = time.time()
+
+    deleted = db.evict_memoized_analyses(
+        [config_hash(prompt) for prompt in _templates()], 
+        config.CLAUDE_MEMO_TTL, 
+        config.CLAUDE_MEMO_MAX_ENTRIES
+    )
+    if deleted:
+        logger.info(f"Evicted {deleted} memoized Claude analyses")
+
+def get_memo_stats():
+    """Get this process's memo counters"""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,256 @@
+"""
+Local stand-in for the parts of the Anthropic API this app calls (Messages and Message Batches)
+
+Point ANTHROPIC_BASE_URL at it to run batch mode without an API key or cost:
+    python anthropic_standin.py serve --port 8600
+Or check the batch client code (create, poll, results, cancel) against it:
+    python anthropic_standin.py check
+"""
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Import local modules
+import config
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+BATCHES_PATH = "/v1/messages/batches"
+
+# Batches submitted to this process's stand-in, by id
+_batches = {}
+_batches_lock = threading.Lock()
+
+def _timestamp(unix_time):
+    """RFC 3339 time as the API returns it, or None"""
+    if unix_time is None:
+        return None
+    return datetime.fromtimestamp(unix_time, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def _message(text, model):
+    """A Messages API response with one text block"""
+    return {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": 0, "output_tokens": 0}
+    }
+
+def _analysis(prompt):
+    """Canned analysis text standing in for Claude's answer"""
+    return f"Stand-in analysis ({len(prompt)} prompt characters)"
+
+class _StandinRequestHandler(BaseHTTPRequestHandler):
+    """Answers the Messages and Message Batches endpoints"""
+
+    # Seconds a batch stays in progress; set by start_standin
+    batch_seconds = 1.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+
+        if self.path == "/v1/messages":
+            prompt = body["messages"][-1]["content"]
+            self._send_json(_message(_analysis(str(prompt)), body.get("model", "")))
+        elif self.path == BATCHES_PATH:
+            batch = {
+                "id": f"msgbatch_{uuid.uuid4().hex}",
+                "model": (body["requests"][0]["params"].get("model", "") if body.get("requests") else ""),
+                "requests": {request["custom_id"]: request["params"] for request in body.get("requests", [])},
+                "created_at": time.time(),
+                "cancel_initiated_at": None,
+                "ended_at": None
+            }
+            with _batches_lock:
+                _batches[batch["id"]] = batch
+            self._send_json(self._batch_json(batch))
+        elif self.path.startswith(BATCHES_PATH + "/") and self.path.endswith("/cancel"):
+            batch = self._find_batch(self.path[len(BATCHES_PATH) + 1:-len("/cancel")])
+            if batch is not None:
+                with _batches_lock:
+                    if batch["ended_at"] is None and batch["cancel_initiated_at"] is None:
+                        batch["cancel_initiated_at"] = time.time()
+                self._send_json(self._batch_json(batch))
+        else:
+            self._send_error(404, "not_found_error", f"No stand-in for POST {self.path}")
+
+    def do_GET(self):
+        if not self.path.startswith(BATCHES_PATH + "/"):
+            self._send_error(404, "not_found_error", f"No stand-in for GET {self.path}")
+            return
+
+        batch_id, _, action = self.path[len(BATCHES_PATH) + 1:].partition("/")
+        batch = self._find_batch(batch_id)
+        if batch is None:
+            return
+
+        if action == "":
+            self._send_json(self._batch_json(batch))
+        elif action == "results" and self._status(batch) == "ended":
+            lines = [json.dumps({"custom_id": custom_id, "result": result}) for custom_id, result in self._results(batch)]
+            self._send(200, "application/binary", ("\n".join(lines) + "\n").encode('utf-8'))
+        else:
+            self._send_error(404, "not_found_error", f"No results for batch {batch_id} yet")
+
+    def _find_batch(self, batch_id):
+        with _batches_lock:
+            batch = _batches.get(batch_id)
+        if batch is None:
+            self._send_error(404, "not_found_error", f"Unknown batch {batch_id}")
+        return batch
+
+    def _status(self, batch):
+        """Advance and get a batch's processing status: cancellation ends it, otherwise time does"""
+        with _batches_lock:
+            if batch["ended_at"] is None:
+                now = time.time()
+                if batch["cancel_initiated_at"] is not None:
+                    batch["ended_at"] = now
+                elif now - batch["created_at"] >= self.batch_seconds:
+                    batch["ended_at"] = batch["created_at"] + self.batch_seconds
+            if batch["ended_at"] is not None:
+                return "ended"
+            return "canceling" if batch["cancel_initiated_at"] is not None else "in_progress"
+
+    def _results(self, batch):
+        """Per request result: cancelled batches end before any request is processed"""
+        for custom_id, params in batch["requests"].items():
+            if batch["cancel_initiated_at"] is not None:
+                yield custom_id, {"type": "canceled"}
+            else:
+                prompt = str(params["messages"][-1]["content"])
+                yield custom_id, {"type": "succeeded", "message": _message(_analysis(prompt), batch["model"])}
+
+    def _batch_json(self, batch):
+        status = self._status(batch)
+        counts = {"processing": 0, "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0}
+        if status == "ended":
+            for _, result in self._results(batch):
+                counts[result["type"]] += 1
+        else:
+            counts["processing"] = len(batch["requests"])
+
+        host, port = self.server.server_address[:2]
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": status,
+            "request_counts": counts,
+            "created_at": _timestamp(batch["created_at"]),
+            "expires_at": _timestamp(batch["created_at"] + timedelta(days=1).total_seconds()),
+            "ended_at": _timestamp(batch["ended_at"]),
+            "cancel_initiated_at": _timestamp(batch["cancel_initiated_at"]),
+            "archived_at": None,
+            "results_url": f"http://{host}:{port}{BATCHES_PATH}/{batch['id']}/results" if status == "ended" else None
+        }
+
+    def _send_json(self, payload):
+        self._send(200, "application/json", json.dumps(payload).encode('utf-8'))
+
+    def _send_error(self, status, error_type, message):
+        payload = {"type": "error", "error": {"type": error_type, "message": message}}
+        self._send(status, "application/json", json.dumps(payload).encode('utf-8'))
+
+    def _send(self, status, content_type, data):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Anthropic stand-in: {format % args}")
+
+def start_standin(host="127.0.0.1", port=0, batch_seconds=1.0):
+    """Start the stand-in in a daemon thread (port 0 picks a free port); returns the server"""
+    handler = type("StandinRequestHandler", (_StandinRequestHandler,), {"batch_seconds": batch_seconds})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="anthropic-standin", daemon=True).start()
+    logger.info(f"Anthropic stand-in listening on port {server.server_address[1]}")
+    return server
+
+def _expect(condition, message):
+    if not condition:
+        raise RuntimeError(f"Batch check failed: {message}")
+
+def _wait_until_ended(batch_id, api_key, timeout=30):
+    """Poll a batch like the worker does, faster"""
+    import async_engine
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if async_engine.run_sync(async_engine.get_claude_batch_status_async(batch_id, api_key)) == "ended":
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"Batch check failed: batch {batch_id} did not end within {timeout}s")
+
+def check():
+    """Run create, poll, results and cancel of async_engine's batch client against a local stand-in"""
+    server = start_standin()
+    config.ANTHROPIC_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+    config.RATE_LIMIT_BACKEND = "memory"
+
+    # Imported after ANTHROPIC_BASE_URL is set, before any client is created
+    import async_engine
+
+    api_key = "standin-key"
+    prompts = {"image-1": "first prompt", "image-2": "second prompt"}
+
+    batch_id = async_engine.run_sync(async_engine.create_claude_batch_async(prompts, api_key))
+    status = async_engine.run_sync(async_engine.get_claude_batch_status_async(batch_id, api_key))
+    _expect(status == "in_progress", f"new batch is {status}")
+    _wait_until_ended(batch_id, api_key)
+    results = async_engine.run_sync(async_engine.get_claude_batch_results_async(batch_id, api_key))
+    _expect(set(results) == set(prompts), f"results cover {sorted(results)}")
+    print(f"create/poll/results: ok ({batch_id})")
+
+    batch_id = async_engine.run_sync(async_engine.create_claude_batch_async(prompts, api_key))
+    async_engine.run_sync(async_engine.cancel_claude_batch_async(batch_id, api_key))
+    _wait_until_ended(batch_id, api_key)
+    results = async_engine.run_sync(async_engine.get_claude_batch_results_async(batch_id, api_key))
+    _expect(results == {}, f"cancelled batch returned {sorted(results)}")
+    print(f"cancel: ok ({batch_id})")
+
+    server.shutdown()
+    return 0
+
+def main(argv=None):
+    """Command line entry point: python anthropic_standin.py serve [--port N] | check"""
+    parser = argparse.ArgumentParser(description="Local stand-in for the Anthropic API")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Serve the stand-in until interrupted")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8600)
+    serve_parser.add_argument("--batch-seconds", type=float, default=5.0, help="Seconds a batch stays in progress")
+
+    subparsers.add_parser("check", help="Exercise the batch client against an in-process stand-in")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "check":
+        return check()
+
+    server = start_standin(args.host, args.port, args.batch_seconds)
+    print(f"Set ANTHROPIC_BASE_URL=http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
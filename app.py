@@ -7,6 +7,7 @@ from datetime import datetime
 # Import local modules
 import database as db
 import processing
+import image_hosts
 import ui
 import utils
 import config
@@ -451,8 +452,14 @@ def main():
     # Run database migrations if needed
     db.migrate_db()
     
-    # Start background worker thread
-    worker_thread = processing.start_worker_thread(api_keys)
+    # Start the background worker pool (only the first call per process starts it),
+    # unless workers run in their own process
+    if config.EMBEDDED_WORKERS:
+        worker_thread = processing.start_worker_thread(api_keys)
+    
+    # Serve uploaded images to SearchAPI when hosting them ourselves
+    if config.IMAGE_HOST_BACKEND == "local":
+        image_hosts.start_image_server()
     
     # Session state initialization
     if 'user_id' not in st.session_state:
@@ -0,0 +1,399 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import mimetypes
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Import local modules
+import config
+import analysis_memo
+import clients
+import ratelimit
+import retry
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+IMGBB_URL = "https://api.imgbb.com/1/upload"
+SEARCHAPI_URL = "https://www.searchapi.io/api/v1/search"
+
+# Section marker of packed multi-image prompts, also expected in the response
+PACK_MARKER = "=== ITEM {number} ==="
+PACK_MARKER_PATTERN = re.compile(r"^[\s#*]*=+\s*ITEM\s+(\d+)\s*=+[\s*]*$", re.MULTILINE | re.IGNORECASE)
+
+# Shared event loop, running in its own daemon thread
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+# Per-provider semaphores, keyed by (loop id, provider, background)
+_semaphores = {}
+
+# Scheduling lane of the work running in the current context (see scheduler.py);
+# the pipeline sets it for each task, calls made elsewhere count as interactive
+current_lane = contextvars.ContextVar("current_lane", default="interactive")
+
+def get_loop():
+    """Get the process-wide I/O event loop, starting it on first use"""
+    global _loop, _loop_thread
+
+    with _loop_lock:
+        if _loop is None or not _loop_thread.is_alive():
+            _loop = asyncio.new_event_loop()
+            # File reads and DB writes done from the loop run on this pool
+            _loop.set_default_executor(ThreadPoolExecutor(
+                max_workers=config.ASYNC_BLOCKING_THREADS,
+                thread_name_prefix="io-engine-blocking"
+            ))
+            _loop_thread = threading.Thread(
+                target=_loop.run_forever,
+                name="io-engine-loop",
+                daemon=True
+            )
+            _loop_thread.start()
+        return _loop
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop and return a concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+def run_sync(coro, timeout=None):
+    """Run a coroutine on the shared loop and block the calling thread until it finishes"""
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync() called from the I/O engine loop; await the coroutine instead")
+    return submit(coro).result(timeout)
+
+def _semaphore(provider, background=False):
+    """Get the semaphore bounding in-flight calls to a provider (or background calls to it) on the running loop"""
+    key = (id(asyncio.get_running_loop()), provider, background)
+    if key not in _semaphores:
+        limit = config.ASYNC_CONCURRENCY[provider]
+        if background:
+            limit = max(limit - config.ASYNC_INTERACTIVE_RESERVED.get(provider, 0), 1)
+        _semaphores[key] = asyncio.Semaphore(limit)
+    return _semaphores[key]
+
+def _in_background():
+    """Check whether the current call is background work, which leaves headroom to interactive calls"""
+    return current_lane.get() == "background"
+
+@contextlib.asynccontextmanager
+async def _provider_slot(provider):
+    """Hold one in-flight call slot of a provider; background work leaves the reserved slots to interactive work"""
+    if _in_background():
+        async with _semaphore(provider, background=True), _semaphore(provider):
+            yield
+    else:
+        async with _semaphore(provider):
+            yield
+
+def filter_search_results(search_results):
+    """Get the fields Claude needs from the first 15 visual matches of a SearchAPI response"""
+    # Extract relevant information from search results
+    filtered_results = []
+    if 'visual_matches' in search_results and search_results['visual_matches']:
+        for match in search_results['visual_matches']:
+            filtered_match = {
+                'title': match.get('title', ''),
+                'source': match.get('source', ''),
+                'price': match.get('price', ''),
+                'currency': match.get('currency', ''),
+                'extracted_price': match.get('extracted_price', '')
+            }
+            filtered_results.append(filtered_match)
+
+    # Limit to first 15 results
+    return filtered_results[:15]
+
+def format_claude_prompt(filtered_results):
+    """Build the Claude prompt from filtered search results"""
+    # Convert filtered results to a JSON string to ensure we're not passing a list directly
+    filtered_results_json = json.dumps(filtered_results, indent=2)
+
+    # Format prompt with filtered results
+    return config.CLAUDE_PROMPT_TEMPLATE.format(
+        search_results=filtered_results_json
+    )
+
+def extract_message_text(message):
+    """Get the text content from a Claude response"""
+    if hasattr(message, 'content') and message.content:
+        # If content is a list of blocks, extract text from them
+        if isinstance(message.content, list):
+            full_text = ""
+            for block in message.content:
+                if hasattr(block, 'text'):
+                    full_text += block.text + "\n\n"
+                elif isinstance(block, dict) and 'text' in block:
+                    full_text += block['text'] + "\n\n"
+            return full_text.strip()
+        # If content is a string, return it directly
+        elif isinstance(message.content, str):
+            return message.content
+        # If content is a single block object, extract its text
+        elif hasattr(message.content, 'text'):
+            return message.content.text
+        # Last resort: convert whatever we got to string
+        return str(message.content)
+
+    return "Analysis unavailable: No content in response"
+
+async def upload_to_imgbb_async(image, api_key):
+    """
+    Upload image to ImgBB and return the URL
+
+    The image goes as a binary multipart field rather than base64 text. It may
+    be the raw bytes or the path of the image file, which is then streamed
+    from disk in chunks instead of being loaded whole.
+    """
+    payload = {
+        'key': api_key,
+        'expiration': str(config.IMGBB_EXPIRATION)
+    }
+
+    async def send():
+        await ratelimit.acquire("imgbb", api_key, background=_in_background())
+        async with _provider_slot("imgbb"):
+            client = clients.get_http_client("imgbb")
+            if isinstance(image, (bytes, bytearray)):
+                response = await client.post(IMGBB_URL, data=payload, files={'image': ('image', image)})
+            else:
+                # Reopened on every attempt, since a retry needs the stream from the start
+                with open(image, 'rb') as image_file:
+                    files = {'image': (os.path.basename(image), image_file, mimetypes.guess_type(image)[0])}
+                    response = await client.post(IMGBB_URL, data=payload, files=files)
+        retry.raise_for_response("imgbb", response)
+        return response.json()['data']['url']
+
+    try:
+        return await retry.call_with_retry("imgbb", send)
+    except retry.CircuitOpenError as e:
+        logger.warning(f"ImgBB upload skipped: {str(e)}")
+    except Exception:
+        pass  # Already logged by the retry policy
+
+    return None
+
+async def search_api_analysis_async(imgbb_url, description="", api_key=""):
+    """Get image analysis from SearchAPI"""
+    # Prepare search parameters
+    params = config.SEARCHAPI_PARAMS.copy()
+    params.update({
+        "q": description if description else " ",
+        "url": imgbb_url,
+        "api_key": api_key
+    })
+
+    async def send():
+        await ratelimit.acquire("searchapi", api_key, background=_in_background())
+        async with _provider_slot("searchapi"):
+            response = await clients.get_http_client("searchapi").get(SEARCHAPI_URL, params=params)
+        retry.raise_for_response("searchapi", response)
+        return response.json()
+
+    try:
+        return await retry.call_with_retry("searchapi", send)
+    except retry.CircuitOpenError as e:
+        logger.warning(f"SearchAPI call skipped: {str(e)}")
+    except Exception:
+        pass  # Already logged by the retry policy
+
+    return None
+
+async def _create_claude_message(prompt, api_key, max_tokens):
+    """Send one prompt to Claude under the rate limits and retry policy"""
+    estimated_tokens = ratelimit.estimate_claude_tokens(prompt, max_tokens)
+
+    async def send():
+        await ratelimit.acquire("anthropic", api_key, background=_in_background())
+        await ratelimit.acquire("anthropic", api_key, "tokens", estimated_tokens, background=_in_background())
+        async with _provider_slot("anthropic"):
+            message = await clients.get_anthropic_client(api_key).messages.create(
+                model=config.DEFAULT_CLAUDE_MODEL,
+                max_tokens=max_tokens,
+                messages=[
+                    {"role": "user", "content": prompt}
+                ]
+            )
+
+        # Give back what the estimate over-reserved
+        usage = getattr(message, 'usage', None)
+        if usage is not None:
+            used_tokens = (usage.input_tokens or 0) + (usage.output_tokens or 0)
+            await ratelimit.refund("anthropic", api_key, "tokens", estimated_tokens - used_tokens)
+        return message
+
+    return await retry.call_with_retry("anthropic", send)
+
+async def claude_analysis_async(search_results, api_key=""):
+    """Get deeper analysis from Claude API using only first 15 search results"""
+    filtered_results = filter_search_results(search_results)
+
+    # Identical match lists (e.g. the same mass-market product) share one analysis
+    memo_key = analysis_memo.memo_key(filtered_results)
+    memoized = await asyncio.to_thread(analysis_memo.lookup, memo_key)
+    if memoized:
+        return memoized
+
+    prompt = format_claude_prompt(filtered_results)
+
+    try:
+        message = await _create_claude_message(prompt, api_key, config.MAX_TOKENS)
+        analysis = extract_message_text(message)
+        await asyncio.to_thread(analysis_memo.store, memo_key, analysis)
+        return analysis
+    except retry.CircuitOpenError as e:
+        logger.warning(f"Claude call skipped: {str(e)}")
+        return "Analysis unavailable: Claude API is temporarily unreachable"
+    except Exception:
+        pass  # Already logged by the retry policy
+
+    return "Analysis failed after multiple attempts"
+
+def format_packed_claude_prompt(filtered_results_list):
+    """Build one Claude prompt covering several images, each in its own delimited section"""
+    sections = [
+        f"{PACK_MARKER.format(number=number)}\n{json.dumps(filtered_results, indent=2)}"
+        for number, filtered_results in enumerate(filtered_results_list, start=1)
+    ]
+    return config.CLAUDE_PACKED_PROMPT_TEMPLATE.format(
+        count=len(sections),
+        items="\n\n".join(sections)
+    )
+
+def split_packed_response(text, count):
+    """
+    Split a packed Claude response into per-item analyses
+
+    Returns:
+        dict: item number (1-based) -> analysis, for the items found in the response
+    """
+    analyses = {}
+    matches = list(PACK_MARKER_PATTERN.finditer(text))
+
+    for i, match in enumerate(matches):
+        number = int(match.group(1))
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        analysis = text[match.end():end].strip()
+        if 1 <= number <= count and analysis:
+            analyses[number] = analysis
+
+    return analyses
+
+async def claude_packed_analysis_async(search_results_list, api_key=""):
+    """
+    Analyse several images' search results with as few Claude requests as possible
+
+    Memoized items are answered from the memo table; the rest share one packed
+    request. Items missing from the packed response get a request of their own.
+
+    Returns:
+        list: One analysis per entry of search_results_list
+    """
+    filtered_list = [filter_search_results(search_results) for search_results in search_results_list]
+    # Packed answers are written to a smaller budget, so they are memoized apart from single ones
+    memo_keys = [analysis_memo.memo_key(filtered_results, "packed") for filtered_results in filtered_list]
+    analyses = [await asyncio.to_thread(analysis_memo.lookup, key) for key in memo_keys]
+
+    remaining = [i for i, analysis in enumerate(analyses) if not analysis]
+    if len(remaining) > 1:
+        prompt = format_packed_claude_prompt([filtered_list[i] for i in remaining])
+        max_tokens = config.CLAUDE_PACK_OUTPUT_TOKENS_PER_ITEM * len(remaining)
+
+        try:
+            message = await _create_claude_message(prompt, api_key, max_tokens)
+            packed = split_packed_response(extract_message_text(message), len(remaining))
+        except retry.CircuitOpenError as e:
+            logger.warning(f"Claude call skipped: {str(e)}")
+            packed = {}
+        except Exception:
+            packed = {}  # Already logged by the retry policy; retried one by one below
+
+        for number, i in enumerate(remaining, start=1):
+            if number in packed:
+                analyses[i] = packed[number]
+                await asyncio.to_thread(analysis_memo.store, memo_keys[i], analyses[i], "packed")
+
+        if len(packed) < len(remaining):
+            logger.warning(f"Packed Claude response covered {len(packed)} of {len(remaining)} items")
+
+    # Anything not answered yet gets a regular request
+    missing = [i for i, analysis in enumerate(analyses) if not analysis]
+    single = await asyncio.gather(*[claude_analysis_async(search_results_list[i], api_key) for i in missing])
+    for i, analysis in zip(missing, single):
+        analyses[i] = analysis
+
+    return analyses
+
+async def create_claude_batch_async(prompts, api_key=""):
+    """
+    Submit Claude prompts as one Message Batch
+
+    Args:
+        prompts (dict): custom_id -> prompt
+
+    Returns:
+        str: The batch id
+    """
+    requests = [
+        {
+            "custom_id": custom_id,
+            "params": {
+                "model": config.DEFAULT_CLAUDE_MODEL,
+                "max_tokens": config.MAX_TOKENS,
+                "messages": [
+                    {"role": "user", "content": prompt}
+                ]
+            }
+        }
+        for custom_id, prompt in prompts.items()
+    ]
+
+    async def send():
+        await ratelimit.acquire("anthropic", api_key, background=_in_background())
+        batch = await clients.get_anthropic_client(api_key).messages.batches.create(requests=requests)
+        return batch.id
+
+    return await retry.call_with_retry("anthropic", send)
+
+async def get_claude_batch_status_async(batch_id, api_key=""):
+    """Get the processing status of a Message Batch ('in_progress', 'canceling' or 'ended')"""
+    async def send():
+        batch = await clients.get_anthropic_client(api_key).messages.batches.retrieve(batch_id)
+        return batch.processing_status
+
+    return await retry.call_with_retry("anthropic", send)
+
+async def cancel_claude_batch_async(batch_id, api_key=""):
+    """Ask for a Message Batch to be cancelled; requests already done keep their results"""
+    async def send():
+        await clients.get_anthropic_client(api_key).messages.batches.cancel(batch_id)
+
+    try:
+        await retry.call_with_retry("anthropic", send)
+    except Exception as e:
+        logger.warning(f"Could not cancel Claude batch {batch_id}: {str(e)}")
+
+async def get_claude_batch_results_async(batch_id, api_key=""):
+    """
+    Get the analyses of an ended Message Batch
+
+    Returns:
+        dict: custom_id -> analysis text, for the requests that succeeded
+    """
+    async def send():
+        analyses = {}
+        async for entry in await clients.get_anthropic_client(api_key).messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                analyses[entry.custom_id] = extract_message_text(entry.result.message)
+            else:
+                logger.warning(f"Claude batch {batch_id} request {entry.custom_id}: {entry.result.type}")
+        return analyses
+
+    return await retry.call_with_retry("anthropic", send)
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+
+# Import local modules
+import config
+import database as db
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+class TaskCancelled(Exception):
+    """Raised in the worker processing a task once the task is cancelled"""
+
+    def __init__(self, task_id):
+        super().__init__(f"Task {task_id} was cancelled")
+        self.task_id = task_id
+
+class CancellationToken:
+    """
+    Cancellation signal of one task, shared by everything working on it in this process
+
+    Work checks the token between steps (check(), cancelled, wait()); in-flight
+    work that cannot check it, such as a running pipeline, registers a callback
+    that aborts it.
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        """Raise TaskCancelled if the task was cancelled"""
+        if self._event.is_set():
+            raise TaskCancelled(self.task_id)
+
+    def wait(self, timeout):
+        """Sleep up to timeout seconds; returns True as soon as the task is cancelled"""
+        return self._event.wait(timeout)
+
+    def add_callback(self, callback):
+        """Call callback() on cancellation (right away if already cancelled)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def cancel(self):
+        """Signal cancellation and abort registered in-flight work"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Cancellation callback of task {self.task_id} failed: {str(e)}")
+
+# Tokens of the tasks being processed in this process, by task ID
+_tokens = {}
+_tokens_lock = threading.Lock()
+_watcher_thread = None
+
+def open_token(task_id):
+    """Get a token for a task this process starts working on, and watch the database for its cancellation"""
+    token = CancellationToken(task_id)
+    with _tokens_lock:
+        _tokens.setdefault(task_id, set()).add(token)
+        _start_watcher()
+    return token
+
+def close_token(token):
+    """Stop watching a token once the work it guards has ended"""
+    with _tokens_lock:
+        tokens = _tokens.get(token.task_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del _tokens[token.task_id]
+
+def cancel(task_id):
+    """Signal the tokens of a task in this process; returns how many were signalled"""
+    with _tokens_lock:
+        tokens = list(_tokens.get(task_id, ()))
+    for token in tokens:
+        token.cancel()
+    return len(tokens)
+
+def _watch():
+    """Poll the database for tasks cancelled from other processes"""
+    while True:
+        with _tokens_lock:
+            task_ids = list(_tokens)
+
+        for task_id in task_ids:
+            try:
+                if db.is_task_cancelled(task_id):
+                    if cancel(task_id):
+                        logger.info(f"Task {task_id} was cancelled; aborting its work")
+            except Exception as e:
+                logger.error(f"Could not check cancellation of task {task_id}: {str(e)}")
+
+        time.sleep(config.CANCEL_POLL_INTERVAL)
+
+def _start_watcher():
+    """Start the watcher thread once per process; caller must hold _tokens_lock"""
+    global _watcher_thread
+
+    if _watcher_thread is None or not _watcher_thread.is_alive():
+        _watcher_thread = threading.Thread(target=_watch, name="cancellation-watcher", daemon=True)
+        _watcher_thread.start()
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import logging
+import threading
+
+import anthropic
+import httpx
+
+# Import local modules
+import config
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Long-lived clients, keyed by (loop id, provider, API key fingerprint)
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Usage counters per provider
+_stats = {}
+
+def _count(provider, counter, amount=1):
+    """Increment one of a provider's usage counters"""
+    with _clients_lock:
+        provider_stats = _stats.setdefault(provider, {
+            "client_hits": 0,
+            "client_misses": 0,
+            "requests": 0,
+            "new_connections": 0,
+            "bytes_sent": 0
+        })
+        provider_stats[counter] += amount
+
+def _fingerprint(api_key):
+    """Short, non-reversible identifier for an API key"""
+    return hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:12]
+
+def _limits(provider):
+    """Connection pool limits for a provider, sized to its concurrency"""
+    size = config.ASYNC_CONCURRENCY[provider]
+    return httpx.Limits(
+        max_connections=size,
+        max_keepalive_connections=size,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY
+    )
+
+def _event_hooks(provider):
+    """Request hooks that count requests, bytes sent and the TCP connections they had to open"""
+    async def on_request(request):
+        _count(provider, "requests")
+        # Request body size on the wire (multipart bodies declare their length up front)
+        _count(provider, "bytes_sent", int(request.headers.get("content-length", 0)))
+
+        async def trace(event_name, info):
+            if event_name == "connection.connect_tcp.complete":
+                _count(provider, "new_connections")
+
+        request.extensions["trace"] = trace
+
+    return {"request": [on_request]}
+
+def get_http_client(provider):
+    """
+    Get the pooled keep-alive HTTP client for a provider ('imgbb' or 'searchapi')
+
+    Clients belong to the event loop they were created on; the I/O engine runs
+    everything on one loop, so in practice there is one client per provider.
+    """
+    key = (id(asyncio.get_running_loop()), provider, _fingerprint(None))
+
+    with _clients_lock:
+        client = _clients.get(key)
+        created = client is None
+        if created:
+            client = httpx.AsyncClient(
+                timeout=config.HTTP_TIMEOUT,
+                limits=_limits(provider),
+                event_hooks=_event_hooks(provider)
+            )
+            _clients[key] = client
+
+    _count(provider, "client_misses" if created else "client_hits")
+    return client
+
+def get_anthropic_client(api_key):
+    """Get the pooled Anthropic client for an API key"""
+    provider = "anthropic"
+    key = (id(asyncio.get_running_loop()), provider, _fingerprint(api_key))
+
+    with _clients_lock:
+        client = _clients.get(key)
+        created = client is None
+        if created:
+            # Retries are handled by our own retry policy (retry.py)
+            client = anthropic.AsyncAnthropic(
+                api_key=api_key,
+                base_url=config.ANTHROPIC_BASE_URL,
+                max_retries=0,
+                http_client=anthropic.DefaultAsyncHttpxClient(
+                    limits=_limits(provider),
+                    event_hooks=_event_hooks(provider)
+                )
+            )
+            _clients[key] = client
+
+    _count(provider, "client_misses" if created else "client_hits")
+    return client
+
+def get_pool_stats():
+    """
+    Get client and connection reuse counters per provider
+
+    Client hits/misses count registry lookups; connection hits are requests
+    that went out on an already-open keep-alive connection.
+    """
+    with _clients_lock:
+        stats = {provider: dict(counters) for provider, counters in _stats.items()}
+
+    for counters in stats.values():
+        counters["connection_hits"] = max(counters["requests"] - counters["new_connections"], 0)
+        counters["connection_misses"] = counters["new_connections"]
+    return stats
+
+async def close_clients():
+    """Close every client created on the running loop"""
+    loop_id = id(asyncio.get_running_loop())
+
+    with _clients_lock:
+        keys = [key for key in _clients if key[0] == loop_id]
+        clients = [_clients.pop(key) for key in keys]
+
+    for client in clients:
+        try:
+            if isinstance(client, anthropic.AsyncAnthropic):
+                await client.close()
+            else:
+                await client.aclose()
+        except Exception as e:
+            logger.error(f"Error closing client: {str(e)}")
@@ -1,4 +1,11 @@
 # Application configuration settings
+import os
+
+from dotenv import load_dotenv
+
+# Settings below read the environment at import, so .env must be loaded first
+# (variables already set in the environment take precedence)
+load_dotenv()
 
 # Database
 DATABASE_PATH = "data/database/image_app.db"
@@ -10,8 +17,21 @@ REPORTS_DIR = "reports"
 # Image processing
 MAX_IMAGE_SIZE = (800, 800)  # Maximum size for uploaded images
 THUMBNAIL_SIZE = (200, 200)  # Size for thumbnails in reports
+UPLOAD_IMAGE_SIZE = (640, 640)  # Maximum size of the variant sent to the image host for reverse search
+MASTER_JPEG_QUALITY = 75  # JPEG quality of the stored master image
+UPLOAD_JPEG_QUALITY = 80  # JPEG quality of the upload variant
+THUMBNAIL_JPEG_QUALITY = 75  # JPEG quality of report/UI thumbnails
 IMGBB_EXPIRATION = 600  # ImgBB image expiration in seconds
 
+# Image hosting: how SearchAPI gets a URL for each image
+# "imgbb" uploads to ImgBB; "local" serves UPLOAD_DIR from this app through signed URLs (no upload)
+IMAGE_HOST_BACKEND = os.getenv("IMAGE_HOST_BACKEND", "imgbb")
+IMAGE_HOST_PUBLIC_URL = os.getenv("IMAGE_HOST_PUBLIC_URL", "")  # Base URL where SearchAPI reaches the image server
+IMAGE_HOST_BIND = os.getenv("IMAGE_HOST_BIND", "0.0.0.0")
+IMAGE_HOST_PORT = int(os.getenv("IMAGE_HOST_PORT", "8502"))
+IMAGE_HOST_URL_TTL = 3600  # Seconds a signed image URL stays valid
+IMAGE_HOST_SECRET = os.getenv("IMAGE_HOST_SECRET") or None  # Signing key; generated and stored in the database if unset
+
 # API Settings
 DEFAULT_CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
 MAX_TOKENS = 1024
@@ -54,8 +74,142 @@ COLOR_THEME = {
 }
 
 # Task Processing
-MAX_RETRIES = 3  # Maximum number of retries for failed API calls
-RETRY_DELAY = 5  # Delay in seconds between retries
+MAX_RETRIES = 3  # Maximum number of attempts for a failed API call
+RETRY_BASE_DELAY = 1  # Backoff before the first retry; doubles on each attempt (with jitter)
+RETRY_MAX_DELAY = 30  # Cap for the backoff and for honoured Retry-After headers
+
+# Per-provider circuit breakers: fail fast while a provider is down
+CIRCUIT_BREAKER = {
+    "failure_threshold": 5,  # Consecutive failures that open the circuit
+    "reset_timeout": 30,     # Seconds before a trial call is let through
+    "trial_timeout": 120,    # Seconds after which an unanswered trial call no longer blocks a new one
+}
+
+# Task workers (each worker processes one task at a time)
+# Set EMBEDDED_WORKERS=false when workers run separately via `python -m processing worker`
+EMBEDDED_WORKERS = os.getenv("EMBEDDED_WORKERS", "true").lower() == "true"
+TASK_WORKERS = 2  # Number of workers started with the app
+MIN_TASK_WORKERS = 1  # The autoscaler never goes below this
+MAX_TASK_WORKERS = 6  # ... or above this
+TASKS_PER_WORKER = 2  # Queued tasks per extra worker before scaling up
+WORKER_SCALE_INTERVAL = 5  # Seconds between autoscaling checks
+WORKER_SUPERVISE_INTERVAL = 2  # Seconds between worker health checks
+WORKER_HEARTBEAT_TIMEOUT = 30  # An idle worker silent this long is replaced
+WORKER_TASK_TIMEOUT = 1800  # A busy worker whose task makes no progress this long is replaced
+DEAD_WORKER_HISTORY = 20  # Number of replaced workers kept for reporting
+
+# Durable work queue (one work item per image, stored in the database)
+WORK_LEASE_SECONDS = 120  # A claimed image returns to the queue if not renewed in time
+WORK_HEARTBEAT_INTERVAL = 30  # Seconds between lease renewals by the holding worker
+WORK_MAX_ATTEMPTS = 3  # Leases an image may expire before it is marked failed
+WORK_POLL_INTERVAL = 2  # Seconds an idle worker waits before checking the database
+CANCEL_POLL_INTERVAL = 0.5  # Seconds between checks for tasks cancelled from another process
+# Workers in this process notify waiting pages at once; those in another process are seen through the database
+TASK_EVENT_FALLBACK_INTERVAL = 5 if EMBEDDED_WORKERS else 2  # Seconds without an event before a waiting page reads the task
+
+# Stage timings (see metrics.py)
+STAGE_METRICS_FLUSH_SIZE = 50  # Timings buffered before they are written to the database
+STAGE_METRICS_RETENTION = 7 * 24 * 3600  # Seconds timings are kept
+STAGE_METRICS_PRUNE_INTERVAL = 3600  # Seconds between deletions of expired timings
+# Windows the admin panel reports latency percentiles over, in seconds
+STAGE_METRICS_WINDOWS = {"Last hour": 3600, "Last 24 hours": 24 * 3600, "Last 7 days": 7 * 24 * 3600}
+
+# Task scheduling: single-image tasks run in the interactive lane, bulk tasks in the background lane
+SCHEDULER_LANE_PRIORITY = {"interactive": 1.0, "background": 0.0}
+SCHEDULER_AGING_SECONDS = 120  # Every this many seconds of waiting add 1 to a task's priority, so bulk work never starves
+SCHEDULER_RESERVED_WORKERS = 1  # Task workers kept free of background work, on top of those the queue needs
+
+# Fair share between users competing for workers, set per user in users.tier:
+# weight is a tier's relative share of processed images, max_tasks caps how many
+# of a user's bulk tasks run at once (single-image tasks are never held back)
+USER_TIERS = {
+    "free": {"weight": 1, "max_tasks": 1},
+    "standard": {"weight": 2, "max_tasks": 2},
+    "premium": {"weight": 4, "max_tasks": 4},
+}
+DEFAULT_USER_TIER = "standard"
+SCHEDULER_QUANTUM = 5  # Images a weight-1 user is credited per round-robin turn
+FAIR_SHARE_WINDOW = 3600  # Seconds of history behind the throughput shares on the admin page
+
+# Rate limits per provider and API key (None or missing = unlimited)
+RATE_LIMITS = {
+    "imgbb": {"requests_per_second": 5},
+    "searchapi": {"requests_per_second": 5},
+    "anthropic": {"requests_per_second": 0.8, "tokens_per_minute": 40000},
+}
+RATE_LIMIT_BURST_SECONDS = 2  # Bucket size, in seconds' worth of the rate
+RATE_LIMIT_INTERACTIVE_HEADROOM = 0.5  # Share of each bucket background calls leave for interactive ones
+# "memory" limits each process on its own; "database" shares the buckets between worker processes
+# (the default for `python -m processing worker`, which is usually run several times)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory" if EMBEDDED_WORKERS else "database")
+
+# Result cache: repeat images reuse their ImgBB URL, SearchAPI results and Claude analysis
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_MAX_ENTRIES = 10000  # Least recently used entries are evicted beyond this
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # ... or beyond this total size of cached results
+RESULT_CACHE_MAX_AGE = 7 * 24 * 3600  # Entries not refreshed for this long are evicted
+RESULT_CACHE_URL_MARGIN = 60  # A cached ImgBB URL must stay valid at least this long to be reused
+RESULT_CACHE_EVICT_INTERVAL = 300  # Minimum seconds between eviction passes
+
+# Bulk tasks can send their Claude prompts as one Message Batch (cheaper, but results may take hours)
+CLAUDE_BATCH_MODE = os.getenv("CLAUDE_BATCH_MODE", "false").lower() == "true"
+CLAUDE_BATCH_POLL_INTERVAL = 30  # Seconds between batch status checks
+CLAUDE_BATCH_MAX_WAIT = 6 * 3600  # After this the batch is cancelled and the rest analysed directly
+# Point the Anthropic client elsewhere, e.g. a local stand-in for testing (None = official API)
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL") or None
+
+# Bulk tasks can pack several images into one Claude request, sized to a token budget
+# (ignored for tasks sent as a Message Batch)
+CLAUDE_PACKING = os.getenv("CLAUDE_PACKING", "false").lower() == "true"
+CLAUDE_PACK_MAX_ITEMS = 8  # Images per packed request at most
+CLAUDE_PACK_TOKEN_BUDGET = 12000  # Estimated input plus output tokens of a packed request at most
+CLAUDE_PACK_OUTPUT_TOKENS_PER_ITEM = 600  # Output tokens allowed per packed image
+CLAUDE_PACK_WORKERS = 2  # Concurrent packed requests per task (fewer workers make fuller packs)
+PIPELINE_PACK_LINGER = 2  # Seconds a packed stage waits for more images before sending a partial pack
+
+# Claude analyses are memoized by model, prompt template and filtered search results;
+# changing either setting makes old entries unreachable and they are evicted
+CLAUDE_MEMO_ENABLED = True
+CLAUDE_MEMO_MAX_ENTRIES = 20000  # Least recently used entries are evicted beyond this
+CLAUDE_MEMO_TTL = 30 * 24 * 3600  # Seconds a memoized analysis stays valid
+CLAUDE_MEMO_EVICT_INTERVAL = 300  # Minimum seconds between eviction passes
+
+# Near-duplicate images (same object, different shot) reuse SearchAPI results via a perceptual hash
+PHASH_ENABLED = True
+PHASH_SIMILARITY_THRESHOLD = 0.9  # Fraction of the 64 hash bits that must match
+# Bulk tasks analyse each group of near-identical photos once and share the result
+BULK_DEDUP_ENABLED = True
+BULK_DEDUP_SIMILARITY_THRESHOLD = 0.85  # Photos of one item taken seconds apart differ a little more
+
+# Per-image pipeline inside a task: number of concurrent workers for each stage
+# (workers are coroutines on the async I/O engine, so these can be fairly high)
+PIPELINE_STAGE_WORKERS = {
+    "upload": 8,     # ImgBB uploads
+    "search": 8,     # SearchAPI reverse image searches
+    "analysis": 4,   # Claude analyses
+    "db_write": 1,   # SQLite writes (keep at 1 to avoid lock contention)
+}
+PIPELINE_QUEUE_SIZE = 8  # Maximum number of images waiting between two stages
+
+# Async I/O engine: maximum in-flight calls per provider, shared by all tasks in the process
+ASYNC_CONCURRENCY = {
+    "imgbb": 32,
+    "searchapi": 32,
+    "anthropic": 16,
+}
+# ... of which background (bulk) work may never use the last few, keeping them for interactive tasks
+ASYNC_INTERACTIVE_RESERVED = {
+    "imgbb": 4,
+    "searchapi": 4,
+    "anthropic": 4,
+}
+ASYNC_BLOCKING_THREADS = 16  # Threads for file and DB work started from the event loop
+
+# Process pool for CPU-bound image work (decoding, thumbnails, re-encoding, hashing), shared per process
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS")) if os.getenv("CPU_POOL_WORKERS") else None  # None = one per core, 0 = run inline
+CPU_POOL_START_METHOD = "spawn"  # Fresh interpreters; forking the threaded app is unsafe
+HTTP_TIMEOUT = 60  # Seconds before an ImgBB or SearchAPI request times out
+HTTP_KEEPALIVE_EXPIRY = 60  # Seconds an idle pooled connection is kept open
 
 # Claude Analysis Prompt Template
 CLAUDE_PROMPT_TEMPLATE = """
@@ -67,6 +221,17 @@ Please identify the product, estimate its price range, and provide any other rel
 Keep your analysis short and to the point, focusing on the most important details.
 """
 
+# Prompt for several images at once (see CLAUDE_PACKING)
+CLAUDE_PACKED_PROMPT_TEMPLATE = """
+Please analyze each of the following {count} items separately. Each item lists the product matches found for one photo:
+
+{items}
+
+For each item, identify the product, estimate its price range, and provide any other relevant information.
+Keep each analysis short and to the point, focusing on the most important details.
+Answer every item in order, and start each item's analysis with its marker line exactly as given (e.g. "=== ITEM 1 ===").
+"""
+
 # SearchAPI Parameters
 SEARCHAPI_PARAMS = {
     "engine": "google_lens",
@@ -0,0 +1,105 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Import local modules
+import config
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Shared process pool for CPU-bound image work (decoding, resizing, encoding, hashing)
+_executor = None
+_executor_lock = threading.Lock()
+_stats = {"submitted": 0, "completed": 0, "failed": 0, "inline": 0, "restarts": 0}
+
+def pool_size():
+    """Number of worker processes: CPU_POOL_WORKERS, or one per available core"""
+    if config.CPU_POOL_WORKERS is not None:
+        return config.CPU_POOL_WORKERS
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def get_executor():
+    """Get the process-wide pool, starting it on first use (None when the pool is disabled)"""
+    global _executor
+
+    with _executor_lock:
+        if _executor is None and pool_size() > 0:
+            # Forking a process that runs threads can copy held locks; start clean interpreters instead
+            _executor = ProcessPoolExecutor(
+                max_workers=pool_size(),
+                mp_context=multiprocessing.get_context(config.CPU_POOL_START_METHOD)
+            )
+            logger.info(f"Started CPU pool with {pool_size()} processes")
+        return _executor
+
+def _restart(broken):
+    """Replace a pool whose worker process died"""
+    global _executor
+
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+            _stats["restarts"] += 1
+            logger.warning("CPU pool broken; it will restart on next use")
+    broken.shutdown(wait=False)
+
+def _count(future):
+    """Done callback tallying how submitted work ended"""
+    with _executor_lock:
+        _stats["failed" if future.cancelled() or future.exception() else "completed"] += 1
+
+def submit(func, *args):
+    """
+    Run func(*args) on the pool and return a concurrent.futures.Future
+
+    func and its arguments are pickled, so func must be a module-level function
+    and arguments plain data (bytes, not memoryviews or open files).
+    """
+    executor = get_executor()
+    if executor is not None:
+        try:
+            future = executor.submit(func, *args)
+        except BrokenProcessPool:
+            _restart(executor)
+            executor = get_executor()
+            future = executor.submit(func, *args)
+
+        with _executor_lock:
+            _stats["submitted"] += 1
+        future.add_done_callback(_count)
+        return future
+
+    # Pool disabled: run in the calling thread, still returning a future
+    future = Future()
+    with _executor_lock:
+        _stats["inline"] += 1
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def run(func, *args, timeout=None):
+    """Run func(*args) on the pool and block until it returns"""
+    return submit(func, *args).result(timeout)
+
+def shutdown(wait=True):
+    """Stop the pool's processes"""
+    global _executor
+
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+def get_cpu_pool_stats():
+    """Get the pool size and this process's work counters"""
+    with _executor_lock:
+        return dict(_stats, processes=pool_size() if _executor is not None else 0)
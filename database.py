@@ -2,6 +2,7 @@ import sqlite3
 from datetime import datetime
 import pandas as pd
 import os
+import time
 import logging
 
 # Import configuration
@@ -10,6 +11,103 @@ import config
 # Get logger
 logger = logging.getLogger(__name__)
 
+# Lease times are stored as Unix timestamps so expiry checks are plain comparisons
+WORK_ITEMS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS work_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id INTEGER NOT NULL,
+    image_id INTEGER NOT NULL UNIQUE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires_at REAL,
+    heartbeat_at REAL,
+    created_at TIMESTAMP NOT NULL,
+    completed_at REAL,
+    FOREIGN KEY (task_id) REFERENCES tasks (id),
+    FOREIGN KEY (image_id) REFERENCES images (id)
+)
+'''
+WORK_ITEMS_INDEX = "CREATE INDEX IF NOT EXISTS idx_work_items_status ON work_items (status, task_id)"
+
+# Processing stages of an image, in order; each is persisted as soon as it completes
+IMAGE_STAGES = ('pending', 'uploaded', 'searched', 'analyzed')
+
+# Every stage change of an image bumps its task's progress_version, so pages
+# waiting in another process re-read the stage counts only when it changes (see events.py)
+BUMP_TASK_PROGRESS = "UPDATE tasks SET progress_version = progress_version + 1 WHERE id = (SELECT task_id FROM images WHERE id = ?)"
+
+# Duplicates of an image are looked up each time the image's results are written
+IMAGES_DUPLICATE_INDEX = "CREATE INDEX IF NOT EXISTS idx_images_duplicate_of ON images (duplicate_of)"
+
+# Similarity indexes catch up on newly hashed images by hash_seq (see similarity.py)
+IMAGES_HASH_SEQ_INDEX = "CREATE INDEX IF NOT EXISTS idx_images_hash_seq ON images (hash_seq)"
+
+# Token buckets shared by every worker process (see ratelimit.py)
+RATE_LIMIT_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    bucket_key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+'''
+
+# Content-addressed cache of API results, keyed by the SHA-256 of the image bytes (see result_cache.py)
+RESULT_CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS result_cache (
+    image_hash TEXT PRIMARY KEY,
+    imgbb_url TEXT,
+    imgbb_expires_at REAL,
+    search_results TEXT,
+    analysis TEXT,
+    size_bytes INTEGER DEFAULT 0,
+    hits INTEGER DEFAULT 0,
+    updated_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+)
+'''
+
+# Claude analyses memoized by model, prompt template and filtered search results (see analysis_memo.py)
+CLAUDE_MEMO_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS claude_memo (
+    memo_key TEXT PRIMARY KEY,
+    config_hash TEXT NOT NULL,
+    analysis TEXT NOT NULL,
+    hits INTEGER DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+)
+'''
+
+# Claude Message Batches in flight; images keep their batch's id so a restarted worker resumes it (see processing.py)
+CLAUDE_BATCHES_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS claude_batches (
+    batch_id TEXT PRIMARY KEY,
+    task_id INTEGER,
+    request_count INTEGER,
+    submitted_at REAL NOT NULL
+)
+'''
+
+# Timing of each processing stage of each image, plus task-level stages with no image (see metrics.py)
+STAGE_METRICS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stage_metrics (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id INTEGER,
+    image_id INTEGER,
+    stage TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    ended_at REAL NOT NULL,
+    attempts INTEGER DEFAULT 0,
+    bytes INTEGER,
+    outcome TEXT NOT NULL
+)
+'''
+STAGE_METRICS_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_stage_metrics_task ON stage_metrics (task_id)",
+    "CREATE INDEX IF NOT EXISTS idx_stage_metrics_ended ON stage_metrics (ended_at, stage)",
+)
+
 def init_db():
     """Initialize the database with required tables"""
     conn = sqlite3.connect(config.DATABASE_PATH)
@@ -23,7 +121,8 @@ def init_db():
         password TEXT NOT NULL,
         image_quota INTEGER DEFAULT 100,
         images_processed INTEGER DEFAULT 0,
-        is_admin INTEGER DEFAULT 0
+        is_admin INTEGER DEFAULT 0,
+        tier TEXT DEFAULT 'standard'
     )
     ''')
     
@@ -49,6 +148,7 @@ def init_db():
         completed_at TIMESTAMP,
         output_path TEXT,
         is_cancelled INTEGER DEFAULT 0,
+        progress_version INTEGER DEFAULT 0,
         FOREIGN KEY (user_id) REFERENCES users (id)
     )
     ''')
@@ -63,10 +163,45 @@ def init_db():
         description TEXT,
         analysis TEXT,
         is_processed INTEGER DEFAULT 0,
+        content_hash TEXT,
+        phash TEXT,
+        duplicate_of INTEGER,
+        upload_path TEXT,
+        thumbnail_path TEXT,
+        stage TEXT DEFAULT 'pending',
+        search_results TEXT,
+        url_expires_at REAL,
+        stage_error TEXT,
+        hash_seq INTEGER,
+        claude_batch_id TEXT,
         FOREIGN KEY (task_id) REFERENCES tasks (id)
     )
     ''')
     
+    # Create work_items table: durable, image-level processing queue
+    c.execute(WORK_ITEMS_SCHEMA)
+    c.execute(WORK_ITEMS_INDEX)
+    
+    # Create rate_limit_buckets table
+    c.execute(RATE_LIMIT_SCHEMA)
+    
+    # Create result_cache table
+    c.execute(RESULT_CACHE_SCHEMA)
+    
+    # Create claude_memo table
+    c.execute(CLAUDE_MEMO_SCHEMA)
+    
+    # Create claude_batches table
+    c.execute(CLAUDE_BATCHES_SCHEMA)
+    
+    # Create stage_metrics table
+    c.execute(STAGE_METRICS_SCHEMA)
+    for index in STAGE_METRICS_INDEXES:
+        c.execute(index)
+    
+    # WAL lets several worker processes read while one of them writes
+    c.execute("PRAGMA journal_mode=WAL")
+    
     # Insert default settings if they don't exist
     c.execute("SELECT COUNT(*) FROM system_settings WHERE setting_key = 'max_bulk_upload'")
     if c.fetchone()[0] == 0:
@@ -107,6 +242,10 @@ def migrate_db():
             c.execute("ALTER TABLE users ADD COLUMN is_admin INTEGER DEFAULT 0")
             logger.info("Added is_admin column to users table")
         
+        if 'tier' not in columns:
+            c.execute("ALTER TABLE users ADD COLUMN tier TEXT DEFAULT 'standard'")
+            logger.info("Added tier column to users table")
+        
         # Check if columns already exist in tasks table
         c.execute("PRAGMA table_info(tasks)")
         columns = [column[1] for column in c.fetchall()]
@@ -123,6 +262,10 @@ def migrate_db():
             c.execute("ALTER TABLE tasks ADD COLUMN is_cancelled INTEGER DEFAULT 0")
             logger.info("Added is_cancelled column to tasks table")
         
+        if 'progress_version' not in columns:
+            c.execute("ALTER TABLE tasks ADD COLUMN progress_version INTEGER DEFAULT 0")
+            logger.info("Added progress_version column to tasks table")
+        
         # Check if columns already exist in images table
         c.execute("PRAGMA table_info(images)")
         columns = [column[1] for column in c.fetchall()]
@@ -131,6 +274,110 @@ def migrate_db():
             c.execute("ALTER TABLE images ADD COLUMN is_processed INTEGER DEFAULT 0")
             logger.info("Added is_processed column to images table")
         
+        if 'content_hash' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN content_hash TEXT")
+            logger.info("Added content_hash column to images table")
+        
+        if 'phash' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN phash TEXT")
+            logger.info("Added phash column to images table")
+        
+        if 'duplicate_of' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN duplicate_of INTEGER")
+            logger.info("Added duplicate_of column to images table")
+        
+        if 'upload_path' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN upload_path TEXT")
+            logger.info("Added upload_path column to images table")
+        
+        if 'thumbnail_path' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN thumbnail_path TEXT")
+            logger.info("Added thumbnail_path column to images table")
+        
+        if 'stage' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN stage TEXT DEFAULT 'pending'")
+            c.execute(
+                """
+                UPDATE images SET stage = CASE 
+                    WHEN is_processed = 1 THEN 'analyzed' 
+                    WHEN imgbb_url IS NOT NULL THEN 'uploaded' 
+                    ELSE 'pending' END
+                """
+            )
+            logger.info("Added stage column to images table")
+        
+        if 'search_results' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN search_results TEXT")
+            logger.info("Added search_results column to images table")
+        
+        if 'url_expires_at' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN url_expires_at REAL")
+            # When older URLs expire is unknown, so never reuse them
+            c.execute("UPDATE images SET url_expires_at = 0 WHERE imgbb_url IS NOT NULL")
+            logger.info("Added url_expires_at column to images table")
+        
+        if 'stage_error' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN stage_error TEXT")
+            logger.info("Added stage_error column to images table")
+        
+        if 'hash_seq' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN hash_seq INTEGER")
+            # Images hashed before the column existed keep their id order
+            c.execute("UPDATE images SET hash_seq = id WHERE phash IS NOT NULL AND content_hash IS NOT NULL")
+            logger.info("Added hash_seq column to images table")
+        
+        if 'claude_batch_id' not in columns:
+            c.execute("ALTER TABLE images ADD COLUMN claude_batch_id TEXT")
+            logger.info("Added claude_batch_id column to images table")
+        
+        # Created here rather than in init_db, which may run before the columns exist
+        c.execute(IMAGES_DUPLICATE_INDEX)
+        c.execute(IMAGES_HASH_SEQ_INDEX)
+        
+        # Check if work_items table exists (init_db usually created it already)
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='work_items'")
+        if not c.fetchone():
+            c.execute(WORK_ITEMS_SCHEMA)
+            c.execute(WORK_ITEMS_INDEX)
+            logger.info("Created work_items table")
+        
+        c.execute("PRAGMA table_info(work_items)")
+        if 'completed_at' not in [column[1] for column in c.fetchall()]:
+            c.execute("ALTER TABLE work_items ADD COLUMN completed_at REAL")
+            logger.info("Added completed_at column to work_items table")
+        
+        # Check if rate_limit_buckets table exists
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='rate_limit_buckets'")
+        if not c.fetchone():
+            c.execute(RATE_LIMIT_SCHEMA)
+            logger.info("Created rate_limit_buckets table")
+        
+        # Check if result_cache table exists
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='result_cache'")
+        if not c.fetchone():
+            c.execute(RESULT_CACHE_SCHEMA)
+            logger.info("Created result_cache table")
+        
+        # Check if claude_memo table exists
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='claude_memo'")
+        if not c.fetchone():
+            c.execute(CLAUDE_MEMO_SCHEMA)
+            logger.info("Created claude_memo table")
+        
+        # Check if claude_batches table exists
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='claude_batches'")
+        if not c.fetchone():
+            c.execute(CLAUDE_BATCHES_SCHEMA)
+            logger.info("Created claude_batches table")
+        
+        # Check if stage_metrics table exists
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='stage_metrics'")
+        if not c.fetchone():
+            c.execute(STAGE_METRICS_SCHEMA)
+            for index in STAGE_METRICS_INDEXES:
+                c.execute(index)
+            logger.info("Created stage_metrics table")
+        
         # Check if system_settings table exists
         c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='system_settings'")
         if not c.fetchone():
@@ -154,6 +401,25 @@ def migrate_db():
             )
             logger.info("Added default system settings")
         
+        # Queue the unprocessed images of unfinished tasks from before the work queue, once:
+        # migrate_db runs on every page load, and a task being submitted has no work items yet
+        c.execute(
+            "INSERT OR IGNORE INTO system_settings (setting_key, setting_value, description) VALUES (?, ?, ?)",
+            ('work_items_backfilled', '1', 'Tasks from before the work queue have been queued')
+        )
+        if c.rowcount:
+            c.execute(
+                """
+                INSERT OR IGNORE INTO work_items (task_id, image_id, status, created_at)
+                SELECT i.task_id, i.id, 'pending', ?
+                FROM images i JOIN tasks t ON t.id = i.task_id
+                WHERE t.status IN ('pending', 'processing') AND t.is_cancelled = 0 AND i.is_processed = 0
+                  AND NOT EXISTS (SELECT 1 FROM work_items w WHERE w.task_id = t.id)
+                """,
+                (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),)
+            )
+            logger.info(f"Queued {c.rowcount} unprocessed images from unfinished tasks")
+        
         conn.commit()
         logger.info("Database migration successful")
     except Exception as e:
@@ -277,6 +543,21 @@ def update_user_quota(user_id, new_quota):
     finally:
         conn.close()
 
+def update_user_tier(user_id, tier):
+    """Set a user's scheduling tier (a key of USER_TIERS)"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    try:
+        c.execute("UPDATE users SET tier = ? WHERE id = ?", (tier, user_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error updating user tier: {e}")
+        return False
+    finally:
+        conn.close()
+
 def reset_user_usage(user_id):
     """Reset a user's processed images count"""
     conn = sqlite3.connect(config.DATABASE_PATH)
@@ -372,14 +653,17 @@ def create_new_task(user_id, task_type, task_name="", task_description=""):
     
     return task_id
 
-def add_image_to_task(task_id, image_path, description=""):
-    """Add an image to a task"""
+def add_image_to_task(task_id, image_path, description="", upload_path=None, thumbnail_path=None, phash=None):
+    """Add an image, with the variants and perceptual hash derived at ingestion, to a task"""
     conn = sqlite3.connect(config.DATABASE_PATH)
     c = conn.cursor()
     
     c.execute(
-        "INSERT INTO images (task_id, image_path, description, is_processed) VALUES (?, ?, ?, ?)",
-        (task_id, image_path, description, 0)
+        """
+        INSERT INTO images (task_id, image_path, description, is_processed, upload_path, thumbnail_path, phash) 
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (task_id, image_path, description, 0, upload_path, thumbnail_path, phash)
     )
     
     image_id = c.lastrowid
@@ -398,27 +682,209 @@ def update_image_with_imgbb_url(image_id, imgbb_url):
     conn.commit()
     conn.close()
 
-def update_image_with_analysis(image_id, analysis):
-    """Update image record with analysis results and mark as processed"""
+def save_image_upload(image_id, imgbb_url, url_expires_at):
+    """Checkpoint a published image URL (url_expires_at is a Unix time, None = never)"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    c.execute(
+        "UPDATE images SET imgbb_url = ?, url_expires_at = ?, stage = 'uploaded', stage_error = NULL WHERE id = ?", 
+        (imgbb_url, url_expires_at, image_id)
+    )
+    c.execute(BUMP_TASK_PROGRESS, (image_id,))
+    
+    conn.commit()
+    conn.close()
+
+def save_image_search_results(image_id, search_results):
+    """Checkpoint the SearchAPI results (JSON) of an image"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    c.execute(
+        "UPDATE images SET search_results = ?, stage = 'searched', stage_error = NULL WHERE id = ?", 
+        (search_results, image_id)
+    )
+    c.execute(BUMP_TASK_PROGRESS, (image_id,))
+    
+    conn.commit()
+    conn.close()
+
+def mark_image_failed(image_id, error):
+    """Record that an image could not be processed; the results of its completed stages are kept"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    c.execute("UPDATE images SET stage = 'failed', stage_error = ? WHERE id = ?", (error, image_id))
+    c.execute(BUMP_TASK_PROGRESS, (image_id,))
+    
+    conn.commit()
+    conn.close()
+
+def update_image_hashes(image_id, content_hash, phash):
+    """
+    Record the content hash and perceptual hash (hex) of an image
+    
+    hash_seq is taken inside the write transaction, so it grows in commit order
+    across processes even though images finish out of id order. Recording the
+    same hashes again (resumed or reprocessed images) keeps it, so similarity
+    indexes don't add the image twice.
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    c.execute(
+        """
+        UPDATE images SET 
+            hash_seq = CASE 
+                WHEN hash_seq IS NOT NULL AND content_hash IS ? AND phash IS ? THEN hash_seq 
+                ELSE (SELECT COALESCE(MAX(hash_seq), 0) + 1 FROM images) END,
+            content_hash = ?, phash = ?
+        WHERE id = ?
+        """, 
+        (content_hash, phash, content_hash, phash, image_id)
+    )
+    
+    conn.commit()
+    conn.close()
+
+def set_image_duplicates(groups):
+    """
+    Record perceptual hashes and duplicate groups of a task's images
+    
+    Args:
+        groups (list): (image_id, phash hex or None, representative image_id or None) tuples
+    """
     conn = sqlite3.connect(config.DATABASE_PATH)
     c = conn.cursor()
     
+    c.executemany(
+        "UPDATE images SET phash = ?, duplicate_of = ? WHERE id = ?",
+        [(phash, duplicate_of, image_id) for image_id, phash, duplicate_of in groups]
+    )
+    
+    conn.commit()
+    conn.close()
+
+def _copy_results_to_duplicates(c, image_id):
+    """Copy an image's results to its duplicates using an open cursor"""
+    c.execute(
+        """
+        UPDATE images SET 
+            imgbb_url = (SELECT imgbb_url FROM images WHERE id = ?),
+            analysis = (SELECT analysis FROM images WHERE id = ?),
+            is_processed = (SELECT is_processed FROM images WHERE id = ?),
+            stage = (SELECT stage FROM images WHERE id = ?),
+            stage_error = (SELECT stage_error FROM images WHERE id = ?)
+        WHERE duplicate_of = ?
+        """,
+        (image_id, image_id, image_id, image_id, image_id, image_id)
+    )
+    return c.rowcount
+
+def copy_results_to_duplicates(image_id):
+    """Give the duplicates of an image its ImgBB URL and analysis"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    count = _copy_results_to_duplicates(c, image_id)
+    if count:
+        c.execute(BUMP_TASK_PROGRESS, (image_id,))
+    
+    conn.commit()
+    conn.close()
+    
+    return count
+
+def save_batch_analyses(results, worker_id):
+    """
+    Write the analyses of a Claude Message Batch and complete their work items in one transaction
+    
+    Args:
+        results (list): (image_id, work_id, analysis, failed) tuples
+        worker_id (str): Worker holding the leases of the work items
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    try:
+        for image_id, work_id, analysis, failed in results:
+            c.execute(
+                "UPDATE images SET analysis = ?, is_processed = 1, stage = ?, stage_error = ? WHERE id = ?", 
+                (str(analysis), 'failed' if failed else 'analyzed', str(analysis) if failed else None, image_id)
+            )
+            _copy_results_to_duplicates(c, image_id)
+            c.execute(BUMP_TASK_PROGRESS, (image_id,))
+            c.execute(
+                """
+                UPDATE work_items SET status = 'done', lease_owner = NULL, lease_expires_at = NULL, completed_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'leased'
+                """,
+                (time.time(), work_id, worker_id)
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_hashed_images(after_seq=0):
+    """Get (hash_seq, phash, content_hash) of images hashed after the given hash_seq, in hashing order"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute(
+        """
+        SELECT hash_seq, phash, content_hash FROM images 
+        WHERE hash_seq > ? AND phash IS NOT NULL AND content_hash IS NOT NULL 
+        ORDER BY hash_seq
+        """,
+        (after_seq,)
+    )
+    result = c.fetchall()
+    conn.close()
+    
+    return result
+
+def update_image_with_analysis(image_id, analysis, failed=False):
+    """Update image record with analysis results and mark as processed (failed = the analysis is an error message)"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
     # Make sure analysis is a string
     if not isinstance(analysis, str):
         analysis = str(analysis)
     
-    c.execute("UPDATE images SET analysis = ?, is_processed = 1 WHERE id = ?", (analysis, image_id))
+    c.execute(
+        "UPDATE images SET analysis = ?, is_processed = 1, stage = ?, stage_error = ? WHERE id = ?", 
+        (analysis, 'failed' if failed else 'analyzed', analysis if failed else None, image_id)
+    )
+    c.execute(BUMP_TASK_PROGRESS, (image_id,))
     
     conn.commit()
     conn.close()
 
 def cancel_task(task_id):
-    """Mark a task as cancelled"""
-    conn = sqlite3.connect(config.DATABASE_PATH)
+    """Mark a task as cancelled and close its open work so no worker picks it up again"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
     c = conn.cursor()
     
     try:
         c.execute("UPDATE tasks SET is_cancelled = 1 WHERE id = ?", (task_id,))
+        # A task already generating its reports is left to finish
+        c.execute(
+            "UPDATE tasks SET status = 'cancelled' WHERE id = ? AND status NOT IN ('completed', 'finalizing')", 
+            (task_id,)
+        )
+        # Workers holding leases notice the cancellation and abort their requests
+        c.execute(
+            """
+            UPDATE work_items SET status = 'cancelled', lease_owner = NULL, lease_expires_at = NULL
+            WHERE task_id = ? AND status IN ('pending', 'leased')
+            """,
+            (task_id,)
+        )
         conn.commit()
         return True
     except Exception as e:
@@ -468,7 +934,11 @@ def get_task_images(task_id):
     conn = sqlite3.connect(config.DATABASE_PATH)
     
     images = pd.read_sql_query(
-        "SELECT id, image_path, description, imgbb_url, analysis, is_processed FROM images WHERE task_id = ?",
+        """
+        SELECT id, image_path, description, imgbb_url, analysis, is_processed, duplicate_of, 
+               upload_path, thumbnail_path, phash 
+        FROM images WHERE task_id = ?
+        """,
         conn,
         params=(task_id,)
     )
@@ -489,6 +959,18 @@ def get_task_status(task_id):
     
     return result[0] if result else None
 
+def get_task_progress(task_id):
+    """Get the status and progress_version of a task, or (None, None) if it does not exist"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute("SELECT status, progress_version FROM tasks WHERE id = ?", (task_id,))
+    result = c.fetchone()
+    
+    conn.close()
+    
+    return result if result else (None, None)
+
 def get_task_type(task_id):
     """Get the type of a task (bulk or single)"""
     conn = sqlite3.connect(config.DATABASE_PATH)
@@ -567,7 +1049,10 @@ def get_image_analysis(task_id):
     conn = sqlite3.connect(config.DATABASE_PATH)
     
     images_df = pd.read_sql_query(
-        "SELECT image_path, description, analysis, is_processed FROM images WHERE task_id = ?",
+        """
+        SELECT id, image_path, description, analysis, is_processed, duplicate_of, thumbnail_path 
+        FROM images WHERE task_id = ?
+        """,
         conn,
         params=(task_id,)
     )
@@ -588,10 +1073,12 @@ def delete_task(task_id):
         output_path = task_data[0] if task_data else None
         
         # Get all images for this task
-        c.execute("SELECT image_path FROM images WHERE task_id = ?", (task_id,))
-        image_paths = [row[0] for row in c.fetchall()]
+        c.execute("SELECT image_path, upload_path, thumbnail_path FROM images WHERE task_id = ?", (task_id,))
+        image_paths = [path for row in c.fetchall() for path in row if path]
         
-        # Delete images from database first (do this first to prevent orphaned records)
+        # Delete queued work and images from database first (do this first to prevent orphaned records)
+        c.execute("DELETE FROM work_items WHERE task_id = ?", (task_id,))
+        c.execute("DELETE FROM claude_batches WHERE task_id = ?", (task_id,))
         c.execute("DELETE FROM images WHERE task_id = ?", (task_id,))
         
         # Delete task from database
@@ -640,4 +1127,824 @@ def check_bulk_upload_limit(count):
 
 def get_bulk_upload_limit():
     """Get the maximum number of images allowed in a bulk upload"""
-    return int(get_system_setting('max_bulk_upload', 25))
\ No newline at end of file
+    return int(get_system_setting('max_bulk_upload', 25))
+
+def enqueue_task_work(task_id):
+    """Add a work item for every unprocessed image of a task (duplicates get their representative's results)"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    c.execute(
+        """
+        INSERT OR IGNORE INTO work_items (task_id, image_id, status, created_at)
+        SELECT task_id, id, 'pending', ? FROM images 
+        WHERE task_id = ? AND is_processed = 0 AND duplicate_of IS NULL
+        """,
+        (current_time, task_id)
+    )
+    
+    count = c.rowcount
+    conn.commit()
+    conn.close()
+    
+    return count
+
+def requeue_task_work(task_id):
+    """
+    Queue again every image of a task that has not been analyzed, and reopen the task
+    
+    Images keep the results of their completed stages, so processing resumes
+    where each one stopped. Work currently leased by a live worker is left alone.
+    
+    Returns:
+        int: Number of images queued again
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        
+        now = time.time()
+        unfinished = """
+            SELECT id FROM images 
+            WHERE task_id = ? AND duplicate_of IS NULL AND COALESCE(stage, 'pending') != 'analyzed'
+        """
+        c.execute(f"UPDATE images SET is_processed = 0 WHERE id IN ({unfinished})", (task_id,))
+        c.execute(
+            f"""
+            UPDATE work_items SET status = 'pending', attempts = 0, lease_owner = NULL, lease_expires_at = NULL
+            WHERE task_id = ? AND image_id IN ({unfinished})
+              AND (status != 'leased' OR lease_expires_at < ?)
+            """,
+            (task_id, task_id, now)
+        )
+        count = c.rowcount
+        
+        c.execute(
+            f"""
+            INSERT OR IGNORE INTO work_items (task_id, image_id, status, created_at)
+            SELECT ?, id, 'pending', ? FROM images WHERE id IN ({unfinished})
+            """,
+            (task_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), task_id)
+        )
+        count += c.rowcount
+        
+        # Back to a state workers pick up and try_finalize_task can close
+        c.execute(
+            "UPDATE tasks SET status = 'pending' WHERE id = ? AND is_cancelled = 0 AND (? > 0 OR status != 'completed')",
+            (task_id, count)
+        )
+        
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error requeueing work of task {task_id}: {e}")
+        raise
+    finally:
+        conn.close()
+    
+    return count
+
+def get_task_stage_counts(task_id):
+    """Get the number of images of a task in each processing stage"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute(
+        "SELECT COALESCE(stage, 'pending'), COUNT(*) FROM images WHERE task_id = ? GROUP BY 1",
+        (task_id,)
+    )
+    counts = {stage: count for stage, count in c.fetchall()}
+    
+    conn.close()
+    
+    return counts
+
+def claim_work_items(worker_id, task_id=None, limit=1, lease_seconds=None):
+    """
+    Lease pending work items to a worker
+    
+    The select and update run in one write transaction, so two workers (or two
+    processes sharing the database file) can never lease the same item.
+    
+    Returns:
+        list: dicts with the work item id, task id and the image's id, path, description,
+              upload variant path, perceptual hash and the results of its completed stages
+    """
+    if lease_seconds is None:
+        lease_seconds = config.WORK_LEASE_SECONDS
+    
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        
+        query = """
+            SELECT w.id, w.task_id, i.id, i.image_path, i.description, i.upload_path, i.phash,
+                   i.stage, i.imgbb_url, i.url_expires_at, i.search_results, i.analysis, i.claude_batch_id
+            FROM work_items w
+            JOIN images i ON i.id = w.image_id
+            JOIN tasks t ON t.id = w.task_id
+            WHERE w.status = 'pending' AND t.is_cancelled = 0
+        """
+        params = []
+        if task_id is not None:
+            query += " AND w.task_id = ?"
+            params.append(task_id)
+        query += " ORDER BY w.id LIMIT ?"
+        params.append(limit)
+        
+        c.execute(query, params)
+        rows = c.fetchall()
+        
+        now = time.time()
+        for row in rows:
+            c.execute(
+                """
+                UPDATE work_items
+                SET status = 'leased', lease_owner = ?, lease_expires_at = ?, heartbeat_at = ?,
+                    attempts = attempts + 1
+                WHERE id = ?
+                """,
+                (worker_id, now + lease_seconds, now, row[0])
+            )
+        
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error claiming work items: {e}")
+        rows = []
+    finally:
+        conn.close()
+    
+    return [
+        {
+            "work_id": row[0],
+            "task_id": row[1],
+            "id": row[2],
+            "image_path": row[3],
+            "description": row[4],
+            "upload_path": row[5],
+            "phash": row[6],
+            "stage": row[7],
+            "imgbb_url": row[8],
+            "url_expires_at": row[9],
+            "search_results": row[10],
+            "analysis": row[11],
+            "claude_batch_id": row[12]
+        }
+        for row in rows
+    ]
+
+def heartbeat_work_items(worker_id, work_ids, lease_seconds=None):
+    """Extend the leases a worker holds; returns how many leases were still held"""
+    if not work_ids:
+        return 0
+    if lease_seconds is None:
+        lease_seconds = config.WORK_LEASE_SECONDS
+    
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    now = time.time()
+    placeholders = ",".join("?" for _ in work_ids)
+    c.execute(
+        f"""
+        UPDATE work_items SET lease_expires_at = ?, heartbeat_at = ?
+        WHERE lease_owner = ? AND status = 'leased' AND id IN ({placeholders})
+        """,
+        [now + lease_seconds, now, worker_id] + list(work_ids)
+    )
+    
+    count = c.rowcount
+    conn.commit()
+    conn.close()
+    
+    return count
+
+def complete_work_item(work_id, worker_id, status='done'):
+    """Mark a leased work item as done (or failed) and release its lease"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    c.execute(
+        """
+        UPDATE work_items SET status = ?, lease_owner = NULL, lease_expires_at = NULL, completed_at = ?
+        WHERE id = ? AND lease_owner = ? AND status = 'leased'
+        """,
+        (status, time.time(), work_id, worker_id)
+    )
+    
+    released = c.rowcount == 1
+    conn.commit()
+    conn.close()
+    
+    return released
+
+def reclaim_expired_work(max_attempts=None):
+    """Return work items whose lease expired to the queue, or fail them after too many attempts"""
+    if max_attempts is None:
+        max_attempts = config.WORK_MAX_ATTEMPTS
+    
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    now = time.time()
+    c.execute(
+        """
+        UPDATE images SET stage = 'failed', stage_error = 'Lease expired too many times'
+        WHERE id IN (
+            SELECT image_id FROM work_items 
+            WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?
+        )
+        """,
+        (now, max_attempts)
+    )
+    if c.rowcount:
+        c.execute(
+            """
+            UPDATE tasks SET progress_version = progress_version + 1
+            WHERE id IN (
+                SELECT task_id FROM work_items 
+                WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?
+            )
+            """,
+            (now, max_attempts)
+        )
+    c.execute(
+        """
+        UPDATE work_items
+        SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+            lease_owner = NULL, lease_expires_at = NULL
+        WHERE status = 'leased' AND lease_expires_at < ?
+        """,
+        (max_attempts, now)
+    )
+    
+    count = c.rowcount
+    conn.commit()
+    conn.close()
+    
+    if count:
+        logger.warning(f"Reclaimed {count} work items with expired leases")
+    return count
+
+def get_schedulable_tasks():
+    """
+    Get the tasks that have pending work, for the scheduler
+    
+    Returns:
+        list: dicts with the task id, task type, user id and tier, the number of
+              pending images and when the oldest of them was queued (Unix time)
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute(
+        """
+        SELECT t.id, t.task_type, t.user_id, COUNT(*), MIN(w.created_at), u.tier 
+        FROM work_items w 
+        JOIN tasks t ON t.id = w.task_id
+        LEFT JOIN users u ON u.id = t.user_id
+        WHERE w.status = 'pending' AND t.is_cancelled = 0
+        GROUP BY t.id
+        ORDER BY MIN(w.id)
+        """
+    )
+    rows = c.fetchall()
+    
+    conn.close()
+    
+    return [
+        {
+            "task_id": row[0],
+            "task_type": row[1],
+            "user_id": row[2],
+            "pending": row[3],
+            "queued_at": datetime.strptime(row[4], '%Y-%m-%d %H:%M:%S').timestamp(),
+            "tier": row[5]
+        }
+        for row in rows
+    ]
+
+def get_running_tasks_by_user():
+    """Get the IDs of the tasks each user has images in progress for, across all worker processes"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute(
+        """
+        SELECT DISTINCT t.user_id, t.id FROM work_items w JOIN tasks t ON t.id = w.task_id
+        WHERE w.status = 'leased'
+        """
+    )
+    running = {}
+    for user_id, task_id in c.fetchall():
+        running.setdefault(user_id, set()).add(task_id)
+    
+    conn.close()
+    
+    return running
+
+def get_user_throughput(since):
+    """
+    Get the images each user had processed since a Unix time, with their tier and open work
+    
+    Returns:
+        pd.DataFrame: user_id, username, tier, images_done, running_tasks and queued_tasks per user
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    
+    throughput_df = pd.read_sql_query(
+        """
+        SELECT u.id AS user_id, u.username, u.tier,
+               SUM(CASE WHEN w.status IN ('done', 'failed') AND w.completed_at >= ? THEN 1 ELSE 0 END) AS images_done,
+               COUNT(DISTINCT CASE WHEN w.status = 'leased' THEN w.task_id END) AS running_tasks,
+               COUNT(DISTINCT CASE WHEN w.status = 'pending' THEN w.task_id END) AS queued_tasks
+        FROM users u
+        JOIN tasks t ON t.user_id = u.id
+        JOIN work_items w ON w.task_id = t.id
+        GROUP BY u.id
+        HAVING images_done > 0 OR running_tasks > 0 OR queued_tasks > 0
+        ORDER BY images_done DESC
+        """,
+        conn,
+        params=(since,)
+    )
+    
+    conn.close()
+    
+    return throughput_df
+
+def has_pending_work(task_id):
+    """Check whether a task still has images waiting to be claimed"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute("SELECT 1 FROM work_items WHERE task_id = ? AND status = 'pending' LIMIT 1", (task_id,))
+    result = c.fetchone()
+    
+    conn.close()
+    
+    return result is not None
+
+def try_finalize_task(task_id):
+    """
+    Claim the right to finish a task once none of its work is pending or leased
+    
+    Only one worker can win this, so reports are generated exactly once.
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    c.execute(
+        """
+        UPDATE tasks SET status = 'finalizing'
+        WHERE id = ? AND status IN ('pending', 'processing') AND NOT EXISTS (
+            SELECT 1 FROM work_items WHERE task_id = ? AND status IN ('pending', 'leased')
+        )
+        """,
+        (task_id, task_id)
+    )
+    
+    won = c.rowcount == 1
+    conn.commit()
+    conn.close()
+    
+    return won
+
+def get_pending_task_count():
+    """Get the number of tasks that still have pending work"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute(
+        """
+        SELECT COUNT(DISTINCT w.task_id) FROM work_items w JOIN tasks t ON t.id = w.task_id
+        WHERE w.status = 'pending' AND t.is_cancelled = 0
+        """
+    )
+    result = c.fetchone()
+    
+    conn.close()
+    
+    return result[0] if result else 0
+
+def get_stalled_tasks():
+    """Get unfinished tasks whose work items are all closed, e.g. after lease reclaims"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute(
+        """
+        SELECT t.id FROM tasks t
+        WHERE t.status IN ('pending', 'processing') AND t.is_cancelled = 0
+          AND EXISTS (SELECT 1 FROM work_items w WHERE w.task_id = t.id)
+          AND NOT EXISTS (
+              SELECT 1 FROM work_items w WHERE w.task_id = t.id AND w.status IN ('pending', 'leased')
+          )
+        """
+    )
+    task_ids = [row[0] for row in c.fetchall()]
+    
+    conn.close()
+    
+    return task_ids
+
+def get_work_queue_stats():
+    """Get the number of work items in each status"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute("SELECT status, COUNT(*) FROM work_items GROUP BY status")
+    stats = {status: count for status, count in c.fetchall()}
+    
+    conn.close()
+    
+    return stats
+
+def reserve_rate_tokens(bucket_key, capacity, reserve):
+    """
+    Apply a token-bucket reservation to a shared bucket
+    
+    The bucket is read and written inside one write transaction, so concurrent
+    processes see a consistent bucket. A missing bucket starts full.
+    
+    Args:
+        bucket_key (str): Bucket identifier
+        capacity (float): Level of a new bucket
+        reserve (callable): (tokens, updated_at, now) -> (new level, wait, granted),
+            the rule of ratelimit.reserve_tokens
+    
+    Returns:
+        tuple: (seconds to wait, whether the tokens were taken)
+    
+    Raises:
+        sqlite3.Error: If the bucket could not be updated (e.g. the database stayed locked)
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        
+        now = time.time()
+        c.execute("SELECT tokens, updated_at FROM rate_limit_buckets WHERE bucket_key = ?", (bucket_key,))
+        result = c.fetchone()
+        tokens, updated_at = result if result else (capacity, now)
+        
+        tokens, wait, granted = reserve(tokens, updated_at, now)
+        
+        c.execute(
+            "INSERT OR REPLACE INTO rate_limit_buckets (bucket_key, tokens, updated_at) VALUES (?, ?, ?)",
+            (bucket_key, tokens, now)
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error reserving rate limit tokens: {e}")
+        raise
+    finally:
+        conn.close()
+    
+    return wait, granted
+
+def get_cached_result(image_hash):
+    """Get the cached API results of an image and mark the entry as used"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    c.execute(
+        "SELECT imgbb_url, imgbb_expires_at, search_results, analysis FROM result_cache WHERE image_hash = ?",
+        (image_hash,)
+    )
+    result = c.fetchone()
+    
+    if result:
+        c.execute(
+            "UPDATE result_cache SET hits = hits + 1, last_used_at = ? WHERE image_hash = ?",
+            (time.time(), image_hash)
+        )
+        conn.commit()
+    
+    conn.close()
+    
+    if not result:
+        return None
+    
+    return {
+        'imgbb_url': result[0],
+        'imgbb_expires_at': result[1],
+        'search_results': result[2],
+        'analysis': result[3]
+    }
+
+def save_cached_result(image_hash, imgbb_url=None, imgbb_expires_at=None, search_results=None, analysis=None):
+    """Insert or update a cache entry; fields left as None keep their cached value"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    now = time.time()
+    
+    try:
+        c.execute(
+            """
+            INSERT INTO result_cache 
+                (image_hash, imgbb_url, imgbb_expires_at, search_results, analysis, updated_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (image_hash) DO UPDATE SET
+                imgbb_url = COALESCE(excluded.imgbb_url, imgbb_url),
+                imgbb_expires_at = COALESCE(excluded.imgbb_expires_at, imgbb_expires_at),
+                search_results = COALESCE(excluded.search_results, search_results),
+                analysis = COALESCE(excluded.analysis, analysis),
+                updated_at = excluded.updated_at,
+                last_used_at = excluded.last_used_at
+            """,
+            (image_hash, imgbb_url, imgbb_expires_at, search_results, analysis, now, now)
+        )
+        c.execute(
+            """
+            UPDATE result_cache 
+            SET size_bytes = LENGTH(COALESCE(imgbb_url, '')) + LENGTH(COALESCE(search_results, '')) 
+                           + LENGTH(COALESCE(analysis, ''))
+            WHERE image_hash = ?
+            """,
+            (image_hash,)
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error saving cached result: {e}")
+    finally:
+        conn.close()
+
+def evict_cached_results(max_age, max_entries, max_bytes):
+    """
+    Delete cache entries older than max_age seconds, then the least recently
+    used ones until the cache is within max_entries and max_bytes
+    
+    Returns:
+        int: Number of entries deleted
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    deleted = 0
+    
+    try:
+        c.execute("DELETE FROM result_cache WHERE updated_at < ?", (time.time() - max_age,))
+        deleted += c.rowcount
+        
+        c.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM result_cache")
+        entries, total_bytes = c.fetchone()
+        
+        if entries > max_entries or total_bytes > max_bytes:
+            c.execute("SELECT image_hash, size_bytes FROM result_cache ORDER BY last_used_at")
+            evicted = []
+            for image_hash, size_bytes in c.fetchall():
+                if entries <= max_entries and total_bytes <= max_bytes:
+                    break
+                evicted.append((image_hash,))
+                entries -= 1
+                total_bytes -= size_bytes or 0
+            
+            c.executemany("DELETE FROM result_cache WHERE image_hash = ?", evicted)
+            deleted += len(evicted)
+        
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error evicting cached results: {e}")
+    finally:
+        conn.close()
+    
+    return deleted
+
+def get_result_cache_stats():
+    """Get the number of entries, total size and total hits of the result cache"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(hits), 0) FROM result_cache")
+    entries, size_bytes, hits = c.fetchone()
+    conn.close()
+    
+    return {"entries": entries, "size_bytes": size_bytes, "hits": hits}
+
+def get_memoized_analysis(memo_key, created_after):
+    """Get a memoized Claude analysis created after the given time and mark it as used"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    c.execute(
+        "SELECT analysis FROM claude_memo WHERE memo_key = ? AND created_at > ?",
+        (memo_key, created_after)
+    )
+    result = c.fetchone()
+    
+    if result:
+        c.execute(
+            "UPDATE claude_memo SET hits = hits + 1, last_used_at = ? WHERE memo_key = ?",
+            (time.time(), memo_key)
+        )
+        conn.commit()
+    
+    conn.close()
+    
+    return result[0] if result else None
+
+def save_memoized_analysis(memo_key, config_hash, analysis):
+    """Insert or replace a memoized Claude analysis"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    now = time.time()
+    
+    try:
+        c.execute(
+            """
+            INSERT OR REPLACE INTO claude_memo (memo_key, config_hash, analysis, hits, created_at, last_used_at)
+            VALUES (?, ?, ?, 0, ?, ?)
+            """,
+            (memo_key, config_hash, analysis, now, now)
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error saving memoized analysis: {e}")
+    finally:
+        conn.close()
+
+def evict_memoized_analyses(config_hashes, ttl, max_entries):
+    """
+    Delete memoized analyses made with a model or prompt template not among
+    config_hashes, those older than ttl seconds, then the least recently used
+    beyond max_entries
+    
+    Returns:
+        int: Number of entries deleted
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    deleted = 0
+    
+    try:
+        c.execute(
+            f"DELETE FROM claude_memo WHERE config_hash NOT IN ({','.join('?' * len(config_hashes))}) OR created_at < ?",
+            (*config_hashes, time.time() - ttl)
+        )
+        deleted += c.rowcount
+        
+        c.execute(
+            """
+            DELETE FROM claude_memo WHERE memo_key IN (
+                SELECT memo_key FROM claude_memo ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (max_entries,)
+        )
+        deleted += c.rowcount
+        
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error evicting memoized analyses: {e}")
+    finally:
+        conn.close()
+    
+    return deleted
+
+def get_claude_memo_stats():
+    """Get the number of memoized analyses and their total hits"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM claude_memo")
+    entries, hits = c.fetchone()
+    conn.close()
+    
+    return {"entries": entries, "hits": hits}
+
+def save_stage_metrics(rows):
+    """
+    Store stage timings
+    
+    Args:
+        rows (list): (task_id, image_id, stage, started_at, ended_at, attempts, bytes, outcome) tuples
+    """
+    if not rows:
+        return
+    
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    try:
+        c.executemany(
+            """
+            INSERT INTO stage_metrics (task_id, image_id, stage, started_at, ended_at, attempts, bytes, outcome)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error saving stage metrics: {e}")
+    finally:
+        conn.close()
+
+def prune_stage_metrics(before):
+    """Delete stage timings that ended before a Unix time; returns how many were deleted"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    deleted = 0
+    
+    try:
+        c.execute("DELETE FROM stage_metrics WHERE ended_at < ?", (before,))
+        deleted = c.rowcount
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error pruning stage metrics: {e}")
+    finally:
+        conn.close()
+    
+    return deleted
+
+def get_task_stage_metrics(task_id):
+    """
+    Get the stage timings of a task in start order
+    
+    Returns:
+        pd.DataFrame: image_id, stage, started_at, ended_at, attempts, bytes and outcome per stage run
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    
+    metrics_df = pd.read_sql_query(
+        """
+        SELECT image_id, stage, started_at, ended_at, attempts, bytes, outcome
+        FROM stage_metrics
+        WHERE task_id = ?
+        ORDER BY started_at
+        """,
+        conn,
+        params=(task_id,)
+    )
+    
+    conn.close()
+    
+    return metrics_df
+
+def get_stage_durations(since):
+    """
+    Get the duration of every stage run that ended since a Unix time
+    
+    Returns:
+        pd.DataFrame: stage, ended_at, duration (seconds) and outcome per stage run
+    """
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    
+    durations_df = pd.read_sql_query(
+        """
+        SELECT stage, ended_at, ended_at - started_at AS duration, outcome
+        FROM stage_metrics
+        WHERE ended_at >= ?
+        """,
+        conn,
+        params=(since,)
+    )
+    
+    conn.close()
+    
+    return durations_df
+
+def save_claude_batch(batch_id, task_id, image_ids):
+    """Record a submitted Claude Message Batch and the images it analyses"""
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=30)
+    c = conn.cursor()
+    
+    try:
+        c.execute(
+            "INSERT OR REPLACE INTO claude_batches (batch_id, task_id, request_count, submitted_at) VALUES (?, ?, ?, ?)",
+            (batch_id, task_id, len(image_ids), time.time())
+        )
+        c.executemany("UPDATE images SET claude_batch_id = ? WHERE id = ?", [(batch_id, image_id) for image_id in image_ids])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error saving Claude batch {batch_id}: {e}")
+    finally:
+        conn.close()
+
+def get_claude_batch_submitted_at(batch_id):
+    """Get the Unix time a Claude Message Batch was submitted, or None if unknown"""
+    conn = sqlite3.connect(config.DATABASE_PATH)
+    c = conn.cursor()
+    
+    c.execute("SELECT submitted_at FROM claude_batches WHERE batch_id = ?", (batch_id,))
+    result = c.fetchone()
+    
+    conn.close()
+    
+    return result[0] if result else None
@@ -0,0 +1,105 @@
+import logging
+import queue
+import threading
+import time
+
+# Import local modules
+import config
+import database as db
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# A task in one of these states will not change again on its own
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+# Event queues of this process's subscribers, by task ID
+_subscribers = {}
+_subscribers_lock = threading.Lock()
+
+def publish(task_id, kind, **data):
+    """
+    Notify this process's subscribers of a task's progress
+
+    kind is "task" (data: status) or "image" (data: image_id, stage and, for
+    failed images, error). Publishing to a task nobody watches costs nothing.
+    """
+    with _subscribers_lock:
+        subscriptions = list(_subscribers.get(task_id, ()))
+    if not subscriptions:
+        return
+
+    event = dict(data, task_id=task_id, kind=kind, time=time.time())
+    for subscription in subscriptions:
+        subscription.put_nowait(event)
+
+def subscribe(task_id):
+    """Get a queue receiving the events published for a task from now on"""
+    subscription = queue.Queue()
+    with _subscribers_lock:
+        _subscribers.setdefault(task_id, set()).add(subscription)
+    return subscription
+
+def unsubscribe(task_id, subscription):
+    """Stop delivering a task's events to a queue returned by subscribe"""
+    with _subscribers_lock:
+        subscriptions = _subscribers.get(task_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del _subscribers[task_id]
+
+def wait_for_task(task_id, timeout=None, on_progress=None):
+    """
+    Block until a task reaches a terminal status
+
+    Workers in this process wake the caller as soon as they publish an event.
+    Workers in another process cannot, so after TASK_EVENT_FALLBACK_INTERVAL
+    seconds without an event the task's status and progress_version are read
+    from the database instead, and its stage counts only when the version
+    changed. It is also read once up front, in case the task finished before
+    we subscribed.
+
+    Args:
+        task_id (int): Task to wait for
+        timeout (float): Give up after this many seconds (None waits indefinitely)
+        on_progress (callable): Called with each event; database reads produce
+            {"kind": "stages", "stages": {stage: image count}} events, only when the counts change
+
+    Returns:
+        str: The terminal status, or the last status seen if the task was deleted or timeout expired
+    """
+    subscription = subscribe(task_id)
+    deadline = None if timeout is None else time.time() + timeout
+    stages = None
+    counted_version = None
+
+    try:
+        status, version = db.get_task_progress(task_id)
+        while status is not None and status not in TERMINAL_STATUSES:
+            wait = config.TASK_EVENT_FALLBACK_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    break
+
+            try:
+                event = subscription.get(timeout=wait)
+            except queue.Empty:
+                # No event: the task may be processed by another process
+                status, version = db.get_task_progress(task_id)
+                if on_progress is not None and version != counted_version:
+                    counted_version = version
+                    counts = db.get_task_stage_counts(task_id)
+                    if counts != stages:
+                        stages = counts
+                        on_progress({"task_id": task_id, "kind": "stages", "stages": counts, "time": time.time()})
+                continue
+
+            if event['kind'] == 'task':
+                status = event['status']
+            if on_progress is not None:
+                on_progress(event)
+        return status
+    finally:
+        unsubscribe(task_id, subscription)
@@ -0,0 +1,188 @@
+import hashlib
+import hmac
+import logging
+import mimetypes
+import os
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+# Import local modules
+import config
+import database as db
+import async_engine
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# URL path under which the local image server publishes UPLOAD_DIR
+IMAGE_PATH_PREFIX = "/images/"
+
+class ImageHost:
+    """
+    Makes an image reachable by URL so SearchAPI can fetch it
+
+    Attributes:
+        name (str): Backend name, as set in IMAGE_HOST_BACKEND
+        url_ttl (int): Seconds a published URL stays valid (None = forever)
+        external (bool): Whether publishing calls an external service
+    """
+    name = None
+    url_ttl = None
+    external = False
+
+    async def publish(self, image_path, api_keys):
+        """Get a URL for the image, or None on failure"""
+        raise NotImplementedError
+
+class ImgBBHost(ImageHost):
+    """Upload the image to ImgBB; it is deleted there after IMGBB_EXPIRATION seconds"""
+    name = "imgbb"
+    external = True
+
+    @property
+    def url_ttl(self):
+        return config.IMGBB_EXPIRATION or None
+
+    async def publish(self, image_path, api_keys):
+        # Streamed from the stored file rather than sent from memory
+        return await async_engine.upload_to_imgbb_async(image_path, api_keys['IMGBB_API_KEY'])
+
+class LocalImageHost(ImageHost):
+    """Serve the stored file from this app's own image server through a signed, expiring URL"""
+    name = "local"
+
+    @property
+    def url_ttl(self):
+        return config.IMAGE_HOST_URL_TTL
+
+    async def publish(self, image_path, api_keys):
+        if not config.IMAGE_HOST_PUBLIC_URL:
+            logger.error("IMAGE_HOST_PUBLIC_URL is not set; SearchAPI cannot reach locally hosted images")
+            return None
+        return signed_url(image_path)
+
+_hosts = {host.name: host for host in (ImgBBHost(), LocalImageHost())}
+
+def get_image_host():
+    """Get the image host selected by IMAGE_HOST_BACKEND"""
+    try:
+        return _hosts[config.IMAGE_HOST_BACKEND]
+    except KeyError:
+        raise ValueError(f"Unknown IMAGE_HOST_BACKEND: {config.IMAGE_HOST_BACKEND}")
+
+_secret = None
+_secret_lock = threading.Lock()
+
+def _get_secret():
+    """Signing key shared by every process: IMAGE_HOST_SECRET, or one generated and kept in the database"""
+    global _secret
+
+    with _secret_lock:
+        if _secret is None:
+            _secret = config.IMAGE_HOST_SECRET or db.get_system_setting('image_host_secret')
+            if not _secret:
+                db.update_system_setting(
+                    'image_host_secret',
+                    secrets.token_hex(32),
+                    'Signing key of locally hosted image URLs'
+                )
+                # Re-read in case another process created it first
+                _secret = db.get_system_setting('image_host_secret')
+        return _secret.encode('utf-8')
+
+def _signature(relative_path, expires):
+    """HMAC of a relative image path and its expiry time"""
+    message = f"{relative_path}:{expires}".encode('utf-8')
+    return hmac.new(_get_secret(), message, hashlib.sha256).hexdigest()
+
+def signed_url(image_path, ttl=None):
+    """Public URL of a file in UPLOAD_DIR that the local image server accepts until it expires"""
+    relative_path = os.path.relpath(os.path.abspath(image_path), os.path.abspath(config.UPLOAD_DIR))
+    relative_path = relative_path.replace(os.sep, '/')
+    expires = int(time.time() + (ttl or config.IMAGE_HOST_URL_TTL))
+
+    return (
+        f"{config.IMAGE_HOST_PUBLIC_URL.rstrip('/')}{IMAGE_PATH_PREFIX}{quote(relative_path)}"
+        f"?expires={expires}&sig={_signature(relative_path, expires)}"
+    )
+
+def verify_request(path):
+    """
+    Check a request path against its signature and expiry
+
+    Returns:
+        tuple: (HTTP status, absolute file path or None)
+    """
+    url = urlsplit(path)
+    if not url.path.startswith(IMAGE_PATH_PREFIX):
+        return 404, None
+
+    relative_path = unquote(url.path[len(IMAGE_PATH_PREFIX):])
+    query = parse_qs(url.query)
+    try:
+        expires = int(query['expires'][0])
+        signature = query['sig'][0]
+    except (KeyError, IndexError, ValueError):
+        return 403, None
+
+    if not hmac.compare_digest(signature, _signature(relative_path, expires)):
+        return 403, None
+    if expires < time.time():
+        return 410, None
+
+    # The signature covers the path, but never serve anything outside UPLOAD_DIR
+    upload_dir = os.path.abspath(config.UPLOAD_DIR)
+    file_path = os.path.abspath(os.path.join(upload_dir, relative_path))
+    if os.path.commonpath([upload_dir, file_path]) != upload_dir or not os.path.isfile(file_path):
+        return 404, None
+
+    return 200, file_path
+
+class _ImageRequestHandler(BaseHTTPRequestHandler):
+    """Serves signed image URLs and nothing else"""
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body):
+        status, file_path = verify_request(self.path)
+        if status != 200:
+            self.send_error(status)
+            return
+
+        with open(file_path, 'rb') as image_file:
+            data = image_file.read()
+
+        self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(file_path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "private, max-age=300")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Image server: {format % args}")
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_image_server(host=None, port=None):
+    """Start the local image server in a daemon thread (only the first call per process starts it)"""
+    global _server
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(
+                (host or config.IMAGE_HOST_BIND, port or config.IMAGE_HOST_PORT),
+                _ImageRequestHandler
+            )
+            threading.Thread(target=_server.serve_forever, name="image-server", daemon=True).start()
+            logger.info(f"Image server listening on port {_server.server_address[1]}")
+        return _server
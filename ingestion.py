@@ -0,0 +1,86 @@
+import io
+import os
+import uuid
+import logging
+
+from PIL import Image
+
+# Import local modules
+import config
+import similarity
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+def _flatten(img):
+    """Convert to RGB, putting transparent images on a white background (JPEG has no alpha)"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, (0, 0), img)
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+def variant_paths(master_path):
+    """Paths of the derived variants stored next to a master image"""
+    base, ext = os.path.splitext(master_path)
+    return {
+        "upload_path": f"{base}_upload{ext}",
+        "thumbnail_path": f"{base}_thumb{ext}"
+    }
+
+def ingest_image(img_data):
+    """
+    Decode an uploaded image once and write every variant the app needs
+
+    JPEGs are decoded in draft mode, which lets the decoder scale down by up
+    to 8x while decoding instead of producing full-size pixels first. From the
+    one decoded image we write, each derived from the previous in memory:
+      - the master (at most MAX_IMAGE_SIZE), shown in the UI and hashed
+      - the upload variant (at most UPLOAD_IMAGE_SIZE), sent to the image host
+      - the thumbnail (THUMBNAIL_SIZE), used by reports and image grids
+    The perceptual hash is taken from the same decoded pixels.
+
+    Returns:
+        dict: id, path (the master), upload_path, thumbnail_path and phash (hex)
+    """
+    img_id = str(uuid.uuid4())
+    os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+    path = f"{config.UPLOAD_DIR}/{img_id}.jpg"
+    paths = variant_paths(path)
+
+    with Image.open(io.BytesIO(img_data)) as original:
+        # Scale down during decode (JPEG only; a no-op for other formats)
+        original.draft('RGB', config.MAX_IMAGE_SIZE)
+        original.load()
+        master = _flatten(original)
+        master.thumbnail(config.MAX_IMAGE_SIZE)
+
+    master.save(path, "JPEG", quality=config.MASTER_JPEG_QUALITY)
+
+    upload = master.copy()
+    upload.thumbnail(config.UPLOAD_IMAGE_SIZE)
+    upload.save(paths["upload_path"], "JPEG", quality=config.UPLOAD_JPEG_QUALITY, optimize=True)
+
+    thumbnail = upload.copy()
+    thumbnail.thumbnail(config.THUMBNAIL_SIZE)
+    thumbnail.save(paths["thumbnail_path"], "JPEG", quality=config.THUMBNAIL_JPEG_QUALITY)
+
+    return {
+        "id": img_id,
+        "path": path,
+        "upload_path": paths["upload_path"],
+        "thumbnail_path": paths["thumbnail_path"],
+        "phash": f"{similarity.dhash_image(master):016x}"
+    }
+
+def remove_image_files(path):
+    """Delete a master image and its variants from disk"""
+    for file_path in [path, *variant_paths(path).values()]:
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except OSError as e:
+            logger.error(f"Error deleting image file {file_path}: {e}")
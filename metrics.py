@@ -0,0 +1,161 @@
+import contextlib
+import logging
+import threading
+import time
+
+import pandas as pd
+
+# Import local modules
+import config
+import database as db
+import retry
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Pipeline and task stages in processing order, for display
+STAGES = ("upload", "search", "analysis", "db_write", "reports")
+OUTCOMES = ("ok", "skipped", "error")
+
+# Timings not yet written to the database
+_buffer = []
+_buffer_lock = threading.Lock()
+_last_prune = 0.0
+
+class StageTimer:
+    """
+    Times one run of a stage over one or more items (images)
+
+    Provider calls attempted while the timer runs, retries included, are counted
+    through retry.call_attempts, so start and stop it in the same thread or
+    coroutine as the stage. Stages attach byte counts and non-default outcomes
+    to an item with note().
+    """
+
+    def __init__(self, stage, items):
+        self.stage = stage
+        self.started_at = time.time()
+        self.attempts = [0]
+        self._failed_before = {id(item) for item in items if item.get('error')}
+        self._reset = retry.call_attempts.set(self.attempts)
+
+    def stop(self, items, error=None):
+        """Record the run for each item; error is the exception the stage raised, if any"""
+        retry.call_attempts.reset(self._reset)
+        ended_at = time.time()
+
+        for item in items:
+            details = item.pop('stage_metrics', {})
+            if error is not None or (item.get('error') and id(item) not in self._failed_before):
+                outcome = "error"
+            else:
+                outcome = details.get('outcome', "ok")
+            record(
+                item.get('task_id'), item.get('id'), self.stage, self.started_at, ended_at,
+                attempts=self.attempts[0], size_bytes=details.get('bytes'), outcome=outcome
+            )
+
+def note(item, **details):
+    """Attach bytes or an outcome ("skipped", "error") to the timing of the stage running on item"""
+    item.setdefault('stage_metrics', {}).update(details)
+
+@contextlib.contextmanager
+def timed(task_id, stage, image_id=None):
+    """Time a block of work as a stage; yields an item to pass to note()"""
+    item = {"task_id": task_id, "id": image_id}
+    timer = StageTimer(stage, [item])
+    try:
+        yield item
+    except Exception as e:
+        timer.stop([item], e)
+        raise
+    timer.stop([item])
+
+def record(task_id, image_id, stage, started_at, ended_at, attempts=0, size_bytes=None, outcome="ok"):
+    """Buffer one stage timing; written by the next flush"""
+    with _buffer_lock:
+        _buffer.append((task_id, image_id, stage, started_at, ended_at, attempts, size_bytes, outcome))
+
+def flush(force=True):
+    """Write buffered timings (unless force is False and fewer than STAGE_METRICS_FLUSH_SIZE are buffered)"""
+    global _buffer
+
+    with _buffer_lock:
+        if not _buffer or (not force and len(_buffer) < config.STAGE_METRICS_FLUSH_SIZE):
+            return
+        rows, _buffer = _buffer, []
+
+    db.save_stage_metrics(rows)
+    _maybe_prune()
+
+def _maybe_prune():
+    """Delete expired timings if the last pass is more than STAGE_METRICS_PRUNE_INTERVAL old"""
+    global _last_prune
+
+    with _buffer_lock:
+        if time.time() - _last_prune < config.STAGE_METRICS_PRUNE_INTERVAL:
+            return
+        _last_prune = time.time()
+
+    deleted = db.prune_stage_metrics(time.time() - config.STAGE_METRICS_RETENTION)
+    if deleted:
+        logger.info(f"Pruned {deleted} expired stage timings")
+
+def get_task_waterfall(task_id):
+    """
+    Get a task's stage timings relative to the task's first stage
+
+    Returns:
+        pd.DataFrame: the columns of db.get_task_stage_metrics plus image (a label),
+                      start and end (seconds since the first stage started) and duration
+    """
+    waterfall_df = db.get_task_stage_metrics(task_id)
+    if waterfall_df.empty:
+        return waterfall_df
+
+    origin = waterfall_df['started_at'].min()
+    waterfall_df['image'] = [
+        f"Image {int(image_id)}" if pd.notna(image_id) else "Task" for image_id in waterfall_df['image_id']
+    ]
+    waterfall_df['start'] = waterfall_df['started_at'] - origin
+    waterfall_df['end'] = waterfall_df['ended_at'] - origin
+    waterfall_df['duration'] = waterfall_df['ended_at'] - waterfall_df['started_at']
+    return waterfall_df
+
+def get_stage_percentiles(window):
+    """
+    Get latency percentiles of each stage over the last window seconds
+
+    Skipped runs (results restored or cached) are left out, as they did no work.
+
+    Returns:
+        pd.DataFrame: stage, runs, errors, p50, p95 and p99 (seconds) per stage
+    """
+    durations_df = db.get_stage_durations(time.time() - window)
+    durations_df = durations_df[durations_df['outcome'] != "skipped"]
+    if durations_df.empty:
+        return pd.DataFrame(columns=["stage", "runs", "errors", "p50", "p95", "p99"])
+
+    grouped = durations_df.groupby('stage')['duration']
+    stats_df = grouped.quantile([0.5, 0.95, 0.99]).unstack()
+    stats_df.columns = ["p50", "p95", "p99"]
+    stats_df.insert(0, "runs", grouped.size())
+    stats_df.insert(1, "errors", durations_df[durations_df['outcome'] == "error"].groupby('stage').size())
+    stats_df['errors'] = stats_df['errors'].fillna(0).astype(int)
+    return stats_df.reset_index()
+
+def get_stage_trend(window, quantile=0.95, buckets=24):
+    """
+    Get a latency percentile of each stage over the last window seconds, split into time buckets
+
+    Returns:
+        pd.DataFrame: one row per bucket start time (index) and one column per stage
+    """
+    durations_df = db.get_stage_durations(time.time() - window)
+    durations_df = durations_df[durations_df['outcome'] != "skipped"]
+    if durations_df.empty:
+        return pd.DataFrame()
+
+    bucket_seconds = window / buckets
+    durations_df['bucket'] = pd.to_datetime((durations_df['ended_at'] // bucket_seconds) * bucket_seconds, unit='s')
+    return durations_df.groupby(['bucket', 'stage'])['duration'].quantile(quantile).unstack('stage')
@@ -0,0 +1,172 @@
+import asyncio
+import concurrent.futures
+import logging
+
+# Import local modules
+import config
+import async_engine
+import cancellation
+import metrics
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Sentinel telling a stage worker to shut down
+_STOP = object()
+
+def _check_cancelled(token):
+    """End the pipeline (by cancelling its task) once the token is cancelled"""
+    if token is not None and token.cancelled:
+        raise asyncio.CancelledError()
+
+async def _stage_worker(name, func, inbox, outbox, token=None):
+    """Take items from inbox, run them through func and hand them to outbox"""
+    while True:
+        item = await inbox.get()
+        if item is _STOP:
+            break
+        _check_cancelled(token)
+
+        timer = metrics.StageTimer(name, [item])
+        error = None
+        try:
+            if asyncio.iscoroutinefunction(func):
+                item = await func(item)
+            else:
+                # Blocking stages (file and DB work) run on the engine's thread pool
+                item = await asyncio.to_thread(func, item)
+        except Exception as e:
+            logger.error(f"Pipeline stage '{name}' failed for image {item.get('id')}: {str(e)}")
+            item['error'] = str(e)
+            error = e
+        timer.stop([item], error)
+
+        await outbox.put(item)
+
+async def _packed_stage_worker(name, func, fits, inbox, outbox, token=None):
+    """
+    Like _stage_worker, but hand func a list of items at a time
+
+    A pack starts with the next item and takes more while fits(pack, item)
+    allows, waiting up to PIPELINE_PACK_LINGER seconds for stragglers.
+    """
+    loop = asyncio.get_running_loop()
+    pending = None
+
+    while True:
+        item = pending if pending is not None else await inbox.get()
+        pending = None
+        if item is _STOP:
+            break
+
+        pack = [item]
+        deadline = loop.time() + config.PIPELINE_PACK_LINGER
+        while True:
+            try:
+                candidate = await asyncio.wait_for(inbox.get(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+            if candidate is _STOP or not fits(pack, candidate):
+                pending = candidate
+                break
+            pack.append(candidate)
+
+        _check_cancelled(token)
+        timer = metrics.StageTimer(name, pack)
+        error = None
+        try:
+            pack = await func(pack)
+        except Exception as e:
+            logger.error(f"Pipeline stage '{name}' failed for images {[i.get('id') for i in pack]}: {str(e)}")
+            for packed_item in pack:
+                packed_item['error'] = str(e)
+            error = e
+        timer.stop(pack, error)
+
+        for packed_item in pack:
+            await outbox.put(packed_item)
+
+async def run_stages_async(items, stages, token=None, lane=None):
+    """Coroutine version of run_stages; must run on the I/O engine loop"""
+    # Stage workers started below inherit the lane, and with it their share of provider slots
+    if lane is not None:
+        async_engine.current_lane.set(lane)
+
+    # One bounded inbox per stage, plus an unbounded outbox for the results
+    queues = [asyncio.Queue(maxsize=config.PIPELINE_QUEUE_SIZE) for _ in stages]
+    results = asyncio.Queue()
+
+    stage_tasks = []
+    for i, (name, func, worker_count, *packing) in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else results
+        if packing:
+            workers = [
+                _packed_stage_worker(name, func, packing[0], queues[i], outbox, token) 
+                for _ in range(max(1, worker_count))
+            ]
+        else:
+            workers = [_stage_worker(name, func, queues[i], outbox, token) for _ in range(max(1, worker_count))]
+        stage_tasks.append([asyncio.ensure_future(worker) for worker in workers])
+
+    try:
+        # Feed the first stage; items may come from a blocking iterator (e.g. database
+        # claims), so advance it on the thread pool
+        iterator = iter(items)
+        while True:
+            _check_cancelled(token)
+            item = await asyncio.to_thread(next, iterator, _STOP)
+            if item is _STOP:
+                break
+            await queues[0].put(item)
+
+        # Shut stages down in order so every item drains into the next stage first
+        for i, tasks in enumerate(stage_tasks):
+            for _ in tasks:
+                await queues[i].put(_STOP)
+            await asyncio.gather(*tasks)
+    finally:
+        # On cancellation, abort the requests the stage workers have in flight
+        for task in (task for tasks in stage_tasks for task in tasks):
+            task.cancel()
+
+    output = []
+    while not results.empty():
+        output.append(results.get_nowait())
+    return output
+
+def run_stages(items, stages, token=None, lane=None):
+    """
+    Push items through a chain of stages, each with its own bounded worker pool
+
+    Every stage owns a queue and a set of workers, so while one image is in the
+    last stage the next ones are already being handled by earlier stages. Stage
+    workers are coroutines on the shared I/O engine loop: coroutine functions are
+    awaited directly, plain functions run on the engine's thread pool.
+
+    Args:
+        items (iterable): Work items (dicts); each stage receives and returns one
+        stages (list): (name, func, worker_count) tuples in execution order; a
+            fourth element fits(pack, item) makes a packed stage, whose func
+            receives and returns a list of items (a coroutine function)
+        token (CancellationToken): Optional; once cancelled, no stage starts on
+            another item and requests in flight are aborted
+        lane (str): Scheduling lane of the work; background work cannot use the
+            provider slots reserved for interactive work (ASYNC_INTERACTIVE_RESERVED)
+
+    Returns:
+        list: The items that came out of the last stage (order not preserved)
+
+    Raises:
+        cancellation.TaskCancelled: If the token was cancelled before all items were through
+    """
+    if token is None:
+        return async_engine.run_sync(run_stages_async(items, stages, lane=lane))
+
+    future = async_engine.submit(run_stages_async(items, stages, token, lane))
+    token.add_callback(future.cancel)
+    try:
+        return future.result()
+    except concurrent.futures.CancelledError:
+        raise cancellation.TaskCancelled(token.task_id)
+    finally:
+        token.remove_callback(future.cancel)
@@ -1,163 +1,507 @@
-import requests
-import base64
 import io
-import json
 from PIL import Image
 import time
-import anthropic
 import os
+import asyncio
 import queue
 import threading
-import uuid
 from datetime import datetime
 import pandas as pd
 import logging
+import functools
+import json
+import itertools
+import socket
+import signal
+import sys
+import argparse
 
 # Import local modules
 import database as db
+import cancellation
+import cpu_pool
+import events
+import ingestion
+import metrics
 import reports
+import scheduler
 import config
 import utils
+import pipeline
+import async_engine
+import clients
+import image_hosts
+import analysis_memo
+import result_cache
+import similarity
 
 # Get logger
 logger = logging.getLogger(__name__)
 
 # Global processing queue
 task_queue = queue.Queue()
-processing_tasks = {}
+processing_tasks = {}  # task_id -> name of the worker processing it
+
+# Task worker pool
+_workers = {}  # worker name -> thread, stop event and usage stats
+_workers_lock = threading.Lock()
+_worker_ids = itertools.count(1)
+_dead_workers = []  # Recently replaced workers, newest last
+_supervisor_stats = {'restarts': 0}
+_supervisor_thread = None
+_pool_lock = threading.Lock()
+_pool_stopping = threading.Event()
 
 def upload_to_imgbb(image_data, api_key):
-    """Upload image to ImgBB and return the URL"""
-    url = "https://api.imgbb.com/1/upload"
-    payload = {
-        'key': api_key,
-        'expiration': config.IMGBB_EXPIRATION,
-        'image': base64.b64encode(image_data).decode('utf-8')
+    """Upload image to ImgBB and return the URL (blocking wrapper around the async engine)"""
+    return async_engine.run_sync(async_engine.upload_to_imgbb_async(image_data, api_key))
+
+def search_api_analysis(imgbb_url, description="", api_key=""):
+    """Get image analysis from SearchAPI (blocking wrapper around the async engine)"""
+    return async_engine.run_sync(async_engine.search_api_analysis_async(imgbb_url, description, api_key))
+
+def claude_analysis(search_results, api_key=""):
+    """Get deeper analysis from Claude API (blocking wrapper around the async engine)"""
+    return async_engine.run_sync(async_engine.claude_analysis_async(search_results, api_key))
+
+def resize_image(img_data, max_size=None):
+    """Resize image while maintaining aspect ratio"""
+    if max_size is None:
+        max_size = config.THUMBNAIL_SIZE
+        
+    img = Image.open(io.BytesIO(img_data))
+    img.thumbnail(max_size)
+    buffered = io.BytesIO()
+    img.save(buffered, format=img.format if img.format else "JPEG")
+    return buffered.getvalue()
+
+def _near_duplicate_results(phash, content_hash):
+    """Get the cached SearchAPI results of the nearest earlier image that looks the same"""
+    for distance, other_hash in similarity.find_similar(phash):
+        if other_hash == content_hash:
+            continue
+        
+        search_results = result_cache.cached_search_results(other_hash)
+        if search_results:
+            logger.info(f"Reusing search results of near-duplicate image {other_hash[:12]} (distance {distance})")
+            return search_results
+    
+    return None
+
+def _restore_checkpoint(item):
+    """
+    Keep the results an earlier run persisted for the image, dropping unusable ones
+    
+    Returns:
+        set: Restored fields (hosted URLs are dropped once they are about to expire,
+             failed analyses are always dropped)
+    """
+    restored = set()
+    
+    expires_at = item.get('url_expires_at')
+    if item.get('imgbb_url') and (expires_at is None or expires_at - time.time() > config.RESULT_CACHE_URL_MARGIN):
+        restored.add('imgbb_url')
+    else:
+        item['imgbb_url'] = None
+    
+    try:
+        item['search_results'] = json.loads(item['search_results']) if item.get('search_results') else None
+    except ValueError:
+        item['search_results'] = None
+    if item['search_results'] is not None:
+        restored.add('search_results')
+    
+    if result_cache.is_cacheable_analysis(item.get('analysis')):
+        restored.add('analysis')
+    else:
+        item['analysis'] = None
+    
+    if restored:
+        logger.info(f"Resuming image {item['id']} after stage '{item.get('stage')}'")
+    return restored
+
+def _identify_image(item):
+    """Hash the image file and collect the results persisted for it, cached for it or for a near-identical image"""
+    item['restored'] = _restore_checkpoint(item)
+    
+    item['image_hash'] = result_cache.file_hash(item['image_path'])
+    cached = {
+        field: value for field, value in result_cache.lookup(item['image_hash']).items() 
+        if item.get(field) is None
     }
+    item.update(cached)
+    item['cached'] = set(cached) | item['restored']
     
-    # Retry mechanism for API calls
-    for attempt in range(config.MAX_RETRIES):
+    # Images ingested before variants existed have no stored hash and are decoded here
+    if item.get('phash'):
+        item['phash'] = int(item['phash'], 16)
+    else:
         try:
-            response = requests.post(url, data=payload)
-            if response.status_code == 200:
-                return response.json()['data']['url']
-            else:
-                logger.error(f"ImgBB upload error (attempt {attempt+1}): {response.text}")
-                time.sleep(config.RETRY_DELAY)
+            item['phash'] = cpu_pool.run(similarity.dhash, item['image_path'])
         except Exception as e:
-            logger.error(f"ImgBB upload exception (attempt {attempt+1}): {str(e)}")
-            time.sleep(config.RETRY_DELAY)
+            logger.warning(f"Could not compute perceptual hash of image {item['id']}: {str(e)}")
+            item['phash'] = None
+            return
     
-    return None
+    # Near-duplicate results are stored under this image's own hash afterwards
+    if config.PHASH_ENABLED and item.get('search_results') is None:
+        search_results = _near_duplicate_results(item['phash'], item['image_hash'])
+        similarity.record_lookup(search_results is not None)
+        if search_results is not None:
+            item['search_results'] = search_results
 
-def search_api_analysis(imgbb_url, description="", api_key=""):
-    """Get image analysis from SearchAPI"""
-    url = "https://www.searchapi.io/api/v1/search"
-    
-    # Prepare search parameters
-    params = config.SEARCHAPI_PARAMS.copy()
-    params.update({
-        "q": description if description else " ",
-        "url": imgbb_url,
-        "api_key": api_key
-    })
-    
-    # Retry mechanism for API calls
-    for attempt in range(config.MAX_RETRIES):
-        try:
-            response = requests.get(url, params=params)
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.error(f"SearchAPI error (attempt {attempt+1}): {response.text}")
-                time.sleep(config.RETRY_DELAY)
-        except Exception as e:
-            logger.error(f"SearchAPI exception (attempt {attempt+1}): {str(e)}")
-            time.sleep(config.RETRY_DELAY)
+async def _upload_stage(item, api_keys):
+    """Pipeline stage: publish the image on the configured image host (unless its results are cached)"""
+    # Later stages skip whatever the cache already has for this picture
+    await asyncio.to_thread(_identify_image, item)
     
-    return None
+    # The hosted URL (kept in the imgbb_url column whatever the host) is only
+    # needed for the reverse image search
+    if item.get('search_results') is None and not item.get('imgbb_url'):
+        host = image_hosts.get_image_host()
+        # The smaller upload variant written at ingestion, for images that have one
+        upload_path = item.get('upload_path')
+        if not upload_path or not os.path.exists(upload_path):
+            upload_path = item['image_path']
+        item['imgbb_url'] = await host.publish(upload_path, api_keys)
+        item['url_ttl'] = host.url_ttl
+        metrics.note(item, bytes=os.path.getsize(upload_path), outcome="ok" if item['imgbb_url'] else "error")
+        
+        if item['imgbb_url']:
+            expires_at = time.time() + host.url_ttl if host.url_ttl else None
+            await asyncio.to_thread(db.save_image_upload, item['id'], item['imgbb_url'], expires_at)
+            events.publish(item['task_id'], "image", image_id=item['id'], stage="uploaded")
+    else:
+        metrics.note(item, outcome="skipped")
+    return item
 
+async def _search_stage(item, api_keys):
+    """Pipeline stage: reverse image search on SearchAPI"""
+    if item.get('search_results') is None and item.get('imgbb_url'):
+        item['search_results'] = await async_engine.search_api_analysis_async(
+            item['imgbb_url'], 
+            item['description'], 
+            api_keys['SEARCHAPI_API_KEY']
+        )
+        if item['search_results'] is None:
+            metrics.note(item, outcome="error")
+    else:
+        metrics.note(item, outcome="skipped")
+    
+    # Checkpoint fetched or cached results so a resumed run skips the search
+    if item.get('search_results') is not None and 'search_results' not in item.get('restored', ()):
+        search_json = json.dumps(item['search_results'])
+        metrics.note(item, bytes=len(search_json))
+        await asyncio.to_thread(db.save_image_search_results, item['id'], search_json)
+        events.publish(item['task_id'], "image", image_id=item['id'], stage="searched")
+    return item
 
-def claude_analysis(search_results, api_key=""):
-    """Get deeper analysis from Claude API using only first 15 search results"""
-    # Extract relevant information from search results
-    filtered_results = []
-    if 'visual_matches' in search_results and search_results['visual_matches']:
-        for match in search_results['visual_matches']:
-            filtered_match = {
-                'title': match.get('title', ''),
-                'source': match.get('source', ''),
-                'price': match.get('price', ''),
-                'currency': match.get('currency', ''),
-                'extracted_price': match.get('extracted_price', '')
-            }
-            filtered_results.append(filtered_match)
-    
-    # Limit to first 15 results
-    filtered_results = filtered_results[:15]
-    
-    # Convert filtered results to a JSON string to ensure we're not passing a list directly
-    filtered_results_json = json.dumps(filtered_results, indent=2)
-    
-    # Format prompt with filtered results
-    prompt = config.CLAUDE_PROMPT_TEMPLATE.format(
-        search_results=filtered_results_json
+async def _analysis_stage(item, api_keys):
+    """Pipeline stage: Claude analysis of the search results"""
+    if _needs_analysis(item):
+        item['analysis'] = await async_engine.claude_analysis_async(
+            item['search_results'], 
+            api_keys['ANTHROPIC_API_KEY']
+        )
+        _note_analysis(item)
+    else:
+        metrics.note(item, outcome="skipped")
+    return item
+
+def _note_analysis(item):
+    """Attach the size and outcome of a fresh analysis to the image's stage timing"""
+    metrics.note(
+        item, 
+        bytes=len(item['analysis'].encode()) if item.get('analysis') else 0, 
+        outcome="ok" if result_cache.is_cacheable_analysis(item.get('analysis')) else "error"
+    )
+
+def _needs_analysis(item):
+    """Check whether an image still needs a Claude analysis"""
+    return item.get('analysis') is None and bool(item.get('search_results'))
+
+def _pack_cost(item):
+    """Estimated tokens an image adds to a packed Claude request"""
+    if not _needs_analysis(item):
+        return 0
+    if 'pack_cost' not in item:
+        filtered_results = async_engine.filter_search_results(item['search_results'])
+        item['pack_cost'] = len(json.dumps(filtered_results, indent=2)) // 4 + config.CLAUDE_PACK_OUTPUT_TOKENS_PER_ITEM
+    return item['pack_cost']
+
+def _fits_pack(pack, item):
+    """Check whether an image can join a packed Claude request without exceeding the limits"""
+    if not _needs_analysis(item):
+        return True  # Passes through without using the request
+    
+    packed = [packed_item for packed_item in pack if _needs_analysis(packed_item)]
+    return (
+        len(packed) < config.CLAUDE_PACK_MAX_ITEMS and
+        sum(_pack_cost(packed_item) for packed_item in packed) + _pack_cost(item) <= config.CLAUDE_PACK_TOKEN_BUDGET
     )
+
+async def _packed_analysis_stage(items, api_keys):
+    """Pipeline stage (packing mode): Claude analysis of several images in one request"""
+    pending = [item for item in items if _needs_analysis(item)]
+    if pending:
+        analyses = await async_engine.claude_packed_analysis_async(
+            [item['search_results'] for item in pending], 
+            api_keys['ANTHROPIC_API_KEY']
+        )
+        for item, analysis in zip(pending, analyses):
+            item['analysis'] = analysis
+            _note_analysis(item)
+    for item in items:
+        if item not in pending:
+            metrics.note(item, outcome="skipped")
+    return items
+
+def _failure_reason(item):
+    """Describe the stage an image without an analysis stopped at"""
+    if not item.get('imgbb_url') and item.get('search_results') is None:
+        return "Publishing the image failed"
+    if item.get('search_results') is None:
+        return "Reverse image search failed"
+    return "No analysis was produced"
+
+def _db_write_stage(item):
+    """Pipeline stage: persist the ImgBB URL, analysis and final stage of the image"""
+    # Fresh URLs were checkpointed by the upload stage; cached ones are written here
+    if item.get('imgbb_url') and 'imgbb_url' in item.get('cached', ()) and 'imgbb_url' not in item.get('restored', ()):
+        db.update_image_with_imgbb_url(item['id'], item['imgbb_url'])
     
-    # Retry mechanism for API calls
-    for attempt in range(config.MAX_RETRIES):
+    if item.get('analysis') is not None:
+        db.update_image_with_analysis(
+            item['id'], 
+            item['analysis'], 
+            failed=not result_cache.is_cacheable_analysis(item['analysis'])
+        )
+        events.publish(item['task_id'], "image", image_id=item['id'], stage="analyzed")
+    elif item.get('error'):
+        db.mark_image_failed(item['id'], item['error'])
+        events.publish(item['task_id'], "image", image_id=item['id'], stage="failed", error=item['error'])
+    
+    # Photos of the same item in a bulk task share the representative's results
+    db.copy_results_to_duplicates(item['id'])
+    
+    if item.get('image_hash') and item.get('phash') is not None:
+        db.update_image_hashes(item['id'], item['image_hash'], f"{item['phash']:016x}")
+    
+    # Cache what this run had to fetch
+    if item.get('image_hash'):
+        fresh = {field: item.get(field) for field in result_cache.FIELDS if field not in item.get('cached', ())}
+        result_cache.store(item['image_hash'], url_ttl=item.get('url_ttl'), **fresh)
+    return item
+
+def _worker_id():
+    """Identify the current worker uniquely across hosts and processes"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+def _claim_images(task_id, worker_id, held, held_lock, name=None):
+    """Lease the task's images one at a time, as the pipeline makes room for them"""
+    while True:
+        items = db.claim_work_items(worker_id, task_id=task_id)
+        if not items:
+            return
+        
+        # Room for another image means the task is moving: keep the worker alive
+        if name is not None:
+            _heartbeat(name)
+        
+        with held_lock:
+            held.add(items[0]['work_id'])
+        yield items[0]
+
+def _lease_keeper(worker_id, held, held_lock, stop_event):
+    """Renew the leases of the images a worker holds until stop_event is set"""
+    while not stop_event.wait(config.WORK_HEARTBEAT_INTERVAL):
+        with held_lock:
+            work_ids = list(held)
+        
         try:
-            client = anthropic.Anthropic(api_key=api_key)
-            
-            message = client.messages.create(
-                model=config.DEFAULT_CLAUDE_MODEL,
-                max_tokens=config.MAX_TOKENS,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            # Get the text content from the response
-            if hasattr(message, 'content') and message.content:
-                # If content is a list of blocks, extract text from them
-                if isinstance(message.content, list):
-                    full_text = ""
-                    for block in message.content:
-                        if hasattr(block, 'text'):
-                            full_text += block.text + "\n\n"
-                        elif isinstance(block, dict) and 'text' in block:
-                            full_text += block['text'] + "\n\n"
-                    return full_text.strip()
-                # If content is a string, return it directly
-                elif isinstance(message.content, str):
-                    return message.content
-                # If content is a single block object, extract its text
-                elif hasattr(message.content, 'text'):
-                    return message.content.text
-                # Last resort: convert whatever we got to string
-                return str(message.content)
-            else:
-                return "Analysis unavailable: No content in response"
-                
+            db.heartbeat_work_items(worker_id, work_ids)
         except Exception as e:
-            logger.error(f"Claude API error (attempt {attempt+1}): {str(e)}")
-            time.sleep(config.RETRY_DELAY)
+            logger.error(f"Lease heartbeat failed for {worker_id}: {str(e)}")
+
+def _release_stage(item, worker_id, held, held_lock, deferred=None, name=None):
+    """
+    Pipeline stage: write the results and mark the image's work item as done
+    
+    In batch mode (deferred is a list) images still waiting for their Claude
+    analysis are set aside instead, keeping their lease. Each image released
+    heartbeats the worker called name.
+    """
+    if name is not None:
+        _heartbeat(name)
+    
+    deferring = deferred is not None and _needs_analysis(item)
+    if item.get('analysis') is None and not deferring:
+        item['error'] = _failure_reason(item)
+    
+    _db_write_stage(item)
+    
+    if deferring:
+        deferred.append(item)
+        return item
+    
+    db.complete_work_item(item['work_id'], worker_id)
     
-    return "Analysis failed after multiple attempts"
+    with held_lock:
+        held.discard(item['work_id'])
+    
+    metrics.flush(force=False)
+    return item
 
-def resize_image(img_data, max_size=None):
-    """Resize image while maintaining aspect ratio"""
-    if max_size is None:
-        max_size = config.THUMBNAIL_SIZE
+def _submit_claude_batch(prompts, api_key, task_id):
+    """
+    Send prompts as one Claude Message Batch and record it on its images
+    
+    Returns:
+        str: The batch id, or None if it could not be submitted
+    """
+    try:
+        batch_id = async_engine.run_sync(async_engine.create_claude_batch_async(prompts, api_key))
+    except Exception as e:
+        logger.error(f"Could not submit Claude batch: {str(e)}")
+        return None
+    
+    # A worker that restarts while the batch runs resumes polling it instead of paying for a new one
+    db.save_claude_batch(batch_id, task_id, [int(custom_id.split('-', 1)[1]) for custom_id in prompts])
+    logger.info(f"Submitted Claude batch {batch_id} with {len(prompts)} requests")
+    return batch_id
+
+def _wait_for_claude_batch(batch_id, api_key, token=None):
+    """
+    Wait for a Claude Message Batch to end and get its analyses
+    
+    CLAUDE_BATCH_MAX_WAIT counts from the batch's submission, also for batches
+    resumed after a restart. A cancelled token cancels the batch and raises
+    TaskCancelled.
+    
+    Returns:
+        dict: image id -> analysis, for the requests that succeeded
+    """
+    started = db.get_claude_batch_submitted_at(batch_id) or time.time()
+    name = threading.current_thread().name
+    
+    while True:
+        # Waiting on a batch is progress, not a hang
+        _heartbeat(name)
         
-    img = Image.open(io.BytesIO(img_data))
-    img.thumbnail(max_size)
-    buffered = io.BytesIO()
-    img.save(buffered, format=img.format if img.format else "JPEG")
-    return buffered.getvalue()
+        try:
+            status = async_engine.run_sync(async_engine.get_claude_batch_status_async(batch_id, api_key))
+        except Exception as e:
+            logger.warning(f"Could not check Claude batch {batch_id}: {str(e)}")
+            status = None
+        
+        if status == 'ended':
+            break
+        
+        if time.time() - started > config.CLAUDE_BATCH_MAX_WAIT:
+            logger.warning(f"Claude batch {batch_id} still running after {config.CLAUDE_BATCH_MAX_WAIT}s; cancelling it")
+            async_engine.run_sync(async_engine.cancel_claude_batch_async(batch_id, api_key))
+            return {}
+        
+        # Sleep until the next poll, waking up early if the task is cancelled
+        if token is None:
+            time.sleep(config.CLAUDE_BATCH_POLL_INTERVAL)
+        elif token.wait(config.CLAUDE_BATCH_POLL_INTERVAL):
+            async_engine.run_sync(async_engine.cancel_claude_batch_async(batch_id, api_key))
+            token.check()
+    
+    try:
+        results = async_engine.run_sync(async_engine.get_claude_batch_results_async(batch_id, api_key))
+    except Exception as e:
+        logger.error(f"Could not fetch results of Claude batch {batch_id}: {str(e)}")
+        return {}
+    
+    logger.info(f"Claude batch {batch_id} ended with {len(results)} analyses")
+    return {int(custom_id.split('-', 1)[1]): analysis for custom_id, analysis in results.items()}
 
-def process_task(task_id, api_keys):
-    """Process a task in the background"""
+async def _analyse_directly(items, api_key):
+    """Get the Claude analyses of several images with regular concurrent calls"""
+    # Only bulk tasks use batch mode, so this is background work
+    async_engine.current_lane.set(scheduler.BACKGROUND)
+    return await asyncio.gather(*[
+        async_engine.claude_analysis_async(item['search_results'], api_key)
+        for item in items
+    ])
+
+def _analyse_in_batch(items, api_key, worker_id, held, held_lock, token=None):
+    """Analyse the images set aside in batch mode and write all their analyses in one transaction"""
+    analyses = {}
+    prompts = {}
+    started_at = time.time()
+    
+    # Images submitted before a worker restart wait for their batch again rather than being resubmitted
+    resumed = {}
+    for item in items:
+        filtered_results = async_engine.filter_search_results(item['search_results'])
+        item['memo_key'] = analysis_memo.memo_key(filtered_results)
+        memoized = analysis_memo.lookup(item['memo_key'])
+        if memoized:
+            analyses[item['id']] = memoized
+        elif item.get('claude_batch_id'):
+            resumed.setdefault(item['claude_batch_id'], []).append(item)
+        else:
+            prompts[f"image-{item['id']}"] = async_engine.format_claude_prompt(filtered_results)
+    memoized_ids = set(analyses)
+    
+    batch_ids = list(resumed)
+    if prompts:
+        batch_id = _submit_claude_batch(prompts, api_key, items[0]['task_id'])
+        if batch_id is not None:
+            batch_ids.append(batch_id)
+    
+    for batch_id in batch_ids:
+        if batch_id in resumed:
+            logger.info(f"Resuming Claude batch {batch_id} for {len(resumed[batch_id])} images")
+        batch_analyses = _wait_for_claude_batch(batch_id, api_key, token)
+        for item in items:
+            if item['id'] in batch_analyses and item['id'] not in analyses:
+                analyses[item['id']] = batch_analyses[item['id']]
+                analysis_memo.store(item['memo_key'], analyses[item['id']])
+    
+    # Whatever the batch did not deliver is analysed directly
+    missing = [item for item in items if item['id'] not in analyses]
+    if missing:
+        if token is not None:
+            token.check()
+        logger.info(f"Analysing {len(missing)} images without the batch")
+        for item, analysis in zip(missing, async_engine.run_sync(_analyse_directly(missing, api_key))):
+            analyses[item['id']] = analysis
+    
+    # Batches take minutes to hours, so they are timed apart from the pipeline's analysis stage
+    ended_at = time.time()
+    for item in items:
+        analysis = analyses[item['id']]
+        if item['id'] in memoized_ids:
+            outcome = "skipped"
+        else:
+            outcome = "ok" if result_cache.is_cacheable_analysis(analysis) else "error"
+        metrics.record(
+            item['task_id'], item['id'], "batch_analysis", started_at, ended_at, 
+            size_bytes=len(analysis.encode()) if analysis else 0, outcome=outcome
+        )
+    
+    db.save_batch_analyses([
+        (item['id'], item['work_id'], analyses[item['id']], not result_cache.is_cacheable_analysis(analyses[item['id']]))
+        for item in items
+    ], worker_id)
+    
+    for item in items:
+        events.publish(item['task_id'], "image", image_id=item['id'], stage="analyzed")
+        if item.get('image_hash'):
+            result_cache.store(item['image_hash'], analysis=analyses[item['id']])
+        with held_lock:
+            held.discard(item['work_id'])
+
+def process_task(task_id, api_keys, worker_id=None):
+    """Process the queued images of a task and finish the task once they are all done"""
+    if worker_id is None:
+        worker_id = _worker_id()
+    name = threading.current_thread().name
+    
     try:
         # Get task information
         task_type = db.get_task_type(task_id)
@@ -165,138 +509,496 @@ def process_task(task_id, api_keys):
         if not task_type:
             return
         
-        # Update task status to processing
-        db.update_task_status(task_id, 'processing')
+        held = set()
+        held_lock = threading.Lock()
+        stop_event = threading.Event()
+        token = cancellation.open_token(task_id)
+        keeper = threading.Thread(
+            target=_lease_keeper, 
+            args=(worker_id, held, held_lock, stop_event), 
+            daemon=True
+        )
+        keeper.start()
         
-        # Get images for this task
-        images_df = db.get_task_images(task_id)
-        
-        for _, img_row in images_df.iterrows():
-            try:
-                # Upload to ImgBB
-                with open(img_row['image_path'], 'rb') as img_file:
-                    img_data = img_file.read()
+        try:
+            # Images are leased lazily, so other workers can share a large task
+            images = _claim_images(task_id, worker_id, held, held_lock, name)
+            first_image = next(images, None)
+            
+            if first_image is not None:
+                # Update task status to processing
+                db.update_task_status(task_id, 'processing')
+                events.publish(task_id, "task", status='processing')
                 
-                imgbb_url = upload_to_imgbb(img_data, api_keys['IMGBB_API_KEY'])
+                # In batch mode bulk analyses are collected and sent as one Message Batch afterwards
+                batch_mode = task_type == 'bulk' and config.CLAUDE_BATCH_MODE
+                deferred = [] if batch_mode else None
                 
-                if imgbb_url:
-                    # Update image record with ImgBB URL
-                    db.update_image_with_imgbb_url(img_row['id'], imgbb_url)
-                    
-                    # Get SearchAPI analysis
-                    search_results = search_api_analysis(
-                        imgbb_url, 
-                        img_row['description'], 
-                        api_keys['SEARCHAPI_API_KEY']
+                # Run upload, search, analysis and DB write as overlapping stages
+                workers = config.PIPELINE_STAGE_WORKERS
+                release = functools.partial(
+                    _release_stage, worker_id=worker_id, held=held, held_lock=held_lock, deferred=deferred, name=name
+                )
+                stages = [
+                    ("upload", functools.partial(_upload_stage, api_keys=api_keys), workers["upload"]),
+                    ("search", functools.partial(_search_stage, api_keys=api_keys), workers["search"]),
+                    ("analysis", functools.partial(_analysis_stage, api_keys=api_keys), workers["analysis"]),
+                    ("db_write", release, workers["db_write"]),
+                ]
+                if batch_mode:
+                    stages = [stage for stage in stages if stage[0] != "analysis"]
+                elif task_type == 'bulk' and config.CLAUDE_PACKING:
+                    stages[2] = (
+                        "analysis", 
+                        functools.partial(_packed_analysis_stage, api_keys=api_keys), 
+                        config.CLAUDE_PACK_WORKERS, 
+                        _fits_pack
                     )
-                    
-                    if search_results:
-                        # Get Claude analysis for this single image
-                        analysis = claude_analysis(search_results, api_keys['ANTHROPIC_API_KEY'])
-                        
-                        # Update image record with analysis - this should be a string now
-                        db.update_image_with_analysis(img_row['id'], analysis)
-            except Exception as e:
-                logger.error(f"Error processing image {img_row['id']}: {str(e)}")
+                pipeline.run_stages(
+                    itertools.chain([first_image], images), 
+                    stages, 
+                    token, 
+                    lane=scheduler.lane_of(task_type)
+                )
+                
+                if deferred:
+                    _analyse_in_batch(deferred, api_keys['ANTHROPIC_API_KEY'], worker_id, held, held_lock, token)
+        finally:
+            stop_event.set()
+            cancellation.close_token(token)
+            metrics.flush()
+        
+        # Whoever sees the last image finish generates the reports
+        if not db.try_finalize_task(task_id):
+            return
         
         # Generate reports for bulk upload tasks
+        _heartbeat(name)
         output_path = None
         if task_type == 'bulk':
-            # Generate Excel report
-            output_path = reports.save_to_excel(task_id)
-            
-            # Generate HTML report (optional)
-            html_path = reports.generate_html_report(task_id)
-            
-            # Generate CSV report (optional)
-            csv_path = reports.generate_csv_report(task_id)
+            with metrics.timed(task_id, "reports") as timing:
+                # Generate Excel report
+                output_path = reports.save_to_excel(task_id)
+                
+                # Generate HTML report (optional)
+                html_path = reports.generate_html_report(task_id)
+                
+                # Generate CSV report (optional)
+                csv_path = reports.generate_csv_report(task_id)
+                
+                metrics.note(timing, bytes=sum(
+                    os.path.getsize(path) for path in (output_path, html_path, csv_path) if path and os.path.exists(path)
+                ))
+            metrics.flush()
         
         # Update task status to completed
         db.update_task_status(task_id, 'completed', output_path)
+        events.publish(task_id, "task", status='completed')
         
+    except cancellation.TaskCancelled:
+        # db.cancel_task already closed the task's work; make sure nothing is left open
+        logger.info(f"Stopped processing of cancelled task {task_id}")
+        db.cancel_task(task_id)
+        events.publish(task_id, "task", status='cancelled')
     except Exception as e:
         logger.error(f"Error processing task {task_id}: {str(e)}")
         db.update_task_status(task_id, 'failed')
+        events.publish(task_id, "task", status='failed')
 
-def task_worker(api_keys):
-    """Worker function for processing tasks from the queue - processes one task at a time"""
-    while True:
+def recover_work():
+    """Requeue images whose lease expired and finish tasks left with no open work"""
+    db.reclaim_expired_work()
+    
+    for task_id in db.get_stalled_tasks():
+        task_queue.put(task_id)
+
+def task_worker(api_keys, stop_event=None):
+    """Worker function for processing tasks from the queue - each worker handles one task at a time"""
+    name = threading.current_thread().name
+    
+    worker_id = _worker_id()
+    
+    while stop_event is None or not stop_event.is_set():
+        _heartbeat(name)
         try:
-            # Get task from queue without removing it yet (peek)
-            task_id = task_queue.get(timeout=1)
-            
-            # Mark task as processing
-            processing_tasks[task_id] = True
-            logger.info(f"Starting processing of task {task_id}")
-            
-            # Process the task
-            process_task(task_id, api_keys)
-            
-            # Mark task as complete and remove from processing dict
-            processing_tasks.pop(task_id, None)
-            logger.info(f"Completed processing of task {task_id}")
-            
-            # Now tell the queue this task is done
+            # The in-memory queue is only a wake-up hint; the database holds the work
+            hinted = task_queue.get(timeout=config.WORK_POLL_INTERVAL)
             task_queue.task_done()
-            
         except queue.Empty:
-            time.sleep(1)
+            hinted = None
+        
+        try:
+            task_id = _next_task(name, hinted)
         except Exception as e:
             logger.error(f"Task worker error: {str(e)}")
-            # If there was a task being processed, mark it as failed
-            if 'task_id' in locals() and task_id in processing_tasks:
-                try:
-                    db.update_task_status(task_id, 'failed')
-                    processing_tasks.pop(task_id, None)
-                    task_queue.task_done()  # Still mark as done to keep queue moving
-                except Exception:
-                    pass  # Avoid nested exceptions
-            time.sleep(5)
+            continue
+        if task_id is None:
+            continue
+        logger.info(f"{name} started processing of task {task_id}")
+        
+        try:
+            process_task(task_id, api_keys, worker_id)
+            logger.info(f"{name} completed processing of task {task_id}")
+        except Exception as e:
+            logger.error(f"Task worker error: {str(e)}")
+            try:
+                db.update_task_status(task_id, 'failed')
+                events.publish(task_id, "task", status='failed')
+            except Exception:
+                pass  # Avoid nested exceptions
+        finally:
+            # Remove from processing dict and keep per-worker stats
+            with _workers_lock:
+                if processing_tasks.get(task_id) == name:
+                    processing_tasks.pop(task_id)
+                worker = _workers.get(name)
+                if worker and worker['busy_since']:
+                    worker['busy_seconds'] += time.time() - worker['busy_since']
+                    worker['busy_since'] = None
+                    worker['lane'] = None
+                    worker['task_id'] = None
+                    worker['user_id'] = None
+                    worker['tasks_done'] += 1
+            _heartbeat(name)
+    
+    with _workers_lock:
+        _workers.pop(name, None)
+    logger.info(f"{name} stopped")
 
-def start_worker_thread(api_keys):
-    """Start the background worker thread"""
-    # Ensure required directories exist
-    utils.ensure_directories()
+def _next_task(name, hinted=None):
+    """
+    Choose a worker's next task and mark the worker busy with it
+    
+    The scheduler picks among the tasks with pending work (see scheduler.py).
+    Background tasks are only taken while more than SCHEDULER_RESERVED_WORKERS
+    workers would remain for interactive ones, and only while the task's user
+    is under its tier's max_tasks. A hinted task without pending work (left to
+    be finalized after a recovery or resume) is taken as is.
     
-    # Run database migrations if needed
-    db.migrate_db()
+    Returns:
+        int: Task ID, or None if there is nothing this worker may take
+    """
+    candidates = db.get_schedulable_tasks()
+    running = db.get_running_tasks_by_user()
+    leftover = hinted if hinted is not None and not db.has_pending_work(hinted) else None
     
-    # Start worker thread
+    with _workers_lock:
+        if name in _workers:
+            active = [w for w in _workers.values() if not w['stop_event'].is_set()]
+            background_busy = sum(1 for w in active if w['lane'] == scheduler.BACKGROUND)
+            allow_background = background_busy < len(active) - config.SCHEDULER_RESERVED_WORKERS
+        else:
+            allow_background = True  # A worker outside the pool has no one to reserve for
+        
+        # Tasks taken here may not have leased any work yet
+        for w in _workers.values():
+            if w['user_id'] is not None and w['task_id'] is not None:
+                running.setdefault(w['user_id'], set()).add(w['task_id'])
+        
+        choice = scheduler.pick_task(candidates, allow_background, running)
+        if choice is not None:
+            task_id, lane, user_id = choice['task_id'], scheduler.lane_of(choice['task_type']), choice['user_id']
+        elif leftover is not None:
+            task_id, lane, user_id = leftover, None, None
+        else:
+            return None
+        
+        # Mark task as processing by this worker
+        processing_tasks[task_id] = name
+        if name in _workers:
+            _workers[name]['busy_since'] = time.time()
+            _workers[name]['lane'] = lane
+            _workers[name]['task_id'] = task_id
+            _workers[name]['user_id'] = user_id
+    return task_id
+
+def _heartbeat(name):
+    """Record that a worker is still alive"""
+    with _workers_lock:
+        if name in _workers:
+            _workers[name]['heartbeat'] = time.time()
+
+def _start_worker(api_keys):
+    """Start one task worker thread; caller must hold _workers_lock"""
+    name = f"task-worker-{next(_worker_ids)}"
+    stop_event = threading.Event()
     worker_thread = threading.Thread(
         target=task_worker, 
-        args=(api_keys,), 
+        args=(api_keys, stop_event), 
+        name=name,
         daemon=True
     )
+    _workers[name] = {
+        'thread': worker_thread,
+        'stop_event': stop_event,
+        'started_at': time.time(),
+        'heartbeat': time.time(),
+        'busy_since': None,
+        'lane': None,
+        'task_id': None,
+        'user_id': None,
+        'busy_seconds': 0.0,
+        'tasks_done': 0
+    }
     worker_thread.start()
-    return worker_thread
+    return name
 
-def add_image_to_current_task(img_data, description=""):
-    """Add an image to the current task and save to disk"""
-    img_id = str(uuid.uuid4())
-    img_dir = config.UPLOAD_DIR
-    os.makedirs(img_dir, exist_ok=True)
+def set_worker_count(count, api_keys):
+    """Grow or shrink the task worker pool to the given number of workers"""
+    count = max(config.MIN_TASK_WORKERS, min(config.MAX_TASK_WORKERS, count))
     
-    img_path = f"{img_dir}/{img_id}.jpg"
+    with _workers_lock:
+        active = [name for name, w in _workers.items() if not w['stop_event'].is_set()]
+        
+        if len(active) < count:
+            for _ in range(count - len(active)):
+                _start_worker(api_keys)
+            logger.info(f"Scaled task workers up from {len(active)} to {count}")
+        elif len(active) > count:
+            # Retire idle workers first; busy ones stop after their current task
+            active.sort(key=lambda name: _workers[name]['busy_since'] is not None)
+            for name in active[:len(active) - count]:
+                _workers[name]['stop_event'].set()
+            logger.info(f"Scaling task workers down from {len(active)} to {count}")
     
-    # Resize image before saving if it exceeds maximum size
-    img = Image.open(io.BytesIO(img_data))
+    return count
+
+def autoscale_workers(api_keys):
+    """Resize the worker pool based on queue depth and the number of busy workers"""
+    with _workers_lock:
+        busy = sum(1 for w in _workers.values() if w['busy_since'] is not None)
+    
+    queued = db.get_pending_task_count()
+    # Keep the reserved workers on top, so interactive tasks never wait for bulk ones
+    desired = busy + -(-queued // config.TASKS_PER_WORKER) + config.SCHEDULER_RESERVED_WORKERS  # ceil division
+    return set_worker_count(desired, api_keys)
+
+def _is_worker_dead(worker, now):
+    """Check whether a worker thread crashed or stopped heartbeating"""
+    if not worker['thread'].is_alive():
+        return "crashed"
     
-    # Convert RGBA to RGB to avoid JPEG saving errors
-    if img.mode == 'RGBA':
-        # Create a white background image
-        background = Image.new('RGB', img.size, (255, 255, 255))
-        # Paste the image on the background, using the alpha channel as mask
-        background.paste(img, (0, 0), img)
-        img = background
+    # Busy workers heartbeat as their task progresses (images leased and released, batch polls),
+    # which can be minutes apart, so they get the longer stall timeout
+    timeout = config.WORKER_TASK_TIMEOUT if worker['busy_since'] else config.WORKER_HEARTBEAT_TIMEOUT
+    if now - worker['heartbeat'] > timeout:
+        return "unresponsive"
+    return None
+
+def supervise_workers(api_keys):
+    """Replace crashed or unresponsive workers and requeue the tasks they held"""
+    now = time.time()
     
-    img.thumbnail(config.MAX_IMAGE_SIZE)
-    img.save(img_path)
+    with _workers_lock:
+        for name, worker in list(_workers.items()):
+            if worker['stop_event'].is_set():
+                continue
+            
+            reason = _is_worker_dead(worker, now)
+            if not reason:
+                continue
+            
+            # Threads can't be killed: tell a hung one to stop and forget it
+            worker['stop_event'].set()
+            _workers.pop(name)
+            _dead_workers.append({
+                "name": name,
+                "reason": reason,
+                "died_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "tasks_done": worker['tasks_done']
+            })
+            del _dead_workers[:-config.DEAD_WORKER_HISTORY]
+            
+            for task_id, owner in list(processing_tasks.items()):
+                if owner == name:
+                    processing_tasks.pop(task_id)
+                    task_queue.put(task_id)
+                    logger.warning(f"Requeued task {task_id} held by {reason} worker {name}")
+            
+            replacement = _start_worker(api_keys)
+            _supervisor_stats['restarts'] += 1
+            logger.error(f"Task worker {name} {reason}; restarted as {replacement}")
+
+def _supervisor(api_keys):
+    """Heartbeat-check the workers and periodically resize the pool"""
+    last_scale = last_recovery = time.time()
     
+    while not _pool_stopping.wait(config.WORKER_SUPERVISE_INTERVAL):
+        try:
+            supervise_workers(api_keys)
+            
+            if time.time() - last_scale >= config.WORKER_SCALE_INTERVAL:
+                autoscale_workers(api_keys)
+                last_scale = time.time()
+            
+            if time.time() - last_recovery >= config.WORK_HEARTBEAT_INTERVAL:
+                recover_work()
+                last_recovery = time.time()
+        except Exception as e:
+            logger.error(f"Worker supervisor error: {str(e)}")
+
+def _peak_memory_mb():
+    """Peak resident memory of this process in MB, where the platform reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def get_worker_stats():
+    """Get the current worker count, utilization and in-flight tasks"""
+    now = time.time()
+    
+    with _workers_lock:
+        workers = []
+        for name, w in _workers.items():
+            busy_seconds = w['busy_seconds']
+            if w['busy_since']:
+                busy_seconds += now - w['busy_since']
+            uptime = max(now - w['started_at'], 1e-6)
+            workers.append({
+                "name": name,
+                "alive": _is_worker_dead(w, now) is None,
+                "heartbeat_age": round(now - w['heartbeat'], 1),
+                "busy": w['busy_since'] is not None,
+                "lane": w['lane'],
+                "stopping": w['stop_event'].is_set(),
+                "tasks_done": w['tasks_done'],
+                "utilization": min(busy_seconds / uptime, 1.0)
+            })
+        in_flight = dict(processing_tasks)
+        dead_workers = list(_dead_workers)
+        restarts = _supervisor_stats['restarts']
+    
+    busy_count = sum(1 for w in workers if w['busy'])
     return {
-        "id": img_id,
-        "path": img_path,
-        "description": description
+        "worker_count": len(workers),
+        "live_workers": sum(1 for w in workers if w['alive']),
+        "busy_workers": busy_count,
+        "utilization": busy_count / len(workers) if workers else 0.0,
+        "queue_depth": db.get_pending_task_count(),
+        "lanes": scheduler.get_lane_stats(),
+        "work_items": db.get_work_queue_stats(),
+        "processing_tasks": in_flight,
+        "workers": workers,
+        "dead_workers": dead_workers,
+        "restarts": restarts,
+        "peak_memory_mb": _peak_memory_mb(),
+        "supervisor_alive": _supervisor_thread is not None and _supervisor_thread.is_alive()
+    }
+
+def start_worker_pool(api_keys, worker_count=None):
+    """
+    Start the task worker pool and its supervisor, once per process
+    
+    Streamlit calls this on every rerun; after the first call it only makes
+    sure the supervisor is still running, so the thread count stays flat.
+    """
+    global _supervisor_thread
+    
+    with _pool_lock:
+        if _supervisor_thread is not None and _supervisor_thread.is_alive():
+            return _supervisor_thread
+        
+        if _supervisor_thread is None:
+            # Ensure required directories exist
+            utils.ensure_directories()
+            
+            # Run database migrations if needed
+            db.migrate_db()
+            
+            set_worker_count(worker_count or config.TASK_WORKERS, api_keys)
+        else:
+            logger.error("Worker supervisor died; restarting it")
+        
+        _supervisor_thread = threading.Thread(
+            target=_supervisor, 
+            args=(api_keys,), 
+            name="task-worker-supervisor",
+            daemon=True
+        )
+        _supervisor_thread.start()
+        return _supervisor_thread
+
+def stop_worker_pool(timeout=None):
+    """Stop the supervisor and let every worker finish its current task"""
+    _pool_stopping.set()
+    
+    with _workers_lock:
+        threads = []
+        for worker in _workers.values():
+            worker['stop_event'].set()
+            threads.append(worker['thread'])
+    
+    for worker_thread in threads:
+        worker_thread.join(timeout)
+
+def start_worker_thread(api_keys):
+    """Start the background workers (kept for compatibility, see start_worker_pool)"""
+    return start_worker_pool(api_keys)
+
+def add_image_to_current_task(img_data, description=""):
+    """Add an image to the current task, writing the master and its variants to disk"""
+    # Decoding and re-encoding run on the CPU pool, off the Streamlit thread
+    img_info = cpu_pool.run(ingestion.ingest_image, bytes(img_data))
+    img_info["description"] = description
+    return img_info
+
+def _safe_dhash(image_path, future):
+    """Perceptual hash of an image file computed on the CPU pool, or None if it cannot be read"""
+    try:
+        return future.result()
+    except Exception as e:
+        logger.warning(f"Could not compute perceptual hash of {image_path}: {str(e)}")
+        return None
+
+def group_duplicate_images(image_paths, phashes=None):
+    """
+    Group images that show the same item
+    
+    Args:
+        image_paths (list): Stored image files
+        phashes (list): Perceptual hashes (hex) recorded at ingestion; images without one are decoded
+    
+    Returns:
+        tuple: (perceptual hash of each image, index of each image's group representative)
+    """
+    phashes = phashes or [None] * len(image_paths)
+    
+    # Hash the images that have no stored hash on every core at once
+    pending = {
+        i: cpu_pool.submit(similarity.dhash, path)
+        for i, (path, phash) in enumerate(zip(image_paths, phashes))
+        if not (isinstance(phash, str) and phash)
     }
+    hashes = [
+        _safe_dhash(path, pending[i]) if i in pending else int(phash, 16)
+        for i, (path, phash) in enumerate(zip(image_paths, phashes))
+    ]
+    return hashes, similarity.cluster(hashes, similarity.max_distance(config.BULK_DEDUP_SIMILARITY_THRESHOLD))
+
+def cluster_task_images(task_id):
+    """Mark the near-identical images of a task so only one per group is processed"""
+    images = db.get_task_images(task_id)
+    image_ids = images['id'].tolist()
+    hashes, groups = group_duplicate_images(images['image_path'].tolist(), images['phash'].tolist())
+    
+    db.set_image_duplicates([
+        (
+            image_ids[i], 
+            f"{hashes[i]:016x}" if hashes[i] is not None else None, 
+            image_ids[representative] if representative != i else None
+        )
+        for i, representative in enumerate(groups)
+    ])
+    
+    duplicates = sum(1 for i, representative in enumerate(groups) if representative != i)
+    if duplicates:
+        logger.info(f"Task {task_id}: {duplicates} of {len(groups)} images are duplicates and will share results")
+    return duplicates
 
 def submit_task(user_id, task_type, images, task_name="", task_description=""):
     """Create a new task with images and submit for processing"""
@@ -315,10 +1017,23 @@ def submit_task(user_id, task_type, images, task_name="", task_description=""):
     
     # Add images to the task
     for img in images:
-        db.add_image_to_task(task_id, img["path"], img["description"])
+        db.add_image_to_task(
+            task_id, 
+            img["path"], 
+            img["description"], 
+            upload_path=img.get("upload_path"), 
+            thumbnail_path=img.get("thumbnail_path"), 
+            phash=img.get("phash")
+        )
+    
+    # Analyse each group of near-identical photos once
+    if task_type == 'bulk' and config.BULK_DEDUP_ENABLED:
+        cluster_task_images(task_id)
     
-    # Add task to processing queue
-    task_queue.put(task_id)
+    # Queue the images in the database, then wake up a local worker if there is one
+    db.enqueue_task_work(task_id)
+    if config.EMBEDDED_WORKERS:
+        task_queue.put(task_id)
     
     return task_id
 
@@ -335,9 +1050,110 @@ def mark_task_complete(task_id):
     conn.close()
     
     # Update the task status
-    return db.manually_complete_task(task_id, output_path)
+    result = db.manually_complete_task(task_id, output_path)
+    events.publish(task_id, "task", status='completed')
+    return result
+
+def resume_task(task_id):
+    """
+    Requeue the unfinished images of a failed or stuck task
+    
+    Each image resumes after its last completed stage, so paid API calls that
+    already succeeded (upload, search, analysis) are not repeated.
+    
+    Returns:
+        int: Number of images queued again
+    """
+    count = db.requeue_task_work(task_id)
+    logger.info(f"Resuming task {task_id}: {count} images queued again")
+    
+    # Tasks with nothing left to process are finalized by the next recovery pass
+    if config.EMBEDDED_WORKERS:
+        task_queue.put(task_id)
+    return count
 
 def cancel_task(task_id):
     """Cancel a task that is in progress or pending"""
-    # Mark the task as cancelled in the database
-    return db.cancel_task(task_id)
\ No newline at end of file
+    # Mark the task as cancelled in the database; workers in other processes notice within CANCEL_POLL_INTERVAL
+    cancelled = db.cancel_task(task_id)
+    
+    # Abort this process's in-flight work on the task right away
+    if cancelled:
+        cancellation.cancel(task_id)
+        events.publish(task_id, "task", status='cancelled')
+    return cancelled
+
+def run_worker_daemon(worker_count=None):
+    """Run the task workers without the Streamlit UI until interrupted"""
+    os.makedirs("logs", exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("logs/worker.log"),
+            logging.StreamHandler()
+        ]
+    )
+    
+    api_keys = {
+        'IMGBB_API_KEY': os.getenv('IMGBB_API_KEY'),
+        'SEARCHAPI_API_KEY': os.getenv('SEARCHAPI_API_KEY'),
+        'ANTHROPIC_API_KEY': os.getenv('ANTHROPIC_API_KEY')
+    }
+    
+    valid, message = utils.validate_api_keys(api_keys)
+    if not valid:
+        logger.error(f"API Key Error: {message}")
+        return 1
+    
+    # Daemons usually run several at once (e.g. --scale worker=N); their buckets must be shared
+    if "RATE_LIMIT_BACKEND" not in os.environ:
+        config.RATE_LIMIT_BACKEND = "database"
+    logger.info(f"Rate limiting with {config.RATE_LIMIT_BACKEND} buckets")
+    
+    db.init_db()
+    start_worker_pool(api_keys, worker_count)
+    logger.info(f"Worker daemon started on {socket.gethostname()} (pid {os.getpid()})")
+    
+    # Stop cleanly on docker stop / Ctrl+C
+    stop_requested = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_requested.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_requested.set())
+    
+    while not stop_requested.wait(1):
+        pass
+    
+    logger.info("Stopping worker daemon, waiting for in-flight tasks")
+    stop_worker_pool(timeout=config.WORK_LEASE_SECONDS)
+    
+    # Close the pooled API connections on the loop that opened them
+    try:
+        async_engine.run_sync(clients.close_clients(), timeout=10)
+    except Exception as e:
+        logger.error(f"Error closing API clients: {str(e)}")
+    
+    cpu_pool.shutdown()
+    return 0
+
+def main(argv=None):
+    """Command line entry point: python -m processing worker [--workers N]"""
+    parser = argparse.ArgumentParser(description="EstateGeniusAI background processing")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    worker_parser = subparsers.add_parser("worker", help="Run task workers outside Streamlit")
+    worker_parser.add_argument(
+        "--workers", 
+        type=int, 
+        default=None, 
+        help=f"Initial number of task workers (default: {config.TASK_WORKERS})"
+    )
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == "worker":
+        return run_worker_daemon(args.workers)
+
+if __name__ == "__main__":
+    # Run through the importable module so state is shared with modules that import it
+    import processing
+    sys.exit(processing.main())
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+
+# Import local modules
+import config
+import database as db
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# In-process buckets and usage counters, keyed by bucket key
+_buckets = {}
+_stats = {}
+_lock = threading.Lock()
+
+def _bucket_key(provider, metric, api_key):
+    """Bucket identifier: provider, limited quantity and a fingerprint of the API key"""
+    fingerprint = hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:12]
+    return f"{provider}:{metric}:{fingerprint}"
+
+def _limits(provider, metric):
+    """Get (refill rate per second, capacity) for a provider's limit, or None if unlimited"""
+    limits = config.RATE_LIMITS.get(provider, {})
+
+    if metric == "requests" and limits.get("requests_per_second"):
+        rate = float(limits["requests_per_second"])
+        return rate, max(rate * config.RATE_LIMIT_BURST_SECONDS, 1.0)
+
+    if metric == "tokens" and limits.get("tokens_per_minute"):
+        rate = float(limits["tokens_per_minute"]) / 60
+        return rate, max(rate * config.RATE_LIMIT_BURST_SECONDS, float(config.MAX_TOKENS))
+
+    return None
+
+def reserve_tokens(tokens, updated_at, cost, rate, capacity, now, floor=None):
+    """
+    Token-bucket reservation shared by the in-memory and database backends
+
+    The bucket refills at rate per second up to capacity. The cost is always
+    taken, so the level may go negative: the caller then waits until the bucket
+    would have refilled to zero, which keeps concurrent callers in order.
+
+    With a floor (background calls), the cost is only taken if the level stays
+    at or above the floor, or if the bucket is full; otherwise nothing is taken
+    and the caller is told how long until it may try again. Background calls
+    thus never queue up ahead of interactive ones.
+
+    Returns:
+        tuple: (new token level, seconds the caller must wait, whether the cost was taken)
+    """
+    tokens = min(capacity, tokens + (now - updated_at) * rate)
+    if floor is not None and cost > 0 and tokens - cost < floor and tokens < capacity:
+        return tokens, (min(floor + cost, capacity) - tokens) / rate, False
+
+    tokens = min(capacity, tokens - cost)  # A negative cost is a refund
+    wait = -tokens / rate if tokens < 0 else 0.0
+    return tokens, wait, True
+
+def _reserve_local(key, cost, rate, capacity, floor=None):
+    """Reserve from an in-process bucket"""
+    now = time.time()
+    with _lock:
+        tokens, updated_at = _buckets.get(key, (capacity, now))
+        tokens, wait, granted = reserve_tokens(tokens, updated_at, cost, rate, capacity, now, floor)
+        _buckets[key] = (tokens, now)
+    return wait, granted
+
+def _record(key, wait):
+    """Update the usage counters of a bucket"""
+    with _lock:
+        stats = _stats.setdefault(key, {"granted": 0, "throttled": 0, "waited_seconds": 0.0})
+        stats["granted"] += 1
+        if wait > 0:
+            stats["throttled"] += 1
+            stats["waited_seconds"] += wait
+
+def reserve(provider, api_key, metric="requests", cost=1, background=False):
+    """
+    Reserve capacity from a provider's bucket
+
+    With RATE_LIMIT_BACKEND = "database" the buckets live in the shared
+    database, so the limit holds across every worker process. Background
+    reservations leave RATE_LIMIT_INTERACTIVE_HEADROOM of the bucket free.
+
+    Returns:
+        tuple: (seconds to wait, whether the capacity was reserved; if not, try again after the wait)
+    """
+    limits = _limits(provider, metric)
+    if limits is None:
+        return 0.0, True
+    rate, capacity = limits
+    floor = capacity * config.RATE_LIMIT_INTERACTIVE_HEADROOM if background else None
+
+    key = _bucket_key(provider, metric, api_key)
+    if config.RATE_LIMIT_BACKEND == "database":
+        try:
+            wait, granted = db.reserve_rate_tokens(
+                key, capacity, 
+                lambda tokens, updated_at, now: reserve_tokens(tokens, updated_at, cost, rate, capacity, now, floor)
+            )
+        except Exception as e:
+            # Still limit this process rather than let every call through while the database is contended
+            logger.warning(f"Shared rate limit bucket {key} unavailable, using this process's: {e}")
+            wait, granted = _reserve_local(key, cost, rate, capacity, floor)
+    else:
+        wait, granted = _reserve_local(key, cost, rate, capacity, floor)
+
+    if cost > 0 and granted:
+        _record(key, wait)
+    return wait, granted
+
+async def acquire(provider, api_key, metric="requests", cost=1, background=False):
+    """Wait until a provider's rate limit allows the call"""
+    while True:
+        if config.RATE_LIMIT_BACKEND == "database":
+            wait, granted = await asyncio.to_thread(reserve, provider, api_key, metric, cost, background)
+        else:
+            wait, granted = reserve(provider, api_key, metric, cost, background)
+
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if granted:
+            return
+
+async def refund(provider, api_key, metric, amount):
+    """Give back reserved capacity that was not used (e.g. estimated tokens above actual usage)"""
+    if amount <= 0:
+        return
+    if config.RATE_LIMIT_BACKEND == "database":
+        await asyncio.to_thread(reserve, provider, api_key, metric, -amount)
+    else:
+        reserve(provider, api_key, metric, -amount)
+
+def estimate_claude_tokens(prompt, max_tokens=None):
+    """Rough token count of a Claude call: ~4 characters per input token plus the output budget"""
+    return len(prompt) // 4 + (max_tokens or config.MAX_TOKENS)
+
+def get_rate_limit_stats():
+    """Get per-bucket counters of granted and throttled calls in this process"""
+    with _lock:
+        return {key: dict(stats) for key, stats in _stats.items()}
@@ -8,6 +8,7 @@ from datetime import datetime
 # Import local modules
 import database as db
 import config
+import cpu_pool
 import utils
 
 def resize_image(image_path, max_size=(200, 200)):
@@ -25,6 +26,18 @@ def resize_image(image_path, max_size=(200, 200)):
         print(f"Error resizing image: {str(e)}")
         return None
 
+def duplicate_labels(images_df):
+    """Describe, for each image, which earlier image of the task shows the same item"""
+    positions = {image_id: i + 1 for i, image_id in enumerate(images_df['id'])}
+    
+    labels = []
+    for duplicate_of in images_df['duplicate_of']:
+        if pd.notna(duplicate_of) and duplicate_of in positions:
+            labels.append(f"Same item as image {positions[duplicate_of]} (analyzed once)")
+        else:
+            labels.append("")
+    return labels
+
 def save_to_excel(task_id):
     """Generate Excel report for bulk upload task with improved layout"""
     # Get all images for this task
@@ -42,7 +55,8 @@ def save_to_excel(task_id):
     # Prepare data for Excel - we only need image_path and analysis columns
     report_df = pd.DataFrame({
         'Image': images_df['image_path'],
-        'Analysis': images_df['analysis']
+        'Analysis': images_df['analysis'],
+        'Grouping': duplicate_labels(images_df)
     })
     
     # Write the DataFrame to Excel without the index
@@ -63,6 +77,15 @@ def save_to_excel(task_id):
         'align': 'left'
     })
     worksheet.set_column('B:B', 80, wrap_format)
+    worksheet.set_column('C:C', 30, wrap_format)  # Grouping column width
+    
+    # Use the thumbnails written at ingestion; older uploads are resized here, on every core
+    previews = [utils.preview_path(path, thumb) for path, thumb in zip(images_df['image_path'], images_df['thumbnail_path'])]
+    resized = {
+        i: cpu_pool.submit(resize_image, img_path, config.THUMBNAIL_SIZE)
+        for i, (img_path, preview) in enumerate(zip(images_df['image_path'], previews))
+        if preview == img_path
+    }
     
     # Add images to the Excel file - first column
     for i, img_path in enumerate(images_df['image_path']):
@@ -70,8 +93,11 @@ def save_to_excel(task_id):
             # Row index in Excel (add 1 for header row)
             row_idx = i + 1
             
-            # Resize image while maintaining aspect ratio
-            img_data = resize_image(img_path, max_size=(200, 200))
+            if i in resized:
+                img_data = resized[i].result()
+            else:
+                with open(previews[i], 'rb') as f:
+                    img_data = f.read()
             if img_data:
                 # Insert image in first column
                 worksheet.insert_image(
@@ -132,6 +158,7 @@ def generate_html_report(task_id):
             .image-preview img { max-width: 100%; height: auto; }
             .image-details { flex: 3; padding-left: 20px; }
             .image-description { color: #666; font-style: italic; margin-bottom: 10px; }
+            .image-grouping { color: #429FC7; font-weight: bold; margin-bottom: 10px; }
             .image-analysis { background-color: #f9f9f9; padding: 10px; border-radius: 5px; }
         </style>
     </head>
@@ -143,16 +170,20 @@ def generate_html_report(task_id):
         </div>
     """
     
-    for _, img in images_df.iterrows():
+    labels = duplicate_labels(images_df)
+    
+    for i, (_, img) in enumerate(images_df.iterrows()):
         # Create HTML for each image
-        img_base64 = utils.image_to_base64(img['image_path'])
+        img_base64 = utils.image_to_base64(utils.preview_path(img['image_path'], img['thumbnail_path']))
+        grouping = f'<div class="image-grouping">{labels[i]}</div>' if labels[i] else ""
         html += f"""
         <div class="image-container">
             <div class="image-preview">
                 <img src="data:image/jpeg;base64,{img_base64}" alt="Image">
             </div>
             <div class="image-details">
-                <h3>Image Details</h3>
+                <h3>Image {i + 1} Details</h3>
+                {grouping}
                 <div class="image-description">
                     <strong>Description:</strong> {img['description'] if img['description'] else 'No description provided'}
                 </div>
@@ -187,8 +218,9 @@ def generate_csv_report(task_id):
         return None
     
     # Select and reorder columns for the report
-    report_df = images_df[['image_path', 'imgbb_url', 'description', 'analysis']]
+    report_df = images_df[['image_path', 'imgbb_url', 'description', 'analysis']].copy()
     report_df.columns = ['Image Path', 'ImgBB URL', 'Description', 'Analysis']
+    report_df['Grouping'] = duplicate_labels(images_df)
     
     # Create a CSV file
     output_path = f"{config.REPORTS_DIR}/task_{task_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+# Import local modules
+import config
+import database as db
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Cached results, in pipeline order
+FIELDS = ("imgbb_url", "search_results", "analysis")
+
+# Hit/miss counters per field, for this process
+_stats = {field: {"hits": 0, "misses": 0} for field in FIELDS}
+_stats_lock = threading.Lock()
+_last_eviction = 0.0
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Content address of an image: SHA-256 of its stored bytes, read in chunks instead of loading the file whole"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_cacheable_analysis(analysis):
+    """Failed or skipped Claude calls are not worth caching"""
+    return bool(analysis) and not analysis.startswith(("Analysis failed", "Analysis unavailable"))
+
+def lookup(content_hash):
+    """
+    Get the reusable results cached for an image
+
+    Returns:
+        dict: The subset of imgbb_url, search_results and analysis that can be
+              reused (an ImgBB URL only while it has not expired)
+    """
+    if not config.RESULT_CACHE_ENABLED:
+        return {}
+
+    entry = db.get_cached_result(content_hash) or {}
+    cached = {}
+
+    expires_at = entry.get('imgbb_expires_at')
+    if entry.get('imgbb_url') and (expires_at is None or expires_at - time.time() > config.RESULT_CACHE_URL_MARGIN):
+        cached['imgbb_url'] = entry['imgbb_url']
+
+    if entry.get('search_results'):
+        try:
+            cached['search_results'] = json.loads(entry['search_results'])
+        except ValueError:
+            logger.warning(f"Ignoring unreadable cached search results for {content_hash[:12]}")
+
+    if is_cacheable_analysis(entry.get('analysis')):
+        cached['analysis'] = entry['analysis']
+
+    with _stats_lock:
+        for field in FIELDS:
+            _stats[field]["hits" if field in cached else "misses"] += 1
+
+    return cached
+
+def cached_search_results(content_hash):
+    """Get the SearchAPI results cached for an image, or None"""
+    entry = db.get_cached_result(content_hash)
+    if not entry or not entry.get('search_results'):
+        return None
+
+    try:
+        return json.loads(entry['search_results'])
+    except ValueError:
+        return None
+
+def store(content_hash, imgbb_url=None, search_results=None, analysis=None, url_ttl=None):
+    """
+    Cache freshly obtained results of an image; failed results are skipped
+
+    url_ttl is how long the hosted image URL stays valid (None = forever)
+    """
+    if not config.RESULT_CACHE_ENABLED:
+        return
+
+    expires_at = time.time() + url_ttl if imgbb_url and url_ttl else None
+
+    if not is_cacheable_analysis(analysis):
+        analysis = None
+
+    if imgbb_url or search_results or analysis:
+        db.save_cached_result(
+            content_hash,
+            imgbb_url=imgbb_url,
+            imgbb_expires_at=expires_at,
+            search_results=json.dumps(search_results) if search_results else None,
+            analysis=analysis
+        )
+
+    _maybe_evict()
+
+def _maybe_evict():
+    """Run an eviction pass if the last one is more than RESULT_CACHE_EVICT_INTERVAL old"""
+    global _last_eviction
+
+    with _stats_lock:
+        if time.time() - _last_eviction < config.RESULT_CACHE_EVICT_INTERVAL:
+            return
+        _last_eviction = time.time()
+
+    deleted = db.evict_cached_results(
+        config.RESULT_CACHE_MAX_AGE,
+        config.RESULT_CACHE_MAX_ENTRIES,
+        config.RESULT_CACHE_MAX_BYTES
+    )
+    if deleted:
+        logger.info(f"Evicted {deleted} result cache entries")
+
+def get_cache_stats():
+    """Get this process's hit/miss counters per cached field"""
+    with _stats_lock:
+        return {field: dict(counters) for field, counters in _stats.items()}
@@ -0,0 +1,253 @@
+import asyncio
+import contextvars
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import anthropic
+import httpx
+
+# Import local modules
+import config
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: timeouts, throttling and server-side failures
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504, 529}
+THROTTLE_STATUSES = {429}
+
+PROVIDER_LABELS = {
+    "imgbb": "ImgBB upload",
+    "searchapi": "SearchAPI",
+    "anthropic": "Claude API",
+}
+
+# A one-element list counting the calls attempted by the code being timed (see metrics.py), if any
+call_attempts = contextvars.ContextVar("call_attempts", default=None)
+
+class ProviderError(Exception):
+    """A provider answered with an unsuccessful HTTP status"""
+
+    def __init__(self, provider, status_code, message="", retry_after=None):
+        super().__init__(f"{provider} returned HTTP {status_code}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class CircuitOpenError(Exception):
+    """A provider's circuit breaker is open, so the call was not attempted"""
+
+def parse_retry_after(headers):
+    """Get the wait in seconds requested by Retry-After (or retry-after-ms) headers, if any"""
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        # HTTP-date form
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(retry_at.timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+def raise_for_response(provider, response):
+    """Raise ProviderError unless the response is a 200"""
+    if response.status_code != 200:
+        raise ProviderError(
+            provider,
+            response.status_code,
+            response.text[:500],
+            parse_retry_after(response.headers)
+        )
+
+def classify_error(error):
+    """
+    Decide whether an error is worth retrying
+
+    Returns:
+        tuple: (retryable, is_throttle, retry_after seconds or None)
+    """
+    if isinstance(error, ProviderError):
+        status = error.status_code
+        return status in RETRYABLE_STATUSES, status in THROTTLE_STATUSES, error.retry_after
+
+    if isinstance(error, anthropic.APIStatusError):
+        status = error.status_code
+        retry_after = parse_retry_after(getattr(error.response, "headers", None))
+        return status in RETRYABLE_STATUSES, status in THROTTLE_STATUSES, retry_after
+
+    # Network problems and timeouts, from our HTTP client or the Anthropic SDK
+    if isinstance(error, (httpx.TransportError, anthropic.APIConnectionError, asyncio.TimeoutError)):
+        return True, False, None
+
+    return False, False, None
+
+def backoff_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number attempt+1: Retry-After if given, else capped exponential with full jitter"""
+    if retry_after is not None:
+        return min(retry_after, config.RETRY_MAX_DELAY)
+
+    ceiling = min(config.RETRY_BASE_DELAY * (2 ** attempt), config.RETRY_MAX_DELAY)
+    return random.uniform(0, ceiling)
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker
+
+    After failure_threshold consecutive retryable failures the circuit opens and
+    calls fail fast for reset_timeout seconds. Then a single trial call is let
+    through (half-open): success closes the circuit, failure opens it again.
+    A trial that is cancelled, or unanswered after trial_timeout seconds, makes
+    way for another one.
+    """
+
+    def __init__(self, provider, failure_threshold, reset_timeout, trial_timeout):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.trial_timeout = trial_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.trial_started_at = None
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Raise CircuitOpenError if the call must not be attempted"""
+        with self._lock:
+            if self.state == "open":
+                if time.time() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.provider} circuit is open")
+                self.state = "half_open"
+                self.trial_in_flight = False
+                logger.info(f"{self.provider} circuit half-open, sending a trial call")
+
+            if self.state == "half_open":
+                if self.trial_in_flight:
+                    if time.time() - self.trial_started_at < self.trial_timeout:
+                        self.rejected += 1
+                        raise CircuitOpenError(f"{self.provider} circuit is half-open and a trial call is running")
+                    logger.warning(f"{self.provider} trial call unanswered after {self.trial_timeout}s, sending another")
+                self.trial_in_flight = True
+                self.trial_started_at = time.time()
+
+    def release_trial(self):
+        """A call ended without an answer (e.g. it was cancelled); let the next call be the trial"""
+        with self._lock:
+            if self.state == "half_open":
+                self.trial_in_flight = False
+
+    def record_success(self):
+        """The provider answered; close the circuit"""
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"{self.provider} circuit closed")
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        """The provider failed in a way that suggests an outage"""
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.error(f"{self.provider} circuit opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.time()
+                self.trial_in_flight = False
+
+    def snapshot(self):
+        """Current state for reporting"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "rejected_calls": self.rejected,
+                "opened_at": self.opened_at
+            }
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(provider):
+    """Get the circuit breaker of a provider"""
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(
+                provider,
+                config.CIRCUIT_BREAKER["failure_threshold"],
+                config.CIRCUIT_BREAKER["reset_timeout"],
+                config.CIRCUIT_BREAKER["trial_timeout"]
+            )
+        return _breakers[provider]
+
+def get_breaker_states():
+    """Get the state of every provider's circuit breaker"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {provider: breaker.snapshot() for provider, breaker in breakers.items()}
+
+async def call_with_retry(provider, send):
+    """
+    Await send() under the provider's retry policy and circuit breaker
+
+    Retryable errors are retried up to MAX_RETRIES attempts with backoff;
+    fatal errors (e.g. 4xx other than 408/425/429) are raised immediately.
+
+    Raises:
+        CircuitOpenError: the provider's circuit is open
+        Exception: the last error, once it is fatal or retries are exhausted
+    """
+    breaker = get_breaker(provider)
+    label = PROVIDER_LABELS.get(provider, provider)
+
+    for attempt in range(config.MAX_RETRIES):
+        breaker.check()
+        counter = call_attempts.get()
+        if counter is not None:
+            counter[0] += 1
+        try:
+            result = await send()
+        except Exception as e:
+            retryable, is_throttle, retry_after = classify_error(e)
+
+            # Throttling and client errors mean the provider is up
+            if retryable and not is_throttle:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+            if not retryable or attempt + 1 >= config.MAX_RETRIES:
+                logger.error(f"{label} error (attempt {attempt+1}, giving up): {str(e)}")
+                raise
+
+            delay = backoff_delay(attempt, retry_after)
+            logger.warning(f"{label} error (attempt {attempt+1}, retrying in {delay:.1f}s): {str(e)}")
+            await asyncio.sleep(delay)
+        except BaseException:
+            # Cancelled (asyncio.CancelledError is not an Exception): no verdict on the provider
+            breaker.release_trial()
+            raise
+        else:
+            breaker.record_success()
+            return result
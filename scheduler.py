@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+
+# Import local modules
+import config
+import database as db
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+# Single-image tasks keep a user waiting; bulk tasks run in the background
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BACKGROUND)
+
+def lane_of(task_type):
+    """Scheduling lane of a task type"""
+    return INTERACTIVE if task_type == 'single' else BACKGROUND
+
+def tier_settings(tier):
+    """Weight and concurrency cap of a user tier (unknown tiers get DEFAULT_USER_TIER's)"""
+    return config.USER_TIERS.get(tier) or config.USER_TIERS[config.DEFAULT_USER_TIER]
+
+class DeficitRoundRobin:
+    """
+    Weighted deficit round-robin over per-user queues
+
+    Users take turns in a fixed order. At the start of its turn a user is
+    credited its quantum (SCHEDULER_QUANTUM times its tier weight, in images)
+    and is served while the task at the head of its queue costs no more than
+    its credit. Over time every waiting user gets a share of the processed
+    images proportional to its weight, however many tasks it has queued.
+    """
+
+    def __init__(self):
+        self.order = []
+        self.deficits = {}
+        self.in_turn = None
+
+    def choose(self, queues):
+        """
+        Pick the user to serve next
+
+        Args:
+            queues (dict): user id -> (quantum, cost of the task at the head of its queue)
+
+        Returns:
+            The chosen user id, or None if queues is empty
+        """
+        # Users whose queue emptied leave the rotation and lose their credit
+        self.order = [user for user in self.order if user in queues]
+        self.order.extend(user for user in queues if user not in self.order)
+        self.deficits = {user: credit for user, credit in self.deficits.items() if user in queues}
+        if self.in_turn not in queues:
+            self.in_turn = None
+
+        while self.order:
+            user = self.order[0]
+            quantum, cost = queues[user]
+            if self.in_turn != user:
+                self.deficits[user] = self.deficits.get(user, 0) + quantum
+                self.in_turn = user
+
+            if cost <= self.deficits[user]:
+                self.deficits[user] -= cost
+                return user
+
+            # Not enough credit left: the turn passes to the next user
+            self.order.append(self.order.pop(0))
+            self.in_turn = None
+
+        return None
+
+# One rotation per lane for this process's workers
+_rotations = {lane: DeficitRoundRobin() for lane in LANES}
+_rotations_lock = threading.Lock()
+
+def priority(candidate, now=None):
+    """
+    Effective priority of a task waiting for a worker
+
+    The lane's base priority plus one point per SCHEDULER_AGING_SECONDS spent
+    waiting, so a bulk task that has waited long enough outranks fresh
+    interactive ones and is never starved.
+    """
+    if now is None:
+        now = time.time()
+    waited = max(now - candidate['queued_at'], 0)
+    return config.SCHEDULER_LANE_PRIORITY[lane_of(candidate['task_type'])] + waited / config.SCHEDULER_AGING_SECONDS
+
+def _is_capped(candidate, running):
+    """Check whether starting this background task would exceed its user's max_tasks"""
+    if lane_of(candidate['task_type']) == INTERACTIVE:
+        return False
+    user_tasks = running.get(candidate['user_id'], set())
+    if candidate['task_id'] in user_tasks:
+        return False  # Joining a task already running starts nothing new
+    return len(user_tasks) >= tier_settings(candidate['tier'])['max_tasks']
+
+def pick_task(candidates, allow_background=True, running=None, now=None):
+    """
+    Choose the task a free worker should process next
+
+    The lane comes from the highest priority waiting task (see priority); within
+    the lane, users are served by weighted deficit round-robin, each user's
+    oldest task first.
+
+    Args:
+        candidates (list): Tasks with pending work, as returned by db.get_schedulable_tasks
+        allow_background (bool): False while the worker pool has no capacity left
+            for background work beyond what is reserved for interactive tasks
+        running (dict): user id -> IDs of that user's tasks being processed
+
+    Returns:
+        dict: The chosen candidate, or None
+    """
+    running = running or {}
+    candidates = [
+        c for c in candidates
+        if (allow_background or lane_of(c['task_type']) == INTERACTIVE) and not _is_capped(c, running)
+    ]
+    if not candidates:
+        return None
+
+    if now is None:
+        now = time.time()
+    # Highest priority first; among equals the task queued first
+    def rank(c):
+        return (priority(c, now), -c['queued_at'])
+    lane = lane_of(max(candidates, key=rank)['task_type'])
+
+    heads = {}
+    for candidate in candidates:
+        if lane_of(candidate['task_type']) != lane:
+            continue
+        head = heads.get(candidate['user_id'])
+        if head is None or rank(candidate) > rank(head):
+            heads[candidate['user_id']] = candidate
+
+    queues = {
+        user_id: (config.SCHEDULER_QUANTUM * tier_settings(head['tier'])['weight'], head['pending'])
+        for user_id, head in heads.items()
+    }
+    with _rotations_lock:
+        user_id = _rotations[lane].choose(queues)
+    return heads[user_id]
+
+def get_lane_stats(candidates=None):
+    """Get the number of waiting tasks and the longest wait (seconds) per lane"""
+    if candidates is None:
+        candidates = db.get_schedulable_tasks()
+
+    now = time.time()
+    stats = {lane: {"queued_tasks": 0, "longest_wait": 0.0} for lane in LANES}
+    for candidate in candidates:
+        lane = stats[lane_of(candidate['task_type'])]
+        lane["queued_tasks"] += 1
+        lane["longest_wait"] = max(lane["longest_wait"], round(now - candidate['queued_at'], 1))
+    return stats
+
+def get_fair_share_stats(window=None):
+    """
+    Get each user's share of the images processed in the last window seconds next to its fair share
+
+    A user's fair share is its tier weight over the total weight of the users
+    that processed or waited for images in the window.
+
+    Returns:
+        pd.DataFrame: user_id, username, tier, weight, images_done, share, fair_share,
+                      running_tasks and queued_tasks per user
+    """
+    throughput_df = db.get_user_throughput(time.time() - (window or config.FAIR_SHARE_WINDOW))
+    if throughput_df.empty:
+        return throughput_df
+
+    throughput_df['weight'] = [tier_settings(tier)['weight'] for tier in throughput_df['tier']]
+    total_done = throughput_df['images_done'].sum()
+    throughput_df['share'] = throughput_df['images_done'] / total_done if total_done else 0.0
+    throughput_df['fair_share'] = throughput_df['weight'] / throughput_df['weight'].sum()
+    return throughput_df[[
+        'user_id', 'username', 'tier', 'weight', 'images_done', 'share', 'fair_share', 'running_tasks', 'queued_tasks'
+    ]]
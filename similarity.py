@@ -0,0 +1,157 @@
+import io
+import logging
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Import local modules
+import config
+import database as db
+
+# Get logger
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+
+def dhash(image):
+    """
+    Perceptual difference hash of an image (file path or bytes), as a 64-bit integer
+
+    The image is reduced to a 9x8 grayscale thumbnail and each bit records
+    whether a pixel is brighter than its right-hand neighbour, so small changes
+    in exposure, framing or compression barely move the hash.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = io.BytesIO(image)
+
+    with Image.open(image) as img:
+        img.draft('L', (64, 64))  # JPEGs decode straight to a small grayscale image
+        return dhash_image(img)
+
+def dhash_image(img):
+    """Same as dhash, for an image that is already decoded"""
+    pixels = np.asarray(img.convert('L').resize((9, 8), Image.LANCZOS), dtype=np.int16)
+
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming(a, b):
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count('1')
+
+def max_distance(threshold=None):
+    """Largest Hamming distance that still counts as the same picture"""
+    if threshold is None:
+        threshold = config.PHASH_SIMILARITY_THRESHOLD
+    return int((1 - threshold) * HASH_BITS)
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance
+
+    Each child edge is labelled with its distance to the parent, so a search
+    only descends into edges within max_distance of the query's own distance.
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, values, {distance: child}]
+        self.size = 0
+
+    def add(self, value_hash, value):
+        """Index value under value_hash"""
+        self.size += 1
+        if self.root is None:
+            self.root = [value_hash, [value], {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming(value_hash, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value_hash, [value], {}]
+                return
+            node = child
+
+    def search(self, query_hash, max_distance):
+        """Get (distance, value) pairs within max_distance of query_hash, nearest first"""
+        matches = []
+        nodes = [self.root] if self.root is not None else []
+
+        while nodes:
+            node = nodes.pop()
+            distance = hamming(query_hash, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, value) for value in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    nodes.append(child)
+
+        return sorted(matches, key=lambda match: match[0])
+
+def cluster(hashes, distance):
+    """
+    Group hashes that are within distance of each other
+
+    Each hash joins the group of the nearest earlier representative, or starts a
+    new group. Missing hashes (None) always form their own group.
+
+    Returns:
+        list: Position of each hash's group representative (its own position for representatives)
+    """
+    representatives = BKTree()
+    groups = []
+
+    for position, value_hash in enumerate(hashes):
+        matches = representatives.search(value_hash, distance) if value_hash is not None else []
+        if matches:
+            groups.append(matches[0][1])
+        else:
+            if value_hash is not None:
+                representatives.add(value_hash, position)
+            groups.append(position)
+
+    return groups
+
+# Process-wide index of processed images: perceptual hash -> content hash
+_index = BKTree()
+_index_lock = threading.Lock()
+_last_hash_seq = 0
+_stats = {"lookups": 0, "near_duplicate_hits": 0}
+
+def _refresh_index():
+    """Add images hashed since the last refresh, including those from other worker processes"""
+    global _last_hash_seq
+
+    # Images finish out of id order, so follow the order their hashes were written in
+    rows = db.get_hashed_images(_last_hash_seq)
+    for hash_seq, phash, content_hash in rows:
+        _index.add(int(phash, 16), content_hash)
+        _last_hash_seq = max(_last_hash_seq, hash_seq)
+
+def find_similar(phash):
+    """
+    Get content hashes of earlier images that look like the same picture
+
+    Returns:
+        list: (distance, content hash) pairs, nearest first
+    """
+    with _index_lock:
+        _refresh_index()
+        return _index.search(phash, max_distance())
+
+def record_lookup(hit):
+    """Count a near-duplicate lookup and whether it found reusable results"""
+    with _index_lock:
+        _stats["lookups"] += 1
+        if hit:
+            _stats["near_duplicate_hits"] += 1
+
+def get_similarity_stats():
+    """Get the index size and near-duplicate lookup counters of this process"""
+    with _index_lock:
+        return dict(_stats, indexed_images=_index.size)
@@ -1,15 +1,27 @@
 import streamlit as st
+import altair as alt
 from PIL import Image
 import os
-import time
-import io
 import sqlite3
 import pandas as pd
 
 # Import local modules
 import database as db
 import processing
+import events
+import ingestion
+import metrics
+import analysis_memo
+import clients
+import cpu_pool
+import ratelimit
+import result_cache
+import retry
+import scheduler
+import similarity
+import reports
 import config
+import utils
 
 def login_page():
     """Render the login/registration page with proper width and centering"""
@@ -374,6 +386,7 @@ def home_page():
                         if not images_df.empty:
                             # Always display results header
                             st.subheader("Results")
+                            grouping = reports.duplicate_labels(images_df)
                             
                             # Mobile-first approach: on mobile devices, stack images and analysis
                             for i, img in enumerate(images_df.itertuples()):
@@ -392,6 +405,8 @@ def home_page():
                                             # Use container_width instead of column_width
                                             st.image(image, use_container_width=True)
                                             st.write(f"**Description:** {img.description if img.description else 'None'}")
+                                            if grouping[i]:
+                                                st.caption(grouping[i])
                                         else:
                                             st.warning("Image file not found. It may have been deleted.")
                                     except Exception as e:
@@ -556,7 +571,7 @@ def admin_page():
         # Get all users
         conn = sqlite3.connect(config.DATABASE_PATH)
         users_df = pd.read_sql_query(
-            "SELECT id, username, image_quota, images_processed, is_admin FROM users ORDER BY username",
+            "SELECT id, username, image_quota, images_processed, is_admin, tier FROM users ORDER BY username",
             conn
         )
         conn.close()
@@ -617,6 +632,51 @@ def admin_page():
                         st.rerun()
                     else:
                         st.error("Failed to reset usage")
+            
+            # Scheduling tier: share of the workers and concurrent bulk tasks
+            st.subheader("Update User Tier")
+            
+            col1, col2, col3 = st.columns([2, 1, 1])
+            
+            with col1:
+                tier_user = st.selectbox(
+                    "Select User", 
+                    options=users_df['id'].tolist(),
+                    format_func=lambda x: f"{users_df[users_df['id'] == x]['username'].iloc[0]} (ID: {x})",
+                    key="tier_user_select"
+                )
+            
+            with col2:
+                tiers = list(config.USER_TIERS)
+                current_tier = users_df[users_df['id'] == tier_user]['tier'].iloc[0]
+                new_tier = st.selectbox(
+                    "New Tier",
+                    options=tiers,
+                    index=tiers.index(current_tier) if current_tier in tiers else tiers.index(config.DEFAULT_USER_TIER),
+                    format_func=lambda t: f"{t} (weight {config.USER_TIERS[t]['weight']}, {config.USER_TIERS[t]['max_tasks']} tasks)"
+                )
+            
+            with col3:
+                st.write("")  # Spacing
+                st.write("")  # Spacing
+                if st.button("Update Tier", use_container_width=True):
+                    if db.update_user_tier(tier_user, new_tier):
+                        st.success(f"Updated tier for user ID {tier_user} to {new_tier}")
+                        st.rerun()
+                    else:
+                        st.error("Failed to update tier")
+        
+        # Throughput share over the recent window against each user's weighted fair share
+        st.subheader("Throughput Share")
+        share_df = scheduler.get_fair_share_stats()
+        if share_df.empty:
+            st.info(f"No images processed in the last {config.FAIR_SHARE_WINDOW // 60} minutes.")
+        else:
+            st.caption(f"Images processed in the last {config.FAIR_SHARE_WINDOW // 60} minutes")
+            share_df = share_df.drop(columns=['user_id'])
+            share_df['share'] = share_df['share'].map("{:.0%}".format)
+            share_df['fair_share'] = share_df['fair_share'].map("{:.0%}".format)
+            st.dataframe(share_df, use_container_width=True)
     
     with tab2:
         st.header("System Settings")
@@ -653,7 +713,84 @@ def admin_page():
                 st.success(f"Updated default user quota to {new_default_quota}")
             else:
                 st.error("Failed to update setting")
-    
+
+        # Task worker pool status
+        st.subheader("Task Workers")
+        worker_stats = processing.get_worker_stats()
+
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Live Workers", f"{worker_stats['live_workers']} / {worker_stats['worker_count']}")
+        col2.metric("Utilization", f"{worker_stats['utilization']:.0%}")
+        col3.metric("Queued Tasks", worker_stats["queue_depth"])
+        col4.metric("Restarts", worker_stats["restarts"])
+
+        st.caption("Waiting tasks: " + ", ".join(
+            f"{lane} {stats['queued_tasks']} (longest wait {stats['longest_wait']:.0f}s)"
+            for lane, stats in worker_stats["lanes"].items()
+        ))
+        work_items = worker_stats["work_items"]
+        st.caption(
+            "Queued images: " + ", ".join(f"{count} {status}" for status, count in sorted(work_items.items()))
+            if work_items else "Queued images: none"
+        )
+        if worker_stats["peak_memory_mb"] is not None:
+            st.caption(f"Peak memory of this process: {worker_stats['peak_memory_mb']:.0f} MB")
+        cpu_stats = cpu_pool.get_cpu_pool_stats()
+        st.caption(
+            f"CPU pool: {cpu_stats['processes']} processes, {cpu_stats['completed']} image jobs done, "
+            f"{cpu_stats['failed']} failed, {cpu_stats['inline']} run inline, {cpu_stats['restarts']} restarts"
+        )
+
+        if not config.EMBEDDED_WORKERS:
+            st.info("Task workers run in a separate worker process; only the shared queue is shown here.")
+        elif not worker_stats["supervisor_alive"]:
+            st.warning("Worker supervisor is not running.")
+
+        if worker_stats["workers"]:
+            st.dataframe(pd.DataFrame(worker_stats["workers"]), use_container_width=True)
+
+        if worker_stats["dead_workers"]:
+            st.write("Replaced workers")
+            st.dataframe(pd.DataFrame(worker_stats["dead_workers"]), use_container_width=True)
+
+        # Connection reuse of the shared API clients
+        pool_stats = clients.get_pool_stats()
+        if pool_stats:
+            st.write("API connection pools")
+            st.dataframe(pd.DataFrame(pool_stats).T, use_container_width=True)
+
+        # Content-addressed result cache
+        cache_totals = db.get_result_cache_stats()
+        st.write(
+            f"Result cache: {cache_totals['entries']} entries, "
+            f"{cache_totals['size_bytes'] / (1024 * 1024):.1f} MB, {cache_totals['hits']} hits in total"
+        )
+        st.dataframe(pd.DataFrame(result_cache.get_cache_stats()).T, use_container_width=True)
+
+        memo_totals = db.get_claude_memo_stats()
+        memo_stats = analysis_memo.get_memo_stats()
+        st.caption(
+            f"Claude analysis memo: {memo_totals['entries']} entries, {memo_totals['hits']} hits in total; "
+            f"this process: {memo_stats['hits']} hits, {memo_stats['misses']} misses"
+        )
+
+        similarity_stats = similarity.get_similarity_stats()
+        st.caption(
+            f"Near-duplicate lookups: {similarity_stats['near_duplicate_hits']} of "
+            f"{similarity_stats['lookups']} reused SearchAPI results "
+            f"({similarity_stats['indexed_images']} images indexed)"
+        )
+
+        rate_limit_stats = ratelimit.get_rate_limit_stats()
+        if rate_limit_stats:
+            st.write(f"Rate limiting ({config.RATE_LIMIT_BACKEND} buckets)")
+            st.dataframe(pd.DataFrame(rate_limit_stats).T, use_container_width=True)
+
+        breaker_states = retry.get_breaker_states()
+        if breaker_states:
+            st.write("Provider circuit breakers")
+            st.dataframe(pd.DataFrame(breaker_states).T, use_container_width=True)
+
     with tab3:
         st.header("Task Management")
         
@@ -751,7 +888,39 @@ def admin_page():
                         st.rerun()
                     else:
                         st.error("Failed to cancel task")
-            
+
+            # Resume task: images continue after their last completed stage
+            st.write("Resume Task")
+            col1, col2 = st.columns([3, 1])
+
+            with col1:
+                resume_task_id = st.selectbox(
+                    "Select Failed or Stuck Task to Resume",
+                    options=filtered_df[filtered_df['status'].isin(
+                        ['failed', 'pending', 'processing', 'finalizing', 'needs_review', 'partially_processed']
+                    )]['id'].tolist(),
+                    format_func=lambda x: f"ID: {x} - {filtered_df[filtered_df['id'] == x]['task_name'].iloc[0]} ({filtered_df[filtered_df['id'] == x]['status'].iloc[0]})",
+                    key="admin_resume_task_select"
+                )
+                if resume_task_id is not None:
+                    stage_counts = db.get_task_stage_counts(resume_task_id)
+                    st.caption(
+                        "Images by stage: " + ", ".join(
+                            f"{stage_counts[stage]} {stage}"
+                            for stage in db.IMAGE_STAGES + ('failed',) if stage in stage_counts
+                        )
+                    )
+
+            with col2:
+                st.write("")  # Spacing
+                if st.button("Resume Task", key="admin_resume", disabled=resume_task_id is None):
+                    try:
+                        count = processing.resume_task(resume_task_id)
+                        st.success(f"Task {resume_task_id} resumed: {count} images queued again")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Failed to resume task: {e}")
+
             # Delete task
             st.write("Delete Task")
             col1, col2 = st.columns([3, 1])
@@ -772,6 +941,46 @@ def admin_page():
                         st.rerun()
                     else:
                         st.error("Failed to delete task")
+
+            # Where a task's time went, image by image
+            st.subheader("Task Waterfall")
+            waterfall_task_id = st.selectbox(
+                "Select Task",
+                options=filtered_df['id'].tolist(),
+                format_func=lambda x: f"ID: {x} - {filtered_df[filtered_df['id'] == x]['task_name'].iloc[0]} ({filtered_df[filtered_df['id'] == x]['status'].iloc[0]})",
+                key="admin_waterfall_task_select"
+            )
+            waterfall_df = metrics.get_task_waterfall(waterfall_task_id) if waterfall_task_id is not None else pd.DataFrame()
+            if waterfall_df.empty:
+                st.info("No stage timings recorded for this task.")
+            else:
+                chart = alt.Chart(waterfall_df).mark_bar().encode(
+                    x=alt.X("start:Q", title="Seconds since the task started"),
+                    x2="end:Q",
+                    y=alt.Y("image:N", sort=None, title=None),
+                    color=alt.Color("stage:N", sort=list(metrics.STAGES)),
+                    opacity=alt.condition(alt.datum.outcome == "skipped", alt.value(0.3), alt.value(1.0)),
+                    tooltip=["image", "stage", "outcome", "attempts", "bytes", alt.Tooltip("duration:Q", format=".2f")]
+                )
+                st.altair_chart(chart, use_container_width=True)
+                st.caption(
+                    "Total time by stage: " + ", ".join(
+                        f"{stage} {duration:.1f}s"
+                        for stage, duration in waterfall_df.groupby('stage')['duration'].sum().items()
+                    )
+                )
+        
+        # Latency of each stage across all tasks
+        st.subheader("Stage Latency")
+        window_label = st.selectbox("Window", options=list(config.STAGE_METRICS_WINDOWS), key="stage_latency_window")
+        window = config.STAGE_METRICS_WINDOWS[window_label]
+        percentiles_df = metrics.get_stage_percentiles(window)
+        if percentiles_df.empty:
+            st.info("No stage timings recorded in this window.")
+        else:
+            st.dataframe(percentiles_df.round({"p50": 2, "p95": 2, "p99": 2}), use_container_width=True)
+            st.caption("p95 latency (seconds) over the window")
+            st.line_chart(metrics.get_stage_trend(window))
     
     with tab4:
         st.header("Admin Access Management")
@@ -1012,11 +1221,9 @@ def display_task_history():
                     results_table = []
                     for _, img in images_df.iterrows():
                         try:
-                            image = Image.open(img['image_path'])
-                            # Convert PIL image to bytes for st.image
-                            img_byte_arr = io.BytesIO()
-                            image.save(img_byte_arr, format=image.format if image.format else 'JPEG')
-                            img_byte_arr = img_byte_arr.getvalue()
+                            # The thumbnail is shown at 200px; no need to decode the master
+                            with open(utils.preview_path(img['image_path'], img['thumbnail_path']), 'rb') as image_file:
+                                img_byte_arr = image_file.read()
                             
                             # Create a row for the table
                             results_table.append({
@@ -1060,6 +1267,39 @@ def display_task_history():
         # Close the container
         st.markdown('</div>', unsafe_allow_html=True)
 
+# What a single-image task is doing once its image reaches each stage
+STAGE_MESSAGES = {
+    "uploaded": "Searching for matching items...",
+    "searched": "Analysing search results...",
+    "analyzed": "Finishing up...",
+}
+
+def wait_for_single_task(task_id):
+    """Show a single-image task's progress until it finishes, woken by the workers' events"""
+    progress = st.empty()
+    
+    def show_progress(event):
+        if event['kind'] == 'image':
+            message = STAGE_MESSAGES.get(event['stage'])
+        elif event['kind'] == 'stages':
+            # Progress read from the database when the workers run in another process
+            reached = [stage for stage in db.IMAGE_STAGES if event['stages'].get(stage)]
+            message = STAGE_MESSAGES.get(reached[-1]) if reached else None
+        else:
+            message = None
+        if message:
+            progress.caption(message)
+    
+    with st.spinner("Processing image..."):
+        status = events.wait_for_task(task_id, on_progress=show_progress)
+    progress.empty()
+    
+    if status == 'failed':
+        st.error("Processing failed")
+    elif status == 'cancelled':
+        st.warning("Processing was cancelled")
+    return status
+
 def single_upload_page():
     """Render the improved single upload page with better camera controls and mobile responsiveness"""
     st.title("Single Upload")
@@ -1215,17 +1455,7 @@ def single_upload_page():
                     st.success(f"Image submitted for processing (Task #{task_id})")
                     
                     # Wait for processing to complete
-                    with st.spinner("Processing image..."):
-                        while True:
-                            status = db.get_task_status(task_id)
-                            
-                            if status == 'completed':
-                                break
-                            elif status == 'failed':
-                                st.error("Processing failed")
-                                break
-                            
-                            time.sleep(2)
+                    wait_for_single_task(task_id)
                     
                     # Display results
                     images_df = db.get_image_analysis(task_id)
@@ -1298,17 +1528,7 @@ def single_upload_page():
                     st.success(f"Image submitted for processing (Task #{task_id})")
                     
                     # Wait for processing to complete
-                    with st.spinner("Processing image..."):
-                        while True:
-                            status = db.get_task_status(task_id)
-                            
-                            if status == 'completed':
-                                break
-                            elif status == 'failed':
-                                st.error("Processing failed")
-                                break
-                            
-                            time.sleep(2)
+                    wait_for_single_task(task_id)
                     
                     # Display results
                     images_df = db.get_image_analysis(task_id)
@@ -1587,11 +1807,9 @@ def bulk_upload_page():
                 import base64
                 import io
                 
-                # Open image and convert to base64 for HTML
-                image = Image.open(img["path"])
-                buffered = io.BytesIO()
-                image.save(buffered, format="JPEG")
-                img_str = base64.b64encode(buffered.getvalue()).decode()
+                # Embed the ingestion thumbnail as base64 for HTML
+                with open(utils.preview_path(img["path"], img.get("thumbnail_path")), "rb") as image_file:
+                    img_str = base64.b64encode(image_file.read()).decode()
                 
                 # Create HTML for this image item
                 caption = img["description"] if img["description"] else ""
@@ -1607,6 +1825,20 @@ def bulk_upload_page():
         # Close the grid
         st.markdown(image_items_html + "</div>", unsafe_allow_html=True)
         
+        # Point out photos of the same item; each group is analyzed once
+        if config.BULK_DEDUP_ENABLED and len(st.session_state.current_task_images) > 1:
+            _, groups = processing.group_duplicate_images(
+                [img["path"] for img in st.session_state.current_task_images],
+                [img.get("phash") for img in st.session_state.current_task_images]
+            )
+            for representative in sorted(set(groups)):
+                members = [i + 1 for i, group in enumerate(groups) if group == representative]
+                if len(members) > 1:
+                    st.info(
+                        f"Images {', '.join(f'#{m}' for m in members)} look like the same item "
+                        "and will be analyzed once."
+                    )
+        
         # Display remove buttons with individual keys
         st.markdown("<h4>Remove Images</h4>", unsafe_allow_html=True)
         
@@ -1623,10 +1855,7 @@ def bulk_upload_page():
                     with cols[col]:
                         if st.button(f"Remove #{idx+1}", key=f"remove_{img['id']}", help=f"Remove {img['description'] or 'Untitled'}"):
                             # Remove image from list and file system
-                            try:
-                                os.remove(img["path"])
-                            except:
-                                pass
+                            ingestion.remove_image_files(img["path"])
                             st.session_state.current_task_images.pop(idx)
                             st.rerun()
         
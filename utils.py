@@ -4,6 +4,8 @@ import base64
 from PIL import Image
 import json
 
+import config
+
 def ensure_directories():
     """Ensure all required directories exist"""
     directories = ["uploaded_images", "reports"]
@@ -64,6 +66,12 @@ def is_valid_image(file_extension):
     valid_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
     return file_extension in valid_extensions
 
+def preview_path(image_path, thumbnail_path=None):
+    """The thumbnail written at ingestion if there is one, else the image itself (older uploads)"""
+    if isinstance(thumbnail_path, str) and os.path.exists(thumbnail_path):
+        return thumbnail_path
+    return image_path
+
 def image_to_base64(image_path):
     """Convert an image file to base64 encoding"""
     try:
@@ -133,6 +141,9 @@ def get_mime_type(file_extension):
 def validate_api_keys(api_keys):
     """Validate API keys are properly set"""
     for key, value in api_keys.items():
+        # Self-hosted images never go to ImgBB
+        if key == 'IMGBB_API_KEY' and config.IMAGE_HOST_BACKEND != 'imgbb':
+            continue
         if not value or value == 'your_api_key_here':
             return False, f"Missing or invalid API key: {key}"
     return True, "All API keys are valid"
\ No newline at end of file